@@ -1,181 +1,534 @@
 # Helper functions for app
 import streamlit as st
-import pandas as pd
+import functools
 import numpy as np
-import gzip
-
-from datetime import datetime
-from urllib.request import urlopen
+import pandas as pd
 
-import requests
-from imdb import Cinemagoer
-from PIL import Image
-from io import BytesIO
+import pipeline
+import instrumentation
+import snapshot_manager
+import telemetry
+import warmer
+from config import CACHE_MAX_MB, COVER_MODE, DATA_DIR, ENGINE, IMDB_USER_ID, STARTUP_WORKERS
+from cache import cached_summary, hash_value, share, versioned, versioned_summary
+from instrumentation import instrumented_cache
+from covers import cover_html, fetch_covers, fetch_cover_url, POSTER_SIZE, STILL_SIZE
 
-# Flow is as follows:
-# 1. Download IMBD datasets (just once!)
-# 2. Get all content depending on choice in order to normalise its scores
-# 3. Show all or rated or unrated
+# The scoring logic lives in pipeline.py so that it can run without Streamlit
+# (see watch_next_cli.py). The functions below only add Streamlit caching.
 
 # TO-DO: Compute series with combined metric
 
+# Tables of a session, as named in the startup stages (see startup_stages)
+STARTUP_TABLES = ['all_titles', 'imdb_episodes', 'episode_index', 'films', 'series']
+
+# Resources of a dataset version (read-only, shared between sessions) are kept for
+# the live snapshot and the previous one, still used by older sessions (see snapshot_manager.py)
+SNAPSHOT_ENTRIES = 2
+
+# Stages of the pandas engine are keyed by the dataset version (and small
+# arguments) instead of hashing their DataFrames on every rerun: see cache.versioned
+
 # Download latest IMDB datasets
-@st.cache_data(show_spinner=False)  # Run only once (when session begins)
-def unzip_and_load_datasets():
+@instrumented_cache(versioned())  # Run only once per dataset version
+def unzip_and_load_datasets(version, data_dir=None):
+    return pipeline.unzip_and_load_datasets(data_dir)
+
+# Get ratings and votes for each title
+@instrumented_cache(versioned())
+def merge_ratings(version, _df_imdb_titles, _df_imdb_ratings):
+    return pipeline.merge_ratings(_df_imdb_titles, _df_imdb_ratings)
+
+# Get episode info
+@instrumented_cache(versioned())
+def merge_episode_info(version, _df_imdb_episodes, _df_imdb_titles):
+    return pipeline.merge_episode_info(_df_imdb_episodes, _df_imdb_titles)
+
+@instrumented_cache(versioned())
+def normalise_content(version, _df, content_type):
+    return pipeline.normalise_content(_df, content_type)
+
+@instrumented_cache(versioned())
+def calculate_episode_metric(version, _df_imdb_episodes):
+    return pipeline.calculate_episode_metric(_df_imdb_episodes)
+
+@instrumented_cache(versioned())
+def calculate_runtime_metric(version, _df_imdb_episodes):
+    return pipeline.calculate_runtime_metric(_df_imdb_episodes)
+
+@instrumented_cache(versioned())
+def calculate_combined_metric(version, _df_series_score, _df_episode_score, _df_runtime_score):
+    return pipeline.calculate_combined_metric(_df_series_score, _df_episode_score, _df_runtime_score)
+
+# All score tables of a dataset version at once, with another engine than pandas (see config.ENGINE)
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))    # Read-only, shared between sessions
+def compute_score_tables(version, data_dir, engine):
+    return pipeline.compute_score_tables(data_dir, engine)
+
+# Freed with the other resources of a version that no session uses any more
+snapshot_manager.on_free(lambda version: compute_score_tables.clear(version, DATA_DIR, ENGINE))
+
+# Not cached: mapping the published files takes milliseconds and their pages are shared anyway
+def attach_shared_tables(version):
+
+    import shared_tables
+
+    return shared_tables.attach(version)
+
+def publish_shared_tables(version, tables):
+
+    import shared_tables
+
+    # Sharing is an optimisation: on failure (e.g. read-only disk) every process keeps its own copy
+    try:
+        shared_tables.publish(tables, version)
+    except (OSError, ValueError, TypeError) as error:
+        instrumentation.log_event('publish_shared_tables', kind='error', error=str(error))
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))
+def build_episode_index(version, _titles, _episodes):
+    return pipeline.build_episode_index(_titles, _episodes)
+
+def get_new_episodes(episode_index, df_user_ratings):
+    return pipeline.get_new_episodes(episode_index, df_user_ratings)
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))
+def build_personalised_index(version, _df_films, _df_series):
+
+    # scipy is only needed for personalised rankings
+    import personalised
+
+    df_candidates = pipeline.candidate_titles(_df_films, _df_series)
+    matrix, _ = personalised.build_feature_matrix(df_candidates)
+
+    return df_candidates, matrix
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))
+def load_similar_titles_index(version, _df_films, _df_series):
+
+    '''
+    Nearest-neighbour index of the snapshot (keyed by version only, the tables are not hashed).
+    '''
+
+    import similar_titles
+
+    df_candidates = pipeline.candidate_titles(_df_films, _df_series)
+
+    # Built offline by `watch_next_cli.py precompute`, otherwise built now and saved with the snapshot
+    index = similar_titles.load_index(version)
+    if index is None:
+        index = similar_titles.build_index(df_candidates)
+        similar_titles.save_index(index, version)
+
+    return index, df_candidates.drop(columns='genres')
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))
+def load_title_search_index(version, _all_titles):
+
+    '''
+    Title search index of the snapshot (keyed by version only, the table is not hashed).
+    '''
+
+    import title_search
+
+    # Built offline by `watch_next_cli.py precompute`, otherwise built now and saved with the snapshot
+    index = title_search.load_index(version)
+    if index is None:
+        index = title_search.build_index(_all_titles)
+        title_search.save_index(index, version)
+
+    return index
+
+def search_titles(query, num_titles=10):
+
+    '''
+    Titles of this session's tables whose name best matches query (see title_search.search).
+    '''
+
+    import title_search
+
+    index = load_title_search_index(st.session_state['dataset_version'], st.session_state['all_titles'])
+
+    return title_search.search_titles(index, st.session_state['all_titles'], query, num_titles)
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=SNAPSHOT_ENTRIES))
+def connect_score_tables(version, _tables):
+
+    '''
+    SQL connection to the score tables of the snapshot (keyed by version only, the tables are not hashed).
+    '''
+
+    import queries
+
+    # Exported offline by `watch_next_cli.py precompute`, otherwise exported now
+    if not queries.has_tables(version):
+        queries.export_tables(_tables, version)
+
+    return queries.connect(version)
+
+def run_named_query(name, **params):
+
+    '''
+    Run a named query (see queries.QUERIES) on the score tables of this session.
+    '''
+
+    import queries
+
+    tables = {key: st.session_state[key] for key in ['films', 'series', 'episode_index']}
+    connection = connect_score_tables(st.session_state['dataset_version'], tables)
+
+    return queries.run_named_query(connection, name, params, df_user_ratings=st.session_state['user_ratings'])
+
+@instrumented_cache(st.cache_resource(show_spinner=False, max_entries=2*SNAPSHOT_ENTRIES))   # Films and series
+def load_facet_index(version, table, _df):
 
     '''
-    Based on https://stackoverflow.com/questions/18146389/urlopen-trouble-while-trying-to-download-a-gzip-file
+    Facet bitmaps of a score table of the snapshot (keyed by version and table only, the table is not hashed).
     '''
 
-    data_urls = {
-        'title_basics': 'https://datasets.imdbws.com/title.basics.tsv.gz',
-        'title_ratings': 'https://datasets.imdbws.com/title.ratings.tsv.gz',
-        'title_episode': 'https://datasets.imdbws.com/title.episode.tsv.gz'
+    import facets
+
+    return facets.build_index(_df, table)
+
+# Bitmaps of the other filters of the panels: computing them scans the whole table,
+# so they are kept per version and table (and ratings or maximum runtime)
+@instrumented_cache(versioned())
+def unwatched_bitmap(version, table, ratings_hash, _index, _watched_tconst):
+
+    import facets
+
+    return facets.unwatched_bitmap(_index, _watched_tconst)
+
+@instrumented_cache(versioned())
+def max_runtime_bitmap(version, table, max_minutes, _index):
+
+    import facets
+
+    return facets.max_runtime_bitmap(_index, max_minutes)
+
+def select_facets(table):
+
+    '''
+    Let the user pick values of every facet of a table ('films' or 'series'), and return them ({facet: [values]}).
+    '''
+
+    import facets
+
+    index = load_facet_index(st.session_state['dataset_version'], table, st.session_state[table])
+
+    selected = {}
+    with st.expander('Filters'):
+        for facet, column in zip(facets.FACETS, st.columns(len(facets.FACETS))):
+            selected[facet] = column.multiselect(
+                label=facets.FACET_LABELS[facet],
+                options=facets.facet_options(index, facet),
+                key='{}_{}'.format(table, facet)
+            )
+
+    return selected
+
+def top_titles(table, selected, show_watched, max_minutes, num_titles, show_unfinished=True):
+
+    '''
+    Best titles of a table of this session with the selected facets (see facets.top_titles),
+    with the same filters as the top_films and top_series queries.
+    '''
+
+    import facets
+
+    version = st.session_state['dataset_version']
+    index = load_facet_index(version, table, st.session_state[table])
+
+    clauses = []
+    if not show_watched:
+        watched_tconst = st.session_state['user_ratings']['tconst']
+        clauses.append([unwatched_bitmap(version, table, hash_value(watched_tconst), index, watched_tconst)])
+    if max_minutes is not None:
+        clauses.append([max_runtime_bitmap(version, table, max_minutes, index)])
+    if not show_unfinished:
+        clauses.append([index['finished']])
+
+    return facets.top_titles(index, num_titles, selected, clauses)
+
+def startup_stages(version, data_dir, engine, tables=None):
+
+    '''
+    Return (stages, inputs) of the graph loading the data of a session (see dag.py):
+    the score tables (unless given, e.g. attached), the user ratings and the title search index.
+    '''
+
+    stages = [
+        {'name': 'Loading user ratings', 'func': get_user_ratings, 'inputs': [], 'outputs': ['user_ratings']},
+        {'name': 'Indexing titles', 'func': functools.partial(load_title_search_index, version), 'inputs': ['all_titles'], 'outputs': ['title_search_index']}
+    ]
+
+    if tables is not None:
+        inputs = {name: tables[key] for name, key in zip(STARTUP_TABLES, ['all_titles', 'episodes', 'episode_index', 'films', 'series'])}
+        return stages, inputs
+
+    if engine != 'pandas':
+        # Other engines build every table in a single (multi-threaded) plan
+        stages.append({
+            'name': 'Scoring IMDB datasets ({})'.format(engine),
+            'func': lambda: tuple(share(compute_score_tables(version, data_dir, engine)[key]) for key in ['all_titles', 'episodes', 'episode_index', 'films', 'series']),
+            'inputs': [],
+            'outputs': STARTUP_TABLES
+        })
+        return stages, {}
+
+    # Every stage of the pandas engine is cached by dataset version
+    stage_funcs = {
+        'merge_ratings': merge_ratings,
+        'merge_episode_info': merge_episode_info,
+        'normalise_content': normalise_content,
+        'calculate_episode_metric': calculate_episode_metric,
+        'calculate_runtime_metric': calculate_runtime_metric,
+        'build_episode_index': build_episode_index
     }
+    stages.append({
+        'name': 'Downloading IMDB datasets',
+        'func': functools.partial(unzip_and_load_datasets, version, data_dir),
+        'inputs': [],
+        'outputs': ['imdb_titles', 'imdb_ratings', 'imdb_episodes']
+    })
+    stages += pipeline.score_stages({name: functools.partial(func, version) for name, func in stage_funcs.items()})
 
-    datasets = []
+    return stages, {}
 
-    for key, url in data_urls.items():
-        inmemory = urlopen(url)
-        fStream = gzip.GzipFile(fileobj=inmemory, mode='rb')
-        df = pd.read_csv(fStream, sep='\t', low_memory=False)
-        datasets.append(df)
-        print('Loaded {}'.format(key))
-        # df.to_csv('IMDB_Data/{}.csv'.format(key))
+def load_session_data(version, data_dir, engine, tables=None):
 
-    return datasets
+    '''
+    Run the startup stages (independent ones at once, see startup_stages) and
+    return their results by name, listing each stage as it ends.
+    '''
 
-# Get ratings and votes for each title
-@st.cache_data(show_spinner=False)
-def merge_ratings(df_imdb_titles, df_imdb_ratings):
-    return df_imdb_titles.merge(df_imdb_ratings, on='tconst')   
+    import dag
 
-# Get episode info
-@st.cache_data(show_spinner=False)
-def merge_episode_info(df_imdb_episodes, df_imdb_titles):
-    return df_imdb_episodes.merge(df_imdb_titles[['tconst', 'runtimeMinutes', 'averageRating', 'numVotes']], on='tconst')
-
-@st.cache_data(show_spinner=False)
-def normalise_content(df, content_type):
-
-    # Remove outlier ratings
-    if content_type in ['Series', 'Films']:
-        df = df.loc[df['numVotes'] >= 5000].copy()
-
-    # Create score metric
-    df['score'] = df['averageRating'] * df['numVotes']
-    # Normalise scores in 0-10 range
-    df['score'] = 10 * (df['score'] - df['score'].min()) / (df['score'].max() - df['score'].min())
-    # Apply sigmoid function (out of 10)
-    df['score'] = 10 / (1 + np.exp(-df['score']))
-    # Score is mean of average rating and normalised metric
-    df['score'] = (df['score'] + df['averageRating']) / 2
-    df = df.sort_values('score', ascending=False)
-    df['score'] = round(df['score'], 2)
-    df.index = np.arange(1, 1+len(df))
-
-    return df
-
-@st.cache_data(show_spinner=False)
-def calculate_episode_metric(df_imdb_episodes):
-
-    # Group episodes by the series to which they belong and calculate their mean score
-    df_episode_score = df_imdb_episodes.groupby('parentTconst').agg({'score': 'mean'})
-    df_episode_score['score'] = round(df_episode_score['score'], 2)
-    df_episode_score.reset_index(inplace=True)
-
-    return df_episode_score
-
-@st.cache_data(show_spinner=False)
-def calculate_runtime_metric(df_imdb_episodes):
-
-    # Fix cases with errors runtimes
-    errors_list = df_imdb_episodes.loc[df_imdb_episodes['runtimeMinutes'].str.isnumeric() == False, 'runtimeMinutes'].unique()
-    df_runtime_errors = df_imdb_episodes.loc[df_imdb_episodes['runtimeMinutes'].isin(errors_list)]
-   
-    # If series has episodes without Nan runtimes, use mean of the series (otherwise use mean of all series)
-    df_runtime_without_errors = df_imdb_episodes[~df_imdb_episodes['runtimeMinutes'].isin(errors_list)].copy()
-    df_runtime_without_errors['runtimeMinutes'] = df_runtime_without_errors['runtimeMinutes'].astype(int)
-
-    # Mean of all episode lengths
-    mean_runtime = df_runtime_without_errors['runtimeMinutes'].mean()
-
-    # Mean of episode length by series
-    df_mean_runtime_series = df_runtime_without_errors.groupby('parentTconst').agg({'runtimeMinutes': 'mean'})
-    df_mean_runtime_series.reset_index(inplace=True)
-
-    # 1. Use existing series info (use how='left' to keep series without runtimes for step 2)
-    df_runtime_errors = df_runtime_errors.merge(df_mean_runtime_series[['parentTconst', 'runtimeMinutes']], how='left', on='parentTconst')
-    df_runtime_errors.drop('runtimeMinutes_x', axis=1, inplace=True)
-    df_runtime_errors.rename(columns={'runtimeMinutes_y': 'runtimeMinutes'}, inplace=True)
-
-    # 2. If there is no info for series, runtimeMinutes columns will have become Nans -> use global mean
-    df_runtime_errors.loc[df_runtime_errors['runtimeMinutes'].isna(), 'runtimeMinutes'] = mean_runtime
-
-    # Calculate total runtime per series
-    df_runtime_score = pd.concat([df_runtime_without_errors, df_runtime_errors])
-    print('# EPISODES AFTER REBUILDING EPISODE RUNTIMES:', len(df_runtime_score))   # Should match value_counts in the cells above
-    df_runtime_score = df_runtime_score.groupby('parentTconst').agg({'runtimeMinutes': 'sum'})
-    df_runtime_score.rename(columns={'runtimeMinutes': 'totalRuntime'}, inplace=True)
-    df_runtime_score['totalRuntime'] = round(df_runtime_score['totalRuntime']).astype(int)
-    df_runtime_score.reset_index(inplace=True)
-
-    return df_runtime_score
-
-st.cache_data(show_spinner=False)
-def calculate_combined_metric(df_series_score, df_episode_score, df_runtime_score):
-
-    # Merge score with episode score
-    df_combined = pd.merge(
-        left=df_series_score,
-        right=df_episode_score,
-        left_on='tconst',
-        right_on='parentTconst'
+    stages, inputs = startup_stages(version, data_dir, engine, tables)
+
+    with st.status('Loading data...') as status:
+        results = dag.run_graph(
+            stages, inputs, STARTUP_WORKERS,
+            on_done=lambda spec, seconds: status.write('{} ({:.2f} s)'.format(spec['name'], seconds))
+        )
+        status.update(label='Data loaded', state='complete', expanded=False)
+
+    return results
+
+def check_snapshots():
+
+    '''
+    Pin the snapshot of this session, start building the next dataset version
+    in the background if there is one, and return the live version.
+    '''
+
+    import uuid
+
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+    snapshot_manager.pin(session_id, st.session_state['dataset_version'])
+    snapshot_manager.check()
+    snapshot_manager.sweep()
+
+    return snapshot_manager.live()[0]
+
+def plan_watching(budget_hours, max_title_hours, max_series, finished_only):
+
+    '''
+    Unwatched titles of this session with the highest total score in budget_hours (see planner.py).
+    '''
+
+    import planner
+
+    df_candidates = planner.plan_candidates(
+        st.session_state['films'],
+        st.session_state['series'],
+        st.session_state['user_ratings']['tconst'],
+        max_title_minutes=max_title_hours*60,
+        finished_only=finished_only
     )
 
-    # Merge with runtime score
-    df_combined = df_combined.merge(df_runtime_score, on='parentTconst')
-    df_combined.drop(columns='parentTconst', inplace=True)
+    return planner.plan(df_candidates, budget_hours*60, max_series)
 
-    df_combined = df_combined[
-        [
-            'tconst',
-            'titleType',
-            'primaryTitle',
-            'originalTitle',
-            'startYear',
-            'endYear',
-            'averageRating',
-            'numVotes',
-            'seriesScore',
-            'episodeScore',
-            'totalRuntime',
-        ]
-    ]
+def display_more_like_this(df_content, watched_tconst, key):
+
+    '''
+    Let the user pick one of the displayed titles and show the most similar unwatched titles.
+    '''
+
+    import similar_titles
+
+    options = dict(zip(df_content['primaryTitle'] + ' (' + df_content['tconst'] + ')', df_content['tconst']))
+    selected = st.selectbox(
+        label='More like this',
+        options=list(options),
+        index=None,
+        placeholder='Select a title to find similar ones',
+        key=key
+    )
+
+    if selected is None:
+        return
+
+    if 'similar_titles_index' not in st.session_state:
+        with st.spinner('Loading similar titles...'):
+            st.session_state['similar_titles_index'] = load_similar_titles_index(
+                st.session_state['dataset_version'],
+                st.session_state['films'],
+                st.session_state['series']
+            )
+
+    index, df_candidates = st.session_state['similar_titles_index']
+    # Titles that are not candidates (e.g. found by the search) are embedded from all_titles
+    df_similar = similar_titles.more_like_this(
+        index, options[selected], num_titles=10, exclude_tconsts=watched_tconst, df_titles=st.session_state['all_titles']
+    )
+    df_similar = df_similar.merge(df_candidates, on='tconst')
+    df_similar.index = np.arange(1, 1+len(df_similar))
+
+    st.dataframe(df_similar, use_container_width=True)
 
-    # Using numVotes to combine with runtime score
-    df_combined['combinedMetric'] = (df_combined['seriesScore'] * df_combined['episodeScore']) / 2 # Normal version
-    # df_combined = normalise_scores(df_combined, score_col='combinedMetric')
-    df_combined.sort_values('combinedMetric', ascending=False, inplace=True)
+def display_title_connections(df_content, watched_tconst, key):
 
-    return df_combined
+    '''
+    Let the user pick one of the displayed titles and show its unwatched prequels and sequels.
+    '''
+
+    from fetching_connections import connections_table, find_franchise
+
+    options = dict(zip(df_content['primaryTitle'] + ' (' + df_content['tconst'] + ')', df_content['tconst']))
+    selected = st.selectbox(
+        label='Prequels and sequels',
+        options=list(options),
+        index=None,
+        placeholder='Select a title to find its connections',
+        key=key
+    )
+
+    if selected is None:
+        return
+
+    tconst = options[selected]
+    with st.spinner('Searching connections...'), warmer.foreground():
+        franchise = find_franchise(st.session_state['all_titles'], tconst, selected.rsplit(' (', 1)[0], list(watched_tconst), set())
+
+    df_franchise = connections_table([franchise])
+    st.dataframe(df_franchise, use_container_width=True)
+    display_covers_franchise(df_franchise, watched_tconst)
+
+@instrumented_cache(st.cache_data(show_spinner=False))      # Run only once per version of the ratings store
+def fetch_user_ratings(id_user, store_version):
+
+    # Web-scraping stack is only loaded when ratings are fetched
+    from fetching_ratings import get_user_ratings
+
+    return get_user_ratings(id_user)
+
+def get_user_ratings(id_user=IMDB_USER_ID):
+
+    import ratings_store
+
+    # New export files are imported when a session begins (not cached), and the
+    # ratings are fetched again once they change the store
+    ratings_store.import_folder()
+
+    return fetch_user_ratings(id_user, ratings_store.store_version())
+
+def warm_caches(kind, tconsts, panel):
+
+    '''
+    Prefetch the covers or connections ('cover' or 'connections') of tconsts in the
+    background, with the priority of the panel that shows them (see warmer.py).
+    '''
+
+    warmer.schedule(kind, list(tconsts), panel)
+
+def connections_search(version, seen_tconst):
+
+    '''
+    State of the connections search of this session (see fetching_connections.search_connections),
+    started again if the dataset version or the watched titles change.
+    '''
+
+    from fetching_connections import new_search
+
+    key = (version, hash_value(list(seen_tconst)))
+    if st.session_state.get('connections_search_key') != key:
+        st.session_state['connections_search'] = new_search()
+        st.session_state['connections_search_key'] = key
+
+    return st.session_state['connections_search']
+
+def search_connections(search, all_content, max_num_titles, seen_tconst):
+
+    '''
+    Continue the search until it has found max_num_titles franchises, yielding each new one.
+    A rerun (e.g. a widget change) stops it, and the next call resumes from where it stopped.
+    '''
+
+    # Cinemagoer and the web-scraping stack are only loaded when connections are shown
+    from fetching_connections import search_connections as search_franchises
+
+    # Print out to the screen title being searched
+    log = st.empty()
+
+    def show_progress(message):
+        with log.container():
+            st.write(message)
+
+    for franchise in search_franchises(all_content, seen_tconst, search, log=show_progress):
+        yield franchise
+        if len(search['franchises']) >= max_num_titles:
+            break
+
+    log.empty()
+
+def fetch_missing_covers(tconsts, size=POSTER_SIZE):
+
+    '''
+    Thumbnails of the covers that this session has not fetched yet, fetched in parallel
+    (none in 'browser' mode).
+    '''
+
+    if COVER_MODE != 'server':
+        return {}
+
+    missing = [tconst for tconst in dict.fromkeys(tconsts) if tconst not in st.session_state]
+
+    return dict(zip(missing, fetch_covers(missing, size)))
+
+def display_cover(container, tconst, caption, size=POSTER_SIZE):
+
+    '''
+    Show a cover in container: the image fetched by the app (COVER_MODE 'server'),
+    or an HTML image that the browser loads from IMDB ('browser').
+    '''
+
+    if COVER_MODE == 'browser':
+        container.markdown(cover_html(fetch_cover_url(tconst), caption, size), unsafe_allow_html=True)
+    else:
+        container.image(image=st.session_state['image_{}'.format(tconst)], caption=caption)
+
+# The display_covers* functions need the element replay of st.cache_data. They are
+# keyed by a hash of the few displayed rows (see cache.hash_value) instead of
+# letting Streamlit hash the DataFrames (and the watched titles) on every rerun
 
-@st.cache_data(show_spinner=False)
 def display_covers(df_content, content_type=None):
+    display_covers_grid(hash_value(df_content), df_content, content_type)
+
+@instrumented_cache(st.cache_data(show_spinner=False))
+def display_covers_grid(rows_hash, _df_content, content_type=None):
+
+    df_content = _df_content
 
     # Display content
-    cg = Cinemagoer()   # Get access to IMDB API for retrieving photos
     n_cols = 5
 
+    images = fetch_missing_covers(df_content['tconst'], POSTER_SIZE)
+
     for idx, tconst in enumerate(df_content['tconst']):
         # Fetch image if not retrieved already
         if tconst not in st.session_state:
-            content = cg.get_movie(tconst[2:])
-
-            # TO-DO: Get image link from the web scraping
-            # Read and resize image: https://stackoverflow.com/questions/7391945/how-do-i-read-image-data-from-a-url-in-python
-            img_data = requests.get(content['full-size cover url']).content
-            content_image = Image.open(BytesIO(img_data)).resize((1200,1800))
+            content_image = images.get(tconst)
             
             # Save variables obtained through requests in cache
             st.session_state['image_{}'.format(tconst)] = content_image
@@ -187,7 +540,8 @@ def display_covers(df_content, content_type=None):
             
             if content_type == 'Series':
                 end_year = tconst_info[4]
-                if end_year == '\\N':
+                # Ongoing series: missing ('\\N' in IMDB tables, NULL in SQL results)
+                if pd.isna(end_year) or end_year == '\\N':
                     end_year = ''
             
             content_caption = '{}. {} ({:.2f}) --- ({}{})'.format(
@@ -208,8 +562,9 @@ def display_covers(df_content, content_type=None):
         if idx % n_cols == 0:
             cols = st.columns(n_cols)
 
-        cols[idx % n_cols].image(
-            image=st.session_state['image_{}'.format(tconst)], 
+        display_cover(
+            cols[idx % n_cols],
+            tconst,
             caption='{}. {}'.format(
                 idx+1, 
                 st.session_state['display_covers_caption_{}'.format(tconst)]
@@ -219,144 +574,85 @@ def display_covers(df_content, content_type=None):
     st.divider()
 
 
-@st.cache_data(show_spinner=False)
-def display_covers_connections(df_content, watched_tconst):
-
-    # Display content
-    cg = Cinemagoer()   # Get access to IMDB API for retrieving photos
-    n_cols = 5
-
-    # TO-DO: If title whose connections is being searched has not been watched, display it too.
-
-    # Titles which are not connections are null, iterate through them
-    # and show images of connection iteratively
-    nan_indices = df_content.index[df_content['connection'].isna()].tolist()
-    nan_ranges = zip(nan_indices, nan_indices[1:])
-    
-    for idxA, idxB in nan_ranges:
-        original_title = df_content.iloc[idxA]['primaryTitle']
-        original_tconst = df_content.iloc[idxA]['tconst']
-
-        st.subheader('{} ({})'.format(original_title, original_tconst))
-        # st.write(original_tconst in set(watched_tconst))
-        # st.write(idxA, idxB)
-
-        # If unseen single title
-        if idxB-idxA == 1:
-            connection_tconsts = [df_content.loc[idxA, 'tconst']]
-        elif original_tconst not in set(watched_tconst):
-            connection_tconsts = df_content.loc[idxA:idxB-1, 'tconst']
-        elif original_tconst in set(watched_tconst):
-            connection_tconsts = df_content.loc[idxA+1:idxB-1, 'tconst']
-
-        for idx, tconst in enumerate(connection_tconsts):
-            # Fetch image if not retrieved already
-            if tconst not in st.session_state:
-                content = cg.get_movie(tconst[2:])
-
-                # Read and resize image: https://stackoverflow.com/questions/7391945/how-do-i-read-image-data-from-a-url-in-python
-                img_data = requests.get(content['full-size cover url']).content
-                content_image = Image.open(BytesIO(img_data)).resize((1200,1800))
-                
-                # Save variables obtained through requests in cache
-                st.session_state['image_{}'.format(tconst)] = content_image
-                
-                tconst_info = df_content.loc[df_content['tconst'] == tconst].values[0]
-                primary_title = tconst_info[1]
-                title_type = tconst_info[3]
-                
-                content_caption = '{}. {} ({})'.format(
-                    idx+1, 
-                    primary_title,
-                    title_type
-                )
-
-                # Store caption (everything except idx)
-                st.session_state['display_covers_connections_caption_{}'.format(tconst)] = ''.join(content_caption.split(sep='. ', maxsplit=1)[-1])
-
-                # Mark tconst as seen after image and caption have been stored
-                st.session_state[tconst] = True
+def display_covers_franchise(df_content, watched_tconst):
 
-            # Add a new row when end of row is reached
-            if idx % n_cols == 0:
-                cols = st.columns(n_cols)
-
-            cols[idx % n_cols].image(
-                image=st.session_state['image_{}'.format(tconst)], 
-                caption='{}. {}'.format(
-                    idx+1, 
-                    st.session_state['display_covers_connections_caption_{}'.format(tconst)]
-                )
-            )
+    '''
+    Covers of a franchise of fetching_connections.connections_table: the title whose
+    connections were searched (if unwatched) and its unwatched connections.
+    '''
 
-    st.divider()
+    # If unseen single title, or unseen title with connections
+    show_original = len(df_content) == 1 or df_content.iloc[0]['tconst'] not in set(watched_tconst)
 
+    display_covers_franchise_grid(hash_value(df_content), show_original, df_content)
 
-def get_new_episodes(titles, episodes, df_user_ratings):
+@instrumented_cache(st.cache_data(show_spinner=False))
+def display_covers_franchise_grid(rows_hash, show_original, _df_content):
 
-    '''
-    Use year of user ratings to look for episodes released after that year
-    '''
+    df_content = _df_content
 
-    # Only keep episodes of watched series
-    episodes_of_watched_series = episodes.loc[episodes['parentTconst'].isin(df_user_ratings['tconst'])].copy()
-    # Get primaryTitle of series
-    episodes_of_watched_series = pd.merge(episodes_of_watched_series, titles[['tconst', 'primaryTitle']], left_on='parentTconst', right_on='tconst')
-    episodes_of_watched_series.rename(columns={'primaryTitle': 'parentTitle', 'tconst_x': 'tconst'}, inplace=True)
-    episodes_of_watched_series.drop(columns='tconst_y', inplace=True)
+    # Display content
+    n_cols = 5
 
-    # Get episode name
-    episodes_of_watched_series = pd.merge(episodes_of_watched_series, titles[['tconst', 'primaryTitle']], on='tconst')
+    original_title = df_content.iloc[0]['primaryTitle']
+    original_tconst = df_content.iloc[0]['tconst']
 
-    # Find unaired pilots, special episodes...
-    unexpected_numbers = [-1,0]
-    unexpected_episodes = episodes_of_watched_series.loc[(episodes_of_watched_series['seasonNumber'].isin(unexpected_numbers)) | (episodes_of_watched_series['episodeNumber'].isin(unexpected_numbers))].copy()
-    unexpected_episodes.reset_index(inplace=True)
+    st.subheader('{} ({})'.format(original_title, original_tconst))
 
-    # Get year of episode
-    episodes_of_watched_series = pd.merge(
-        left=episodes_of_watched_series,
-        right=titles[['tconst', 'startYear']],
-        on='tconst'
-    )
+    if show_original:
+        connection_tconsts = df_content['tconst']
+    else:
+        connection_tconsts = df_content['tconst'].iloc[1:]
 
-    # Some unreleased episodes will show as '\\N', so convert them to -1
-    episodes_of_watched_series.loc[~(episodes_of_watched_series['startYear'].str.isnumeric()), 'startYear'] = -1
+    images = fetch_missing_covers(connection_tconsts, POSTER_SIZE)
 
-    # Merge with user ratings
-    episodes_of_watched_series = pd.merge(
-        left=episodes_of_watched_series,
-        right=df_user_ratings[['tconst', 'dateRating']],
-        left_on='parentTconst',
-        right_on='tconst'
-    )
+    for idx, tconst in enumerate(connection_tconsts):
+        # Fetch image if not retrieved already
+        if tconst not in st.session_state:
+            content_image = images.get(tconst)
+            
+            # Save variables obtained through requests in cache
+            st.session_state['image_{}'.format(tconst)] = content_image
+            
+            tconst_info = df_content.loc[df_content['tconst'] == tconst].values[0]
+            primary_title = tconst_info[1]
+            title_type = tconst_info[3]
+            
+            content_caption = '{}. {} ({})'.format(
+                idx+1, 
+                primary_title,
+                title_type
+            )
 
-    episodes_of_watched_series.rename(columns={'tconst_x': 'tconst'}, inplace=True)
-    episodes_of_watched_series.drop(columns='tconst_y', inplace=True)
+            # Store caption (everything except idx)
+            st.session_state['display_covers_connections_caption_{}'.format(tconst)] = ''.join(content_caption.split(sep='. ', maxsplit=1)[-1])
 
-    episodes_of_watched_series['startYear'] = episodes_of_watched_series['startYear'].astype(int)
-    episodes_of_watched_series['newEpisode'] = episodes_of_watched_series['startYear'] > episodes_of_watched_series['dateRating']
+            # Mark tconst as seen after image and caption have been stored
+            st.session_state[tconst] = True
 
-    # Sort by series, season and episode number
-    for col in ['seasonNumber', 'episodeNumber']:
-        episodes_of_watched_series.loc[episodes_of_watched_series[col] == '\\N', col] = -1
+        # Add a new row when end of row is reached
+        if idx % n_cols == 0:
+            cols = st.columns(n_cols)
 
-    episodes_of_watched_series['seasonNumber'] = episodes_of_watched_series['seasonNumber'].astype(int)
-    episodes_of_watched_series['episodeNumber'] = episodes_of_watched_series['episodeNumber'].astype(int)
+        display_cover(
+            cols[idx % n_cols],
+            tconst,
+            caption='{}. {}'.format(
+                idx+1, 
+                st.session_state['display_covers_connections_caption_{}'.format(tconst)]
+            )
+        )
 
-    episodes_of_watched_series.sort_values(['parentTconst', 'seasonNumber', 'episodeNumber'], inplace=True)
-    
-    unwatched_episodes = episodes_of_watched_series.loc[episodes_of_watched_series['newEpisode']]
-    unwatched_episodes.reset_index(inplace=True)
 
-    return unwatched_episodes, unexpected_episodes
+def display_covers_unwatched_episodes(df_new_episodes):
+    display_covers_unwatched_episodes_grid(hash_value(df_new_episodes), df_new_episodes)
 
+@instrumented_cache(st.cache_data(show_spinner=False))
+def display_covers_unwatched_episodes_grid(rows_hash, _df_new_episodes):
 
-@st.cache_data(show_spinner=False)
-def display_covers_unwatched_episodes(df_new_episodes):
+    df_new_episodes = _df_new_episodes
 
     # Display content
-    cg = Cinemagoer()   # Get access to IMDB API for retrieving photos
     n_cols = 5
 
     for parent_tconst in df_new_episodes['parentTconst'].unique():
@@ -365,15 +661,12 @@ def display_covers_unwatched_episodes(df_new_episodes):
         parent_title = df_content['parentTitle'].values[0]
         st.subheader('{} ({})'.format(parent_title, parent_tconst))
 
+        images = fetch_missing_covers(df_content['tconst'], STILL_SIZE)
+
         for idx, tconst in enumerate(df_content['tconst']):
             # Fetch image if not retrieved already
             if tconst not in st.session_state:
-                content = cg.get_movie(tconst[2:])
-
-                # TO-DO: Get image link from the web scraping
-                # Read and resize image: https://stackoverflow.com/questions/7391945/how-do-i-read-image-data-from-a-url-in-python
-                img_data = requests.get(content['full-size cover url']).content
-                content_image = Image.open(BytesIO(img_data)).resize((1200,1200))
+                content_image = images.get(tconst)
                 
                 # Save variables obtained through requests in cache
                 st.session_state['image_{}'.format(tconst)] = content_image
@@ -399,9 +692,66 @@ def display_covers_unwatched_episodes(df_new_episodes):
             if idx % n_cols == 0:
                 cols = st.columns(n_cols)
 
-            cols[idx % n_cols].image(
-                image=st.session_state['image_{}'.format(tconst)], 
-                caption=st.session_state['display_covers_unwatched_episodes_caption_{}'.format(tconst)]
+            display_cover(
+                cols[idx % n_cols],
+                tconst,
+                caption=st.session_state['display_covers_unwatched_episodes_caption_{}'.format(tconst)],
+                size=STILL_SIZE
             )
 
-    st.divider()
\ No newline at end of file
+    st.divider()
+
+
+def display_instrumentation_panel():
+
+    '''
+    Sidebar panel with the time spent in each stage, the cache hits/misses of cached
+    functions and the outbound requests. Also writes the metrics for Prometheus (see telemetry.py).
+    '''
+
+    telemetry.write_metrics()
+
+    show_timings = st.sidebar.toggle(
+        label='Show pipeline timings',
+        value=False
+    )
+
+    if not show_timings:
+        return
+
+    st.sidebar.subheader('Stages')
+    stages = [record for record in instrumentation.RECORDS if record.get('kind') == 'stage']
+    st.sidebar.dataframe(
+        [
+            {
+                'stage': record['name'],
+                'wall (s)': record['wall_seconds'],
+                'cpu (s)': record['cpu_seconds'],
+                'peak RSS +MB': record['peak_rss_delta_mb'],
+                'rows': str(record.get('rows', ''))
+            }
+            for record in reversed(stages)
+        ],
+        use_container_width=True
+    )
+
+    st.sidebar.subheader('Cache')
+    st.sidebar.dataframe(instrumentation.cache_summary(), use_container_width=True)
+
+    st.sidebar.caption('Versioned cache (MB, limit {:.0f})'.format(CACHE_MAX_MB))
+    st.sidebar.dataframe(versioned_summary(), use_container_width=True)
+
+    st.sidebar.caption('Persistent cache (memory and disk)')
+    st.sidebar.dataframe(cached_summary(), use_container_width=True)
+
+    st.sidebar.subheader('Network')
+    st.sidebar.dataframe(telemetry.request_summary(), use_container_width=True)
+    st.sidebar.download_button('Metrics (Prometheus)', telemetry.prometheus_text(), file_name=telemetry.METRICS_FILE, mime='text/plain')
+
+    st.sidebar.subheader('Cache warmer')
+    st.sidebar.dataframe([warmer.progress()], use_container_width=True)
+
+    st.sidebar.subheader('Snapshots')
+    status = snapshot_manager.status()
+    st.sidebar.caption('Live: {live}, building: {building}, swaps: {swaps}, freed: {freed}, failed builds: {failed}'.format(**status))
+    st.sidebar.dataframe([{'version': version, 'sessions': count} for version, count in status['sessions'].items()], use_container_width=True)
@@ -0,0 +1,152 @@
+# Parity and speed of the engines of the scoring pipeline (see config.ENGINE):
+# builds the score tables with every engine on the same datasets, checks that
+# they are identical and reports wall time, CPU time and peak RSS of each one.
+# Every engine runs in its own process so that peak RSS is not shared.
+#
+# Usage:
+#   python benchmarks/compare_engines.py --rows 1000000
+#   python benchmarks/compare_engines.py --rows 12000000          # about the size of the IMDB datasets
+#   python benchmarks/compare_engines.py --data-dir path/to/imdb  # real datasets
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import redirect_stdout
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+from instrumentation import peak_rss_mb
+
+from generate_datasets import generate
+
+ENGINES = ['pandas', 'polars']
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+
+def run_engine(engine, data_dir, tables_path):
+
+    '''
+    Build the score tables with engine (in this process), pickle them to tables_path
+    and return the timings.
+    '''
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        tables = pipeline.compute_score_tables(data_dir, engine)
+    seconds, cpu_seconds = time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+    with open(tables_path, 'wb') as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return {
+        'seconds': round(seconds, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None
+    }
+
+
+def differences(tables, reference):
+
+    '''
+    Return the names of the tables that are not identical to the reference ones.
+    '''
+
+    different = []
+
+    frames = ['all_titles', 'episodes', 'films', 'series']
+    pairs = [(name, tables[name], reference[name]) for name in frames]
+    pairs.append(('episode_index', tables['episode_index']['episodes'], reference['episode_index']['episodes']))
+
+    for name, df, df_reference in pairs:
+        try:
+            pd.testing.assert_frame_equal(df, df_reference, check_exact=True)
+        except AssertionError as error:
+            print('{} differs:\n{}'.format(name, error))
+            different.append(name)
+
+    for key in ['parents', 'starts', 'stops']:
+        if not np.array_equal(tables['episode_index'][key], reference['episode_index'][key]):
+            print('episode_index[{}] differs'.format(key))
+            different.append('episode_index[{}]'.format(key))
+
+    return different
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare the engines of the WatchNext pipeline.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='the first one is the reference')
+    parser.add_argument('--run-engine', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('--tables-path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows))
+
+    # Child process: a single engine
+    if args.run_engine is not None:
+        print(json.dumps(run_engine(args.run_engine, data_dir, args.tables_path)))
+        return 0
+
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    results, mismatches = {}, {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        for engine in args.engines:
+            tables_path = os.path.join(tmp_dir, '{}.pkl'.format(engine))
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--data-dir', data_dir, '--run-engine', engine, '--tables-path', tables_path],
+                check=True, capture_output=True, text=True
+            )
+            results[engine] = json.loads(output.stdout.splitlines()[-1])
+
+        with open(os.path.join(tmp_dir, '{}.pkl'.format(args.engines[0])), 'rb') as f:
+            reference = pickle.load(f)
+
+        for engine in args.engines[1:]:
+            with open(os.path.join(tmp_dir, '{}.pkl'.format(engine)), 'rb') as f:
+                mismatches[engine] = differences(pickle.load(f), reference)
+
+    print('{:<10} {:>10} {:>10} {:>10} {:>10}'.format('Engine', 'Wall (s)', 'CPU (s)', 'RSS (MB)', 'Identical'))
+    for engine, result in results.items():
+        identical = 'reference' if engine == args.engines[0] else ('yes' if not mismatches[engine] else 'NO')
+        print('{:<10} {:>10.2f} {:>10.2f} {:>10} {:>10}'.format(
+            engine, result['seconds'], result['cpu_seconds'], result['peak_rss_mb'], identical
+        ))
+
+    report = {
+        'rows': args.rows if args.data_dir is None else None,
+        'data_dir': args.data_dir,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'engines': results,
+        'mismatches': mismatches
+    }
+
+    label = args.rows if args.data_dir is None else os.path.basename(os.path.normpath(args.data_dir))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest_engines_{}.json'.format(label)), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return 1 if any(mismatches.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
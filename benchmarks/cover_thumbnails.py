@@ -0,0 +1,104 @@
+# Images per second of the cover pipeline of the app ('server' cover mode):
+# the previous path (full-size decode, resize to 1200x1800 and JPEG encoding by
+# st.image, one cover at a time on the script thread) against the thumbnails of
+# covers.make_thumbnail (reduced-resolution decode, centred crop to the display
+# size) on 1 thread and on the pool of covers.fetch_covers.
+#
+# Covers are synthetic JPEGs with the size of IMDB full-size covers (see
+# fake_fetchers.fake_cover_bytes), so downloads are not part of the timings.
+#
+# Usage:
+#   python benchmarks/cover_thumbnails.py --covers 40 --workers 1 4 8
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from covers import make_thumbnail, POSTER_SIZE
+
+from fake_fetchers import fake_cover_bytes
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Display size and encoding of covers before thumbnails
+PREVIOUS_SIZE = (1200, 1800)
+PREVIOUS_QUALITY = 90   # JPEG quality of st.image for PIL images
+
+
+def previous_cover(img_data):
+
+    from PIL import Image
+
+    image = Image.open(BytesIO(img_data)).resize(PREVIOUS_SIZE)
+
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=PREVIOUS_QUALITY)
+
+    return buffer.getvalue()
+
+
+def images_per_second(func, covers, num_workers=1):
+
+    start = time.perf_counter()
+
+    if num_workers == 1:
+        outputs = [func(img_data) for img_data in covers]
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            outputs = list(pool.map(func, covers))
+
+    seconds = time.perf_counter() - start
+
+    return {
+        'images_per_second': round(len(covers) / seconds, 1),
+        'mean_output_kb': round(sum(len(output) for output in outputs) / len(outputs) / 2**10, 1)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Images per second of the WatchNext cover pipeline.')
+    parser.add_argument('--covers', type=int, default=40, help='number of covers decoded by each run')
+    parser.add_argument('--width', type=int, default=1382, help='width of the full-size covers')
+    parser.add_argument('--height', type=int, default=2048, help='height of the full-size covers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='threads of the thumbnail pool')
+    args = parser.parse_args()
+
+    # Different images, so that no run benefits from another one's decoded data
+    covers = [fake_cover_bytes(args.width, args.height, seed) for seed in range(args.covers)]
+
+    runs = {'previous': images_per_second(previous_cover, covers)}
+    for num_workers in args.workers:
+        runs['thumbnails_{}_workers'.format(num_workers)] = images_per_second(make_thumbnail, covers, num_workers)
+
+    print('{:<24} {:>14} {:>16}'.format('Path', 'Images/s', 'Output (KB)'))
+    for name, result in runs.items():
+        print('{:<24} {:>14.1f} {:>16.1f}'.format(name, result['images_per_second'], result['mean_output_kb']))
+
+    report = {
+        'covers': args.covers,
+        'cover_size': [args.width, args.height],
+        'display_size': list(POSTER_SIZE),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'runs': runs
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest_cover_thumbnails.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
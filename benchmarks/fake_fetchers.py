@@ -0,0 +1,200 @@
+# Offline stand-ins for the IMDB connection and cover fetchers, so that the
+# network-bound parts of the app can be benchmarked deterministically.
+import functools
+
+import numpy as np
+
+# Titles are grouped in franchises of this many consecutive tconsts
+FRANCHISE_SIZE = 6
+
+# Like Cinemagoer, only the first 5 connections are returned
+MAX_CONNECTIONS_RETURNED = 5
+
+
+def make_fake_connections(all_content):
+
+    '''
+    Return (count_connections, find_connections) with the signatures of
+    fetching_connections.get_num_connections and find_title_connections.
+
+    Titles sorted by tconst are grouped in franchises of FRANCHISE_SIZE titles
+    (every third franchise is a single title without connections); a title
+    'follows' the titles before it in its franchise and is 'followed by' the ones after.
+    '''
+
+    tconsts = np.sort(all_content['tconst'].to_numpy())
+
+    def franchise_of(tconst):
+        position = int(np.searchsorted(tconsts, tconst))
+        if position == len(tconsts) or tconsts[position] != tconst:
+            return [], []
+        block = position // FRANCHISE_SIZE
+        if block % 3 == 0:
+            return [], []
+        members = list(tconsts[block*FRANCHISE_SIZE:(block+1)*FRANCHISE_SIZE])
+        index = members.index(tconst)
+        return members[:index][::-1], members[index+1:]
+
+    def count_connections(tconst, connection_type):
+        follows, followed_by = franchise_of(tconst)
+        return len(follows) if connection_type == 'follows' else len(followed_by)
+
+    def find_connections(tconst, connection_type):
+        follows, followed_by = franchise_of(tconst)
+        connections = follows if connection_type == 'follows' else followed_by
+        return connections[:MAX_CONNECTIONS_RETURNED]
+
+    return count_connections, find_connections
+
+
+@functools.lru_cache(maxsize=None)
+def fake_cover_bytes(width=600, height=900, seed=0):
+
+    '''
+    JPEG-encoded noise image with the size of a typical IMDB full-size cover.
+    '''
+
+    from io import BytesIO
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=85)
+
+    return buffer.getvalue()
+
+
+def ratings_page_html(id_user, ratings, position, page_size=100):
+
+    '''
+    HTML of a ratings page of IMDB (the parts read by fetching_ratings), with the
+    ratings [(tconst, rating, 'DD Mon YYYY')] from position.
+    '''
+
+    page = ratings[position:position + page_size]
+    items = ''.join(
+        '<div class="lister-item-content"><h3 class="lister-item-header"><a href="/title/{0}/">{0}</a></h3>'
+        '<div class="ipl-rating-star ipl-rating-star--other-user small"><span class="ipl-rating-star__rating">{1}</span></div>'
+        '<p class="text-muted">Title</p><p class="text-muted">Rated on {2}</p></div>'.format(tconst, rating, date)
+        for tconst, rating, date in page
+    )
+    next_page = '<a class="flat-button lister-page-next next-page" href="/user/{}/ratings?lastPosition={}">Next</a>'.format(
+        id_user, position + page_size
+    )
+
+    return (
+        '<html><body><div class="list-pagination"><span class="pagination-range">{} - {} of {:,}</span>{}</div>{}</body></html>'
+    ).format(position + 1, position + len(page), len(ratings), next_page, items)
+
+
+def connections_page_html(num_follows, num_followed_by):
+
+    return (
+        '<html><body><select><option value="#follows">Follows ({})</option>'
+        '<option value="#followed_by">Followed by ({})</option></select></body></html>'
+    ).format(num_follows, num_followed_by)
+
+
+def serve_fake_imdb(all_content, ratings, latency_ms=0, id_user='ur1'):
+
+    '''
+    Start a local HTTP server standing in for the IMDB pages and images the app
+    fetches, on a free port and its own threads. Return (server, base URL).
+
+    /user/<id_user>/ratings               ratings pages (ratings: see ratings_page_html)
+    /title/<tconst>/movieconnections/     number of connections (see make_fake_connections)
+    /title/<tconst>/json                  cover URL and connections, read by FakeCinemagoer
+    /covers/<tconst>.jpg                  cover (fake_cover_bytes)
+
+    Every response waits latency_ms first, like a remote server.
+    '''
+
+    import json
+    import threading
+    import time
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    count_connections, find_connections = make_fake_connections(all_content)
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+
+            time.sleep(latency_ms / 1000)
+
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+
+            if parts[:1] == ['user'] and parts[1] == id_user:
+                position = int(parse_qs(url.query).get('lastPosition', ['0'])[0])
+                self.reply(ratings_page_html(id_user, ratings, position).encode(), 'text/html')
+            elif parts[:1] == ['title'] and parts[2:] == ['movieconnections']:
+                html = connections_page_html(count_connections(parts[1], 'follows'), count_connections(parts[1], 'followed by'))
+                self.reply(html.encode(), 'text/html')
+            elif parts[:1] == ['title'] and parts[2:] == ['json']:
+                body = {
+                    'full-size cover url': '{}/covers/{}._V1_.jpg'.format(self.server.url, parts[1]),
+                    'follows': find_connections(parts[1], 'follows'),
+                    'followed by': find_connections(parts[1], 'followed by')
+                }
+                self.reply(json.dumps(body).encode(), 'application/json')
+            elif parts[:1] == ['covers']:
+                self.reply(fake_cover_bytes(), 'image/jpeg')
+            else:
+                self.send_error(404)
+
+        def reply(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    threading.Thread(target=server.serve_forever, name='fake-imdb', daemon=True).start()
+
+    return server, server.url
+
+
+class FakeMovie:
+
+    '''
+    The parts of a Cinemagoer movie read by the app: get() for the cover URL and
+    items() for the connections (with the movieID of each connection).
+    '''
+
+    def __init__(self, info):
+        self.info = info
+
+    def get(self, key, default=None):
+        return self.info.get(key, default)
+
+    def items(self):
+        from types import SimpleNamespace
+        connections = {
+            connection_type: [SimpleNamespace(movieID=tconst[2:]) for tconst in self.info[connection_type]]
+            for connection_type in ['follows', 'followed by']
+        }
+        return [('connections', connections)]
+
+
+class FakeCinemagoer:
+
+    '''
+    Stand-in for Cinemagoer reading movies from serve_fake_imdb.
+    '''
+
+    def __init__(self, url):
+        self.url = url
+
+    def get_movie(self, movie_id, info=None):
+        import requests
+        return FakeMovie(requests.get('{}/title/tt{}/json'.format(self.url, movie_id)).json())
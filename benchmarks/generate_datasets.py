@@ -0,0 +1,247 @@
+# Deterministic generator of synthetic IMDB-shaped datasets, so that the
+# pipeline can be benchmarked at real scale without network access.
+#
+# Writes title.basics.tsv.gz, title.ratings.tsv.gz and title.episode.tsv.gz
+# (same columns and '\N' conventions as https://datasets.imdbws.com) plus a
+# ratings.csv of a synthetic user (tconst, userRating, dateRating).
+#
+# Usage:
+#   python benchmarks/generate_datasets.py --rows 100000 --output-dir benchmarks/data/100k
+#   python benchmarks/generate_datasets.py --rows 20000000 --output-dir benchmarks/data/20m
+import argparse
+import gzip
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+MISSING = '\\N'
+
+# Share of each titleType in title.basics (roughly that of the real dataset)
+TITLE_TYPES = {
+    'movie': 0.09,
+    'short': 0.10,
+    'tvMovie': 0.02,
+    'video': 0.04,
+    'tvSpecial': 0.005,
+    'tvSeries': 0.02,
+    'tvMiniSeries': 0.005,
+    'tvEpisode': 0.72,
+}
+
+GENRES = [
+    'Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary',
+    'Drama', 'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Musical', 'Mystery',
+    'Romance', 'Sci-Fi', 'Sport', 'Thriller', 'War', 'Western'
+]
+
+# Malformed runtimes found in the real dataset when a row has shifted columns
+MALFORMED_RUNTIMES = ['Documentary', 'Reality-TV', 'Talk-Show']
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ra', 'to', 'su', 'vi', 'da', 'shi', 'mor', 'tel', 'an', 'ber', 'cor', 'dun', 'el', 'fen']
+
+CHUNK_ROWS = 1_000_000
+
+
+def make_vocabulary(seed, size=3000):
+
+    '''
+    Pseudo-words used to build titles (deterministic for a given seed).
+    '''
+
+    rng = np.random.default_rng([seed, 0])
+    words = set()
+    while len(words) < size:
+        n = rng.integers(2, 4)
+        words.add(''.join(rng.choice(SYLLABLES, n)).capitalize())
+
+    return np.array(sorted(words), dtype=object)
+
+
+def with_missing(values, rng, p_missing):
+
+    '''
+    Convert values to strings and replace a share p_missing of them by '\\N'.
+    '''
+
+    values = np.asarray(values).astype(str).astype(object)
+    values[rng.random(len(values)) < p_missing] = MISSING
+
+    return values
+
+
+def make_tconsts(ids):
+    return 'tt' + pd.Series(ids).astype(str).str.zfill(8)
+
+
+def make_basics_chunk(rng, ids, types, vocabulary):
+
+    n = len(ids)
+    type_names = np.array(list(TITLE_TYPES), dtype=object)[types]
+    is_series = np.isin(type_names, ['tvSeries', 'tvMiniSeries'])
+    is_episode = type_names == 'tvEpisode'
+
+    # Titles of 1-3 words
+    n_words = rng.integers(1, 4, n)
+    titles = pd.Series(vocabulary[rng.integers(0, len(vocabulary), n)])
+    for k in [2, 3]:
+        words = pd.Series(vocabulary[rng.integers(0, len(vocabulary), n)])
+        titles = titles.where(n_words < k, titles + ' ' + words)
+
+    original_titles = titles.where(rng.random(n) > 0.1, pd.Series(vocabulary[rng.integers(0, len(vocabulary), n)]))
+
+    start_year = rng.integers(1900, 2027, n)
+    end_year = np.where(is_series, np.minimum(start_year + rng.integers(0, 16, n), 2026), 0).astype(str).astype(object)
+    end_year[~is_series | (rng.random(n) < 0.4)] = MISSING
+
+    runtime = np.where(is_episode, rng.integers(15, 65, n), rng.integers(5, 200, n))
+    runtime = with_missing(runtime, rng, 0.25)
+    malformed = rng.random(n) < 0.001
+    runtime[malformed] = np.array(MALFORMED_RUNTIMES, dtype=object)[rng.integers(0, len(MALFORMED_RUNTIMES), malformed.sum())]
+
+    # 1-3 distinct genres: offsets from the first genre are distinct and non-zero
+    genre_names = np.array(GENRES, dtype=object)
+    n_genres = rng.integers(1, 4, n)
+    first_genre = rng.integers(0, len(GENRES), n)
+    offset_2 = rng.integers(1, len(GENRES), n)
+    offset_3 = rng.integers(1, len(GENRES)-1, n)
+    offset_3 += offset_3 >= offset_2
+    genres = pd.Series(genre_names[first_genre])
+    for k, offset in zip([2, 3], [offset_2, offset_3]):
+        genre = pd.Series(genre_names[(first_genre + offset) % len(GENRES)])
+        genres = genres.where(n_genres < k, genres + ',' + genre)
+    genres[rng.random(n) < 0.05] = MISSING
+
+    return pd.DataFrame({
+        'tconst': make_tconsts(ids),
+        'titleType': type_names,
+        'primaryTitle': titles,
+        'originalTitle': original_titles,
+        'isAdult': np.where(rng.random(n) < 0.01, '1', '0'),
+        'startYear': with_missing(start_year, rng, 0.01),
+        'endYear': end_year,
+        'runtimeMinutes': runtime,
+        'genres': genres,
+    })
+
+
+def make_ratings_chunk(rng, ids, types):
+
+    # Episodes are rated less often than films and series
+    is_episode = types == list(TITLE_TYPES).index('tvEpisode')
+    is_rated = rng.random(len(ids)) < np.where(is_episode, 0.45, 0.6)
+    ids = ids[is_rated]
+    n = len(ids)
+
+    return pd.DataFrame({
+        'tconst': make_tconsts(ids),
+        'averageRating': np.round(np.clip(rng.normal(6.5, 1.3, n), 1, 10), 1),
+        'numVotes': np.maximum(5, rng.lognormal(3, 2, n)).astype(np.int64),   # Heavy tail: few titles with 5000+ votes
+    })
+
+
+def make_episodes_chunk(rng, ids, series_ids):
+
+    n = len(ids)
+
+    # Skewed so that a few series have many episodes
+    parents = series_ids[(len(series_ids) * rng.power(0.3, n)).astype(np.int64)]
+
+    season = with_missing(np.minimum(rng.geometric(0.4, n), 30), rng, 0.03)
+    episode = with_missing(rng.integers(1, 25, n), rng, 0.03)
+    # Specials and pilots
+    season[rng.random(n) < 0.01] = '0'
+    episode[rng.random(n) < 0.01] = '0'
+
+    return pd.DataFrame({
+        'tconst': make_tconsts(ids),
+        'parentTconst': make_tconsts(parents),
+        'seasonNumber': season,
+        'episodeNumber': episode,
+    })
+
+
+def make_user_ratings(rng, df_ratings, num_ratings=500):
+
+    '''
+    Ratings of a synthetic user: a sample of rated titles, in the format of df_user_ratings.csv.
+    '''
+
+    sample = df_ratings.sample(n=min(num_ratings, len(df_ratings)), random_state=int(rng.integers(0, 2**31)))
+
+    return pd.DataFrame({
+        'tconst': sample['tconst'].values,
+        'userRating': rng.integers(1, 11, len(sample)),
+        'dateRating': rng.integers(2015, 2025, len(sample)),
+    })
+
+
+def generate(num_rows, output_dir, seed=0):
+
+    '''
+    Write the three datasets with num_rows titles to output_dir (in chunks, so
+    that 20M rows fit in memory). The same seed always produces the same files.
+    '''
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    rng = np.random.default_rng([seed, 1])
+    types = rng.choice(len(TITLE_TYPES), size=num_rows, p=list(TITLE_TYPES.values())).astype(np.int8)
+    series_codes = [list(TITLE_TYPES).index(t) for t in ['tvSeries', 'tvMiniSeries']]
+    series_ids = np.flatnonzero(np.isin(types, series_codes)) + 1
+    episode_code = list(TITLE_TYPES).index('tvEpisode')
+    vocabulary = make_vocabulary(seed)
+
+    paths = {name: os.path.join(output_dir, 'title.{}.tsv.gz'.format(name)) for name in ['basics', 'ratings', 'episode']}
+    # mtime=0 so that the gzip headers (and therefore the files) are reproducible
+    files = {
+        name: io.TextIOWrapper(gzip.GzipFile(path, mode='wb', compresslevel=1, mtime=0), encoding='utf-8')
+        for name, path in paths.items()
+    }
+    user_ratings = []
+
+    try:
+        for i, start in enumerate(range(0, num_rows, CHUNK_ROWS)):
+            # One generator per chunk: output does not depend on the chunk being generated first
+            chunk_rng = np.random.default_rng([seed, 2, i])
+            ids = np.arange(start, min(start + CHUNK_ROWS, num_rows)) + 1
+            chunk_types = types[start:start + len(ids)]
+
+            df_basics = make_basics_chunk(chunk_rng, ids, chunk_types, vocabulary)
+            df_ratings = make_ratings_chunk(chunk_rng, ids, chunk_types)
+            is_episode = chunk_types == episode_code
+            df_episodes = make_episodes_chunk(chunk_rng, ids[is_episode], series_ids)
+
+            for name, df in zip(['basics', 'ratings', 'episode'], [df_basics, df_ratings, df_episodes]):
+                df.to_csv(files[name], sep='\t', index=False, header=(i == 0))
+
+            # Keep the user's sample small and spread across chunks
+            is_not_episode = ~df_ratings['tconst'].isin(df_episodes['tconst'])
+            user_ratings.append(make_user_ratings(chunk_rng, df_ratings.loc[is_not_episode], 50))
+
+            print('Generated {}/{} rows'.format(start + len(ids), num_rows))
+    finally:
+        for f in files.values():
+            f.close()
+
+    pd.concat(user_ratings).to_csv(os.path.join(output_dir, 'ratings.csv'), index=False)
+
+    return paths
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Generate synthetic IMDB datasets.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles in title.basics (10k to 20M)')
+    parser.add_argument('--output-dir', default=None, help='default: benchmarks/data/<rows>')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(os.path.dirname(__file__), 'data', str(args.rows))
+    generate(args.rows, output_dir, args.seed)
+    print('Datasets written to {}'.format(output_dir))
+
+
+if __name__ == '__main__':
+    main()
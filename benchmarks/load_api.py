@@ -0,0 +1,244 @@
+# Load test of the HTTP API (ranking_api.py): the server runs with --workers
+# worker processes on synthetic datasets, and N concurrent clients send
+# requests for --seconds to /films, /series and /episodes, in three modes:
+#   computed:    distinct parameters, so that nearly every ranking is computed
+#   cached:      a few parameters, served from the response cache of the workers
+#   revalidated: a few parameters with If-None-Match, answered 304 Not Modified
+#
+# Reports requests per second, latency (p50/p95/max) and status codes per mode
+# and number of clients. The simulated user's ratings are imported into the
+# ratings store of the server beforehand (see ratings_store.py).
+#
+# Usage:
+#   python benchmarks/load_api.py --rows 100000 --clients 1 10 50 --workers 4 --seconds 10
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from generate_datasets import generate
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+API_FILE = os.path.join(ROOT_DIR, 'ranking_api.py')
+
+# User of the imported ratings
+USER = 'ur1'
+
+ENDPOINTS = ['films', 'series', 'episodes']
+
+MODES = ['computed', 'cached', 'revalidated']
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers, work_dir, log):
+
+    command = [sys.executable, API_FILE, '--port', str(port), '--workers', str(workers)]
+    server = subprocess.Popen(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+
+    import requests
+
+    for _ in range(3000):
+        try:
+            if requests.get('http://127.0.0.1:{}/health'.format(port)).ok:
+                return server
+        except requests.ConnectionError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+
+    raise RuntimeError('The API server did not start (see its log)')
+
+
+def write_export(data_dir, path):
+
+    '''
+    Write the user ratings of the synthetic datasets as an IMDB export file (rated on January 1st).
+    '''
+
+    import pandas as pd
+
+    df = pd.read_csv(os.path.join(data_dir, 'ratings.csv'), dtype={'tconst': 'str'})
+    pd.DataFrame({
+        'Const': df['tconst'],
+        'Your Rating': df['userRating'],
+        'Date Rated': df['dateRating'].astype('str') + '-01-01'
+    }).to_csv(path, index=False)
+
+
+def make_query(endpoint, mode, rng):
+
+    '''
+    Query parameters of a request: drawn from many values when rankings should be computed, a few otherwise.
+    '''
+
+    values = 1000 if mode == 'computed' else 3
+    step = int(rng.integers(values))
+
+    if endpoint == 'films':
+        return {'user': USER, 'max_hours': round(1 + 3 * step / values, 3), 'top': 20}
+    if endpoint == 'series':
+        return {'user': USER, 'max_days': 1 + step % 10, 'top': 10 + step // 10}
+
+    # Missed episodes have no parameter: an unused one gives distinct responses (and ETags)
+    return {'user': USER, 'run': step}
+
+
+def percentiles(seconds):
+
+    milliseconds = 1000 * np.array(seconds)
+
+    return {
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 1),
+        'p95_ms': round(float(np.percentile(milliseconds, 95)), 1),
+        'max_ms': round(float(milliseconds.max()), 1)
+    }
+
+
+async def client(http, url, mode, deadline, seed, latencies, statuses):
+
+    rng = np.random.default_rng(seed)
+    etags = {}
+
+    while time.perf_counter() < deadline:
+        endpoint = ENDPOINTS[int(rng.integers(len(ENDPOINTS)))]
+        query = make_query(endpoint, mode, rng)
+        key = (endpoint, tuple(sorted(query.items())))
+        headers = {'If-None-Match': etags[key]} if mode == 'revalidated' and key in etags else {}
+
+        start = time.perf_counter()
+        async with http.get('{}/{}'.format(url, endpoint), params={k: str(v) for k, v in query.items()}, headers=headers) as response:
+            await response.read()
+            if 'ETag' in response.headers:
+                etags[key] = response.headers['ETag']
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status] += 1
+
+
+async def load_test(url, mode, num_clients, seconds, seed):
+
+    '''
+    Run num_clients clients at once for seconds, and measure their requests.
+    '''
+
+    import aiohttp
+
+    latencies = []
+    statuses = Counter()
+
+    connector = aiohttp.TCPConnector(limit=num_clients)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            client(http, url, mode, start + seconds, seed + i, latencies, statuses) for i in range(num_clients)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'clients': num_clients,
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency': percentiles(latencies),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Concurrent clients of the WatchNext HTTP API.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--workers', type=int, default=4, help='worker processes of the server')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of every run')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows)))
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    import ratings_store
+
+    # Snapshots, shared tables, ratings store and logs of the server are written to a temporary folder
+    with tempfile.TemporaryDirectory() as work_dir:
+
+        store_dir = os.path.join(work_dir, 'Ratings')
+        export_path = os.path.join(work_dir, '{}.csv'.format(USER))
+        write_export(data_dir, export_path)
+        ratings_store.import_exports([export_path], store_dir=store_dir)
+        os.environ.update({
+            'WATCHNEXT_DATA_DIR': data_dir,
+            'WATCHNEXT_RATINGS_STORE_DIR': store_dir,
+            'WATCHNEXT_IMDB_USER': USER
+        })
+
+        port = free_port()
+        url = 'http://127.0.0.1:{}'.format(port)
+
+        with open(os.path.join(work_dir, 'server.log'), 'w') as log:
+
+            start = time.perf_counter()
+            server = start_server(port, args.workers, work_dir, log)
+            print('Server with {} workers started in {:.1f} s'.format(args.workers, time.perf_counter() - start))
+
+            try:
+                # Every worker loads the ratings store and fills its caches, as on a server that has been up for a while
+                asyncio.run(load_test(url, 'cached', 2 * args.workers, 2, args.seed))
+
+                runs = []
+                print('{:<12} {:>8} {:>9} {:>10} {:>10} {:>10} {:>10}  {}'.format(
+                    'Mode', 'Clients', 'Requests', 'Req/s', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Statuses'
+                ))
+                for mode in args.modes:
+                    for num_clients in args.clients:
+                        result = asyncio.run(load_test(url, mode, num_clients, args.seconds, args.seed))
+                        runs.append(result)
+                        print('{:<12} {:>8} {:>9} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}  {}'.format(
+                            mode, num_clients, result['requests'], result['requests_per_second'], result['latency']['p50_ms'],
+                            result['latency']['p95_ms'], result['latency']['max_ms'], result['statuses']
+                        ))
+            finally:
+                server.terminate()
+                server.wait()
+
+    report = {
+        'rows': args.rows,
+        'workers': args.workers,
+        'seconds': args.seconds,
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'runs': runs
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest_load_api.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
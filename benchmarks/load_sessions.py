@@ -0,0 +1,358 @@
+# Load test of one WatchNext process: a Streamlit server runs the app and N
+# simulated sessions connect to it at once (websocket clients speaking the
+# protocol of the browser) and go through typical interactions: toggling
+# watched titles, moving sliders, opening missed episodes and connections.
+# IMDB is replaced by a local stand-in server (see fake_fetchers.serve_fake_imdb)
+# answering after --latency-ms, for ratings, connections and covers.
+#
+# Reports the latency of reruns (from sending the widget change to the end of
+# the script run: p50/p95/max, overall and per interaction) and the memory of the
+# server process: resident set growth per session once sessions are open, and
+# after their interactions. Linux only (reads /proc/<pid>/status).
+#
+# Usage:
+#   python benchmarks/load_sessions.py --rows 100000 --sessions 1 5 10 20 --rounds 3
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from fake_fetchers import FakeCinemagoer, serve_fake_imdb
+from generate_datasets import generate
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+APP_FILE = os.path.join(ROOT_DIR, 'watch_next.py')
+
+# User of the stand-in ratings pages
+USER = 'ur1'
+
+# Interactions of every round: (name, widget label, value set on even rounds, on odd rounds)
+INTERACTIONS = [
+    ('toggle watched films', 'Show watched films', True, False),
+    ('films slider', 'Select number of films to display', 10, 20),
+    ('films duration', 'Select the maximum duration of the film (in hours)', 3.0, 1.5),
+    ('toggle ongoing series', 'Show ongoing series', True, False),
+    ('series duration', 'Select the maximum duration of the series (in days)', 10, 3),
+    ('open missed episodes', 'Show missed episodes', True, True),
+    ('open connections', 'Show connections', True, True),
+    ('connections number', 'Select number of titles with connections to display.', 5, 10),
+    ('close panels', 'Show connections', False, False)
+]
+
+
+def rss_mb(pid):
+
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 2**10
+
+    return None
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def sample_ratings(data_dir, num_ratings, seed):
+
+    '''
+    Return (tconsts of all titles, [(tconst, rating, 'DD Mon YYYY')]): ratings of
+    random films and series with IMDB ratings, rated in 2018-2022, most recent first.
+    '''
+
+    df = pd.read_csv(os.path.join(data_dir, 'title.basics.tsv.gz'), sep='\t', usecols=['tconst', 'titleType'], dtype='str')
+    df_imdb_ratings = pd.read_csv(os.path.join(data_dir, 'title.ratings.tsv.gz'), sep='\t', usecols=['tconst'], dtype='str')
+    rng = np.random.default_rng(seed)
+
+    is_candidate = df['titleType'].isin(['movie', 'tvSeries', 'tvMiniSeries']) & df['tconst'].isin(df_imdb_ratings['tconst'])
+    rated = df.loc[is_candidate, 'tconst'].sample(num_ratings, random_state=seed)
+    dates = pd.Timestamp('2022-12-31') - pd.to_timedelta(np.sort(rng.integers(0, 5*365, num_ratings)), unit='D')
+
+    ratings = list(zip(rated, rng.integers(1, 11, num_ratings).tolist(), dates.strftime('%d %b %Y')))
+
+    return df[['tconst']], ratings
+
+
+def serve_app(port, imdb_url):
+
+    '''
+    Run the app with Streamlit in this process, with Cinemagoer replaced by the stand-in.
+    '''
+
+    import fetching_connections
+    from streamlit.web import cli
+
+    fetching_connections.get_cinemagoer = lambda: FakeCinemagoer(imdb_url)
+
+    sys.argv = [
+        'streamlit', 'run', APP_FILE, '--server.port', str(port), '--server.headless', 'true',
+        '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false'
+    ]
+    cli.main()
+
+
+def start_server(port, imdb_url, work_dir, log):
+
+    command = [sys.executable, os.path.abspath(__file__), '--serve', str(port), '--imdb-url', imdb_url]
+    server = subprocess.Popen(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+
+    import requests
+
+    for _ in range(600):
+        try:
+            if requests.get('http://127.0.0.1:{}/_stcore/health'.format(port)).ok:
+                return server
+        except requests.ConnectionError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+
+    raise RuntimeError('The Streamlit server did not start (see its log)')
+
+
+def widget_state(state, widget, value):
+
+    '''
+    Set the value of a widget (id, kind, data type) in a WidgetState, as the browser does.
+    '''
+
+    widget_id, kind, data_type = widget
+    state.id = widget_id
+
+    if kind == 'checkbox':
+        state.bool_value = value
+    elif kind == 'slider':
+        state.double_array_value.data.append(value)
+    elif data_type == 0:    # Integer number_input
+        state.int_value = int(value)
+    else:
+        state.double_value = float(value)
+
+
+async def rerun(ws, session, values):
+
+    '''
+    Rerun the script of a session with values ({label: value}) and wait until it
+    has finished. Return the seconds it took.
+    '''
+
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    message = BackMsg()
+    message.rerun_script.query_string = ''
+    message.rerun_script.page_script_hash = session['page_script_hash']
+    for label, value in values.items():
+        if label in session['widgets']:
+            widget_state(message.rerun_script.widget_states.widgets.add(), session['widgets'][label], value)
+
+    start = time.perf_counter()
+    await ws.send_bytes(message.SerializeToString())
+
+    async for received in ws:
+        forward = ForwardMsg()
+        forward.ParseFromString(received.data)
+        kind = forward.WhichOneof('type')
+
+        if kind == 'new_session':
+            session['page_script_hash'] = forward.new_session.page_script_hash
+        elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+            element = forward.delta.new_element
+            element_type = element.WhichOneof('type')
+            if element_type in ('checkbox', 'slider', 'number_input'):
+                proto = getattr(element, element_type)
+                session['widgets'][proto.label] = (proto.id, element_type, getattr(proto, 'data_type', None))
+            elif element_type == 'exception':
+                session['errors'].append('{}: {}'.format(element.exception.type, element.exception.message))
+        elif kind == 'script_finished':
+            break
+
+    return time.perf_counter() - start
+
+
+async def open_session(http, url):
+
+    ws = await http.ws_connect('{}/_stcore/stream'.format(url.replace('http', 'ws')), max_msg_size=0)
+    session = {'widgets': {}, 'page_script_hash': '', 'errors': [], 'timings': []}
+    session['timings'].append(('open', await rerun(ws, session, {})))
+
+    return ws, session
+
+
+async def interact(ws, session, rounds):
+
+    values = {}
+    for round_number in range(rounds):
+        for name, label, even_value, odd_value in INTERACTIONS:
+            values[label] = even_value if round_number % 2 == 0 else odd_value
+            session['timings'].append((name, await rerun(ws, session, values)))
+
+
+def percentiles(seconds):
+
+    milliseconds = 1000 * np.array(seconds)
+
+    return {
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 1),
+        'p95_ms': round(float(np.percentile(milliseconds, 95)), 1),
+        'max_ms': round(float(milliseconds.max()), 1)
+    }
+
+
+async def load_test(url, pid, num_sessions, rounds):
+
+    '''
+    Open num_sessions sessions at once, then run their interactions at once, and
+    measure their reruns and the memory of the server.
+    '''
+
+    import aiohttp
+
+    async with aiohttp.ClientSession() as http:
+
+        rss_before = rss_mb(pid)
+        start = time.perf_counter()
+
+        opened = await asyncio.gather(*[open_session(http, url) for _ in range(num_sessions)])
+        rss_opened = rss_mb(pid)
+
+        await asyncio.gather(*[interact(ws, session, rounds) for ws, session in opened])
+        seconds = time.perf_counter() - start
+        rss_after = rss_mb(pid)
+
+        for ws, _ in opened:
+            await ws.close()
+
+    timings = [timing for _, session in opened for timing in session['timings']]
+    reruns = [rerun_seconds for name, rerun_seconds in timings if name != 'open']
+
+    by_interaction = {}
+    for name, rerun_seconds in timings:
+        by_interaction.setdefault(name, []).append(rerun_seconds)
+
+    return {
+        'sessions': num_sessions,
+        'reruns': len(reruns),
+        'reruns_per_second': round(len(timings) / seconds, 1),
+        'errors': sorted({error for _, session in opened for error in session['errors']}),
+        'rerun': percentiles(reruns),
+        'open': percentiles(by_interaction.pop('open')),
+        'interactions': {name: percentiles(values) for name, values in by_interaction.items()},
+        'open_mb_per_session': round((rss_opened - rss_before) / num_sessions, 1),
+        'interactions_mb_per_session': round((rss_after - rss_opened) / num_sessions, 1),
+        'rss_mb': round(rss_after, 1)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Concurrent sessions of one WatchNext process.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--rounds', type=int, default=2, help='times each session goes through the interactions')
+    parser.add_argument('--ratings', type=int, default=500, help='titles rated by the simulated user')
+    parser.add_argument('--latency-ms', type=float, default=50, help='latency of the stand-in IMDB server')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--imdb-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Server process (started by start_server)
+    if args.serve is not None:
+        serve_app(args.serve, args.imdb_url)
+        return 0
+
+    data_dir = os.path.abspath(args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows)))
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    all_content, ratings = sample_ratings(data_dir, args.ratings, args.seed)
+    imdb, imdb_url = serve_fake_imdb(all_content, ratings, args.latency_ms, USER)
+
+    # Caches, snapshots, logs and rankings of the server are written to a temporary folder
+    with tempfile.TemporaryDirectory() as work_dir:
+
+        os.makedirs(os.path.join(work_dir, 'Rankings'))
+        os.environ.update({
+            'WATCHNEXT_DATA_DIR': data_dir,
+            'WATCHNEXT_IMDB_URL': imdb_url,
+            'WATCHNEXT_IMDB_USER': USER
+        })
+
+        port = free_port()
+        url = 'http://127.0.0.1:{}'.format(port)
+
+        with open(os.path.join(work_dir, 'server.log'), 'w') as log:
+
+            server = start_server(port, imdb_url, work_dir, log)
+
+            try:
+                # A first session builds the tables and fills the shared caches, as on a server that has been up for a while
+                warmup = asyncio.run(load_test(url, server.pid, 1, 1))
+                print('Warm-up session: opened in {:.1f} s, server RSS {:.0f} MB'.format(warmup['open']['max_ms'] / 1000, warmup['rss_mb']))
+
+                runs = []
+                print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>7} {:>14} {:>14}'.format(
+                    'Sessions', 'Reruns', 'Reruns/s', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Errors', 'Open MB/sess', 'Use MB/sess'
+                ))
+                for num_sessions in args.sessions:
+                    result = asyncio.run(load_test(url, server.pid, num_sessions, args.rounds))
+                    runs.append(result)
+                    print('{:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>7} {:>14.1f} {:>14.1f}'.format(
+                        num_sessions, result['reruns'], result['reruns_per_second'], result['rerun']['p50_ms'], result['rerun']['p95_ms'],
+                        result['rerun']['max_ms'], len(result['errors']), result['open_mb_per_session'], result['interactions_mb_per_session']
+                    ))
+            finally:
+                server.terminate()
+                server.wait()
+
+    imdb.shutdown()
+
+    for error in sorted({error for result in runs for error in result['errors']}):
+        print('Error in the app: {}'.format(error))
+
+    print('\nInteractions with {} sessions:'.format(runs[-1]['sessions']))
+    print('{:<24} {:>10} {:>10} {:>10}'.format('Interaction', 'p50 (ms)', 'p95 (ms)', 'Max (ms)'))
+    for name, result in [('open', runs[-1]['open'])] + list(runs[-1]['interactions'].items()):
+        print('{:<24} {:>10.1f} {:>10.1f} {:>10.1f}'.format(name, result['p50_ms'], result['p95_ms'], result['max_ms']))
+
+    report = {
+        'rows': args.rows,
+        'ratings': args.ratings,
+        'rounds': args.rounds,
+        'latency_ms': args.latency_ms,
+        'warmup': warmup,
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'runs': runs
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, 'latest_load_sessions.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# Benchmarks of each stage of the WatchNext pipeline on synthetic datasets
+# (see generate_datasets.py): wall time, CPU time and peak memory per stage,
+# compared against a stored baseline.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py --rows 1000000 --save-baseline
+#   python benchmarks/run_benchmarks.py --rows 1000000            # compare with baseline
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from contextlib import redirect_stdout
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import pandas as pd
+
+import pipeline
+from covers import make_thumbnail, POSTER_SIZE
+from fetching_connections import get_ordered_connections
+
+from fake_fetchers import make_fake_connections, fake_cover_bytes
+from generate_datasets import generate
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Regressions smaller than this are considered noise
+MIN_SECONDS_DIFFERENCE = 0.05
+
+
+def measure(results, stage, func, *args, **kwargs):
+
+    '''
+    Run func, storing its wall time, CPU time, peak traced memory and number of rows in results[stage].
+    '''
+
+    gc.collect()
+    tracemalloc.start()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+
+    result = func(*args, **kwargs)
+
+    seconds, cpu_seconds = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    main_result = result[0] if isinstance(result, tuple) else result
+    results[stage] = {
+        'seconds': round(seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'peak_mb': round(peak / 2**20, 2),
+        'rows': len(main_result) if isinstance(main_result, (pd.DataFrame, pd.Series)) else None,
+    }
+
+    return result
+
+
+def run(data_dir, num_connections=5, num_covers=20):
+
+    results = {}
+
+    datasets = measure(results, 'unzip_and_load_datasets', pipeline.unzip_and_load_datasets, data_dir)
+    df_imdb_titles, df_imdb_ratings, df_imdb_episodes = datasets
+    df_user_ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'))
+
+    df_imdb_titles = measure(results, 'merge_ratings', pipeline.merge_ratings, df_imdb_titles, df_imdb_ratings)
+    df_episodes = measure(results, 'merge_episode_info', pipeline.merge_episode_info, df_imdb_episodes, df_imdb_titles)
+    df_films, df_series = measure(results, 'split_content', pipeline.split_content, df_imdb_titles)
+
+    df_films = measure(results, 'normalise_content_films', pipeline.normalise_content, df_films, 'Films')
+    df_films.rename(columns={'score': 'filmScore', 'scoreRaw': 'filmScoreRaw'}, inplace=True)
+    df_series = measure(results, 'normalise_content_series', pipeline.normalise_content, df_series, 'Series')
+    df_series.rename(columns={'score': 'seriesScore', 'scoreRaw': 'seriesScoreRaw'}, inplace=True)
+    df_episodes = measure(results, 'normalise_content_episodes', pipeline.normalise_content, df_episodes, 'Episodes')
+
+    episode_metric = measure(results, 'calculate_episode_metric', pipeline.calculate_episode_metric, df_episodes)
+    runtime_metric = measure(results, 'calculate_runtime_metric', pipeline.calculate_runtime_metric, df_episodes)
+    episode_metric.rename(columns={'score': 'episodeScore'}, inplace=True)
+    df_series = measure(results, 'add_series_metrics', pipeline.add_series_metrics, df_series, episode_metric, runtime_metric)
+
+    episode_index = measure(results, 'build_episode_index', pipeline.build_episode_index, df_imdb_titles, df_imdb_episodes)
+    measure(results, 'get_new_episodes', pipeline.get_new_episodes, episode_index, df_user_ratings)
+
+    watched_tconst = df_user_ratings['tconst']
+    measure(results, 'filter_films', pipeline.filter_films, df_films, watched_tconst, False, 2.0, 20)
+    measure(results, 'filter_series', pipeline.filter_series, df_series, watched_tconst, False, False, 5, 20)
+
+    count_connections, find_connections = make_fake_connections(df_imdb_titles)
+    measure(
+        results, 'get_ordered_connections', get_ordered_connections,
+        df_imdb_titles, num_connections, watched_tconst,
+        count_connections=count_connections, find_connections=find_connections
+    )
+
+    img_data = fake_cover_bytes()
+    measure(results, 'resize_covers', lambda: [make_thumbnail(img_data, POSTER_SIZE) for _ in range(num_covers)])
+
+    return results
+
+
+def compare(results, baseline, threshold):
+
+    '''
+    Print results next to the baseline and return the stages that regressed by more than threshold.
+    '''
+
+    regressions = []
+    print('\n{:<28} {:>10} {:>10} {:>8} {:>10} {:>10}'.format('Stage', 'Base (s)', 'Now (s)', 'Change', 'Base (MB)', 'Now (MB)'))
+
+    for stage, now in results.items():
+        base = baseline.get(stage)
+        if base is None:
+            print('{:<28} {:>10} {:>10.3f}'.format(stage, '-', now['seconds']))
+            continue
+
+        change = (now['seconds'] - base['seconds']) / base['seconds'] if base['seconds'] > 0 else 0
+        is_slower = change > threshold and now['seconds'] - base['seconds'] > MIN_SECONDS_DIFFERENCE
+        uses_more_memory = now['peak_mb'] > (1 + threshold) * base['peak_mb'] and now['peak_mb'] - base['peak_mb'] > 1
+        if is_slower or uses_more_memory:
+            regressions.append(stage)
+
+        print('{:<28} {:>10.3f} {:>10.3f} {:>+7.0%} {:>10.1f} {:>10.1f}{}'.format(
+            stage, base['seconds'], now['seconds'], change, base['peak_mb'], now['peak_mb'],
+            '  <-- REGRESSION' if stage in regressions else ''
+        ))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the WatchNext pipeline on synthetic datasets.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=None, help='default: benchmarks/results/baseline_<rows>.json')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as a regression')
+    parser.add_argument('--verbose', action='store_true', help='show the progress messages of the pipeline')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows))
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    # Progress messages of the pipeline are not part of the report
+    with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stderr if args.verbose else devnull):
+        results = run(data_dir)
+
+    print('{:<28} {:>10} {:>10} {:>10} {:>10}'.format('Stage', 'Wall (s)', 'CPU (s)', 'Peak (MB)', 'Rows'))
+    for stage, result in results.items():
+        print('{:<28} {:>10.3f} {:>10.3f} {:>10.1f} {:>10}'.format(
+            stage, result['seconds'], result['cpu_seconds'], result['peak_mb'], result['rows'] if result['rows'] is not None else '-'
+        ))
+
+    report = {
+        'rows': args.rows,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'stages': results
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    baseline_path = args.baseline or os.path.join(RESULTS_DIR, 'baseline_{}.json'.format(args.rows))
+
+    with open(os.path.join(RESULTS_DIR, 'latest_{}.json'.format(args.rows)), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Baseline saved to {}'.format(baseline_path))
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print('No baseline found at {} (run with --save-baseline)'.format(baseline_path))
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline['stages'], args.threshold)
+    if regressions:
+        print('\nRegressions: {}'.format(', '.join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# Memory of several worker processes holding the score tables, with and
+# without shared tables (see shared_tables.py): each worker either maps the
+# published Arrow files or unpickles its own copy of the snapshot, reads every
+# column, and reports its proportional set size (PSS: shared pages are split
+# between the processes that map them, so the PSS of all workers adds up to the
+# memory they use on the host). Linux only (reads /proc/self/smaps_rollup).
+#
+# Usage:
+#   python benchmarks/shared_workers.py --rows 1000000 --workers 1 2 4
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import redirect_stdout
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from generate_datasets import generate
+
+# 'none' only imports the libraries: the memory every worker needs anyway
+MODES = ['none', 'shared', 'private']
+
+
+def pss_mb():
+
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) / 2**10
+
+    return None
+
+
+def read_every_column(tables):
+
+    '''
+    Touch the data of every column, as serving rankings eventually does.
+    '''
+
+    frames = [tables[name] for name in ['all_titles', 'episodes', 'films', 'series']] + [tables['episode_index']['episodes']]
+
+    for df in frames:
+        for col in df.columns:
+            if df[col].dtype.kind in 'biuf':
+                df[col].sum()
+            else:
+                df[col].str.startswith('tt').sum()
+
+
+def run_worker(mode, version):
+
+    # Imported here so that WATCHNEXT_SNAPSHOT_DIR (set by the parent) is used
+    import shared_tables
+    import snapshots
+
+    start = time.perf_counter()
+    if mode == 'shared':
+        tables = shared_tables.attach(version)
+    elif mode == 'private':
+        tables = snapshots.load_score_tables(version)
+    seconds = time.perf_counter() - start
+
+    if mode != 'none':
+        read_every_column(tables)
+    gc.collect()
+
+    return {'load_seconds': round(seconds, 4), 'pss_mb': round(pss_mb(), 1)}
+
+
+def measure_workers(mode, num_workers, data_dir, version):
+
+    '''
+    Start num_workers workers, wait until all of them hold the tables, then stop them.
+    '''
+
+    command = [sys.executable, os.path.abspath(__file__), '--data-dir', data_dir, '--worker', mode, '--version', version]
+    workers = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for _ in range(num_workers)]
+
+    # Every worker reports once it holds the tables, and waits for its stdin to close
+    reports = [json.loads(worker.stdout.readline()) for worker in workers]
+
+    for worker in workers:
+        worker.stdin.close()
+        worker.wait()
+
+    return {
+        'workers': num_workers,
+        'total_pss_mb': round(sum(report['pss_mb'] for report in reports), 1),
+        'max_load_seconds': max(report['load_seconds'] for report in reports)
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Memory of WatchNext workers with and without shared tables.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--version', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows))
+
+    # Worker process: report, then hold the tables until the parent closes stdin
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.worker, args.version)), flush=True)
+        sys.stdin.read()
+        return 0
+
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+
+        os.environ['WATCHNEXT_SNAPSHOT_DIR'] = snapshot_dir
+
+        import pipeline
+        import shared_tables
+        import snapshots
+
+        version = 'benchmark'
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            tables = pipeline.compute_score_tables(data_dir)
+        snapshots.save_score_tables(tables, version)
+        shared_tables.publish(tables, version)
+        del tables
+
+        print('{:<10} {:>8} {:>16} {:>18}'.format('Mode', 'Workers', 'Total PSS (MB)', 'Load/attach (s)'))
+        for mode in MODES:
+            for num_workers in args.workers:
+                result = measure_workers(mode, num_workers, data_dir, version)
+                print('{:<10} {:>8} {:>16.1f} {:>18.4f}'.format(
+                    mode, num_workers, result['total_pss_mb'], result['max_load_seconds']
+                ))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# Cold start of the scoring pipeline run as a dependency graph (see dag.py):
+# wall time with different numbers of threads, compared with the sum of the
+# times of its stages (running them one after the other) and the critical path
+# (the slowest chain of dependent stages, the best parallel time).
+#
+# Usage:
+#   python benchmarks/startup_graph.py --rows 1000000 --workers 1 2 4
+import argparse
+import os
+import sys
+import time
+
+from contextlib import redirect_stdout
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import dag
+import instrumentation
+import pipeline
+
+from generate_datasets import generate
+
+
+def run(datasets, num_workers):
+
+    '''
+    Build the score tables on num_workers threads and return (wall seconds, {stage: seconds}).
+    '''
+
+    stage_names = {spec['name'] for spec in pipeline.score_stages()}
+    instrumentation.RECORDS.clear()
+
+    start = time.perf_counter()
+    pipeline.build_score_tables(datasets, max_workers=num_workers)
+    seconds = time.perf_counter() - start
+
+    return seconds, {record['name']: record['wall_seconds'] for record in instrumentation.RECORDS if record['name'] in stage_names}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Cold start of the WatchNext pipeline as a dependency graph.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of titles of the synthetic datasets')
+    parser.add_argument('--data-dir', default=None, help='default: benchmarks/data/<rows> (generated if missing)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or os.path.join(BENCHMARKS_DIR, 'data', str(args.rows))
+    if not os.path.exists(os.path.join(data_dir, 'title.basics.tsv.gz')):
+        generate(args.rows, data_dir, args.seed)
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        datasets = pipeline.unzip_and_load_datasets(data_dir)
+
+    print('{:>8} {:>10} {:>16} {:>18}'.format('Workers', 'Wall (s)', 'Sum stages (s)', 'Critical path (s)'))
+    for num_workers in args.workers:
+        seconds, stage_seconds = run(datasets, num_workers)
+        _, critical_seconds = dag.critical_path(pipeline.score_stages(), stage_seconds)
+        print('{:>8} {:>10.2f} {:>16.2f} {:>18.2f}'.format(num_workers, seconds, sum(stage_seconds.values()), critical_seconds))
+
+    # Stages measured alone (one thread): the critical path without contention
+    _, stage_seconds = run(datasets, 1)
+    path, critical_seconds = dag.critical_path(pipeline.score_stages(), stage_seconds)
+    print('Critical path: {} ({:.2f} s of {:.2f} s)'.format(' -> '.join(path), critical_seconds, sum(stage_seconds.values())))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
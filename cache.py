@@ -0,0 +1,269 @@
+# Caching layer that does not depend on Streamlit, so that the pipeline
+# can be cached when it runs from the command line or a scheduled job.
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from config import CACHE_DIR, CACHE_MAX_MB
+
+
+def hash_value(value):
+
+    '''
+    Return a stable hex digest of a function argument.
+    DataFrames, Series and arrays are hashed by content, containers recursively.
+    '''
+
+    h = hashlib.sha1()
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        columns = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        h.update(repr(list(columns)).encode())
+    elif isinstance(value, np.ndarray):
+        h.update(pd.util.hash_array(value.ravel()).tobytes() if value.dtype == object else value.tobytes())
+        h.update(repr((value.dtype, value.shape)).encode())
+    elif isinstance(value, (list, tuple)):
+        h.update(type(value).__name__.encode())
+        for v in value:
+            h.update(hash_value(v).encode())
+    elif isinstance(value, dict):
+        for k in sorted(value, key=repr):
+            h.update(repr(k).encode())
+            h.update(hash_value(value[k]).encode())
+    else:
+        h.update(repr(value).encode())
+
+    return h.hexdigest()
+
+
+# Calls of each function of cached() served from memory, from disk, or run (misses)
+CACHED_STATS = defaultdict(lambda: {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+_stats_lock = threading.Lock()
+
+
+def count_call(name, outcome):
+
+    with _stats_lock:
+        CACHED_STATS[name][outcome] += 1
+
+
+def cached(persist=False, memory=True):
+
+    '''
+    Memoise a function by the content of its arguments.
+
+    persist: also pickle results to CACHE_DIR/<function name>/ so that they
+             survive between runs (e.g. downloads and web-scraping results)
+    memory: keep results in memory (unbounded). With persist, False only keeps them
+            on disk, for large results that would otherwise pile up (e.g. images)
+    '''
+
+    keep_in_memory = memory
+
+    def decorator(func):
+
+        memory = {}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            key = hash_value((args, kwargs))
+            if key in memory:
+                count_call(func.__name__, 'memory_hits')
+                return memory[key]
+
+            path = os.path.join(CACHE_DIR, func.__name__, '{}.pkl'.format(key))
+
+            if persist and os.path.exists(path):
+                count_call(func.__name__, 'disk_hits')
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+            else:
+                count_call(func.__name__, 'misses')
+                result = func(*args, **kwargs)
+                if persist:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # Write to a temporary file first so that an interrupted run never leaves a corrupt entry
+                    with open(path + '.tmp', 'wb') as f:
+                        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(path + '.tmp', path)
+
+            if keep_in_memory:
+                memory[key] = result
+            return result
+
+        def is_cached(*args, **kwargs):
+            key = hash_value((args, kwargs))
+            path = os.path.join(CACHE_DIR, func.__name__, '{}.pkl'.format(key))
+            return key in memory or (persist and os.path.exists(path))
+
+        wrapper.clear = memory.clear
+        wrapper.is_cached = is_cached   # Whether a call would be served from the cache
+
+        return wrapper
+
+    return decorator
+
+
+# Results of all versioned functions, least recently used first:
+# (function name, key) -> (result, size in bytes)
+_versioned_entries = OrderedDict()
+_versioned_bytes = 0
+_versioned_lock = threading.Lock()
+
+
+def size_in_bytes(value):
+
+    '''
+    Approximate memory held by a result (DataFrames, arrays and containers of them).
+    '''
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(size_in_bytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(size_in_bytes(v) for v in value.values())
+
+    return 0
+
+
+def share(value):
+
+    '''
+    Shallow copies of cached DataFrames, so that callers can rename or add columns
+    (even inplace) without changing the cached ones. Data is only copied if a
+    caller writes to it: this needs the copy-on-write of pandas 3 (see requirements.txt).
+    '''
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, (list, tuple)):
+        return type(value)(share(v) for v in value)
+
+    return value
+
+
+def evict(max_bytes):
+
+    '''
+    Drop least recently used results until the cache fits in max_bytes (call with the lock held).
+    '''
+
+    global _versioned_bytes
+
+    while _versioned_entries and _versioned_bytes > max_bytes:
+        _, (_, size) = _versioned_entries.popitem(last=False)
+        _versioned_bytes -= size
+
+
+def versioned(max_mb=CACHE_MAX_MB):
+
+    '''
+    Memoise a function by the dataset version (its first argument) and its other
+    small arguments. Arguments whose name starts with an underscore (e.g. the
+    DataFrames derived from that version) are not part of the key, so a hit costs
+    a dictionary lookup instead of hashing them.
+
+    Results are kept in memory, shared by all versioned functions, and the least
+    recently used ones are evicted once they take more than max_mb.
+    '''
+
+    def decorator(func):
+
+        signature = inspect.signature(func)
+        key_names = [name for name in signature.parameters if not name.startswith('_')]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            global _versioned_bytes
+
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = []
+            for name in key_names:
+                value = arguments.arguments[name]
+                try:
+                    hash(value)
+                except TypeError:
+                    value = hash_value(value)   # Small unhashable arguments (e.g. lists of tconsts)
+                key.append(value)
+            key = (func.__qualname__, tuple(key))
+
+            with _versioned_lock:
+                if key in _versioned_entries:
+                    _versioned_entries.move_to_end(key)
+                    return share(_versioned_entries[key][0])
+
+            result = func(*args, **kwargs)
+            size = size_in_bytes(result)
+
+            with _versioned_lock:
+                if key not in _versioned_entries and size <= max_mb * 2**20:
+                    _versioned_entries[key] = (result, size)
+                    _versioned_bytes += size
+                    evict(max_mb * 2**20)
+
+            return share(result)
+
+        wrapper.clear = lambda: clear_versioned(func.__qualname__)
+
+        return wrapper
+
+    return decorator
+
+
+def clear_versioned(name=None, version=None):
+
+    '''
+    Drop the results of one versioned function (all of them if name is None),
+    only those of a dataset version if version is given.
+    '''
+
+    global _versioned_bytes
+
+    with _versioned_lock:
+        for key in [key for key in _versioned_entries if (name is None or key[0] == name) and (version is None or key[1][:1] == (version,))]:
+            _, size = _versioned_entries.pop(key)
+            _versioned_bytes -= size
+
+
+def versioned_summary():
+
+    '''
+    Number of cached results and memory they take (in MB), per versioned function.
+    '''
+
+    summary = {}
+
+    with _versioned_lock:
+        for (name, _), (_, size) in _versioned_entries.items():
+            entry = summary.setdefault(name, {'function': name, 'entries': 0, 'mb': 0.0})
+            entry['entries'] += 1
+            entry['mb'] += size / 2**20
+
+    return [dict(entry, mb=round(entry['mb'], 1)) for entry in summary.values()]
+
+
+def cached_summary():
+
+    '''
+    Calls served from memory, from disk, and misses, per function of cached().
+    '''
+
+    with _stats_lock:
+        return [dict(function=name, **stats) for name, stats in sorted(CACHED_STATS.items())]
@@ -0,0 +1,71 @@
+# Settings shared by the Streamlit app and the command-line interface.
+# Every setting can be overridden with an environment variable.
+import os
+
+# Where IMDB datasets are downloaded from. WATCHNEXT_DATA_DIR takes precedence
+# and points to a local folder with title.basics.tsv.gz, title.ratings.tsv.gz
+# and title.episode.tsv.gz (e.g. a mirror refreshed by a nightly job).
+DATASETS_URL = os.environ.get('WATCHNEXT_DATASETS_URL', 'https://datasets.imdbws.com')
+DATA_DIR = os.environ.get('WATCHNEXT_DATA_DIR')
+
+# On-disk cache used outside of Streamlit (CLI, scheduled jobs)
+CACHE_DIR = os.environ.get('WATCHNEXT_CACHE_DIR', '.watchnext_cache')
+
+# Memory (in MB) of the in-memory cache of the app (see cache.versioned)
+CACHE_MAX_MB = float(os.environ.get('WATCHNEXT_CACHE_MAX_MB', 4096))
+
+# IMDB website scraped for ratings and connections (e.g. a local stand-in for load tests)
+IMDB_URL = os.environ.get('WATCHNEXT_IMDB_URL', 'https://www.imdb.com')
+
+# Outbound requests (see telemetry.http_get): retries of connection errors, rate
+# limiting (429) and server errors, waiting REQUEST_BACKOFF_SECONDS, then twice as long each time
+REQUEST_RETRIES = int(os.environ.get('WATCHNEXT_REQUEST_RETRIES', 2))
+REQUEST_BACKOFF_SECONDS = float(os.environ.get('WATCHNEXT_REQUEST_BACKOFF_SECONDS', 0.5))
+
+# IMDB user whose ratings are used to filter watched content
+IMDB_USER_ID = os.environ.get('WATCHNEXT_IMDB_USER', 'ur103598244')
+
+# IMDB ratings export files (one per user, named after the user id, e.g. ur103598244.csv)
+# imported when ratings cannot be scraped, and where they are stored (see ratings_store.py)
+RATINGS_EXPORTS_DIR = os.environ.get('WATCHNEXT_RATINGS_EXPORTS_DIR', 'IMDB_Data')
+RATINGS_STORE_DIR = os.environ.get('WATCHNEXT_RATINGS_STORE_DIR', 'Ratings')
+
+# Folder where top rankings are exported
+RANKINGS_DIR = os.environ.get('WATCHNEXT_RANKINGS_DIR', 'Rankings')
+
+# Folder where the instrumentation of the pipeline writes its JSON logs
+LOG_DIR = os.environ.get('WATCHNEXT_LOG_DIR', 'Logs')
+
+# Folder with the persisted score tables and indexes of each dataset version
+SNAPSHOT_DIR = os.environ.get('WATCHNEXT_SNAPSHOT_DIR', 'Snapshots')
+
+# New dataset versions are looked for every SNAPSHOT_CHECK_SECONDS and built in the
+# background (see snapshot_manager.py). Older versions are freed once no session
+# has used them for SNAPSHOT_IDLE_SECONDS.
+SNAPSHOT_CHECK_SECONDS = float(os.environ.get('WATCHNEXT_SNAPSHOT_CHECK_SECONDS', 600))
+SNAPSHOT_IDLE_SECONDS = float(os.environ.get('WATCHNEXT_SNAPSHOT_IDLE_SECONDS', 1800))
+
+# Threads running the independent stages of the scoring pipeline at once (see dag.py)
+STARTUP_WORKERS = int(os.environ.get('WATCHNEXT_STARTUP_WORKERS', 4))
+
+# HTTP API of the rankings (see ranking_api.py): address and number of worker processes
+API_HOST = os.environ.get('WATCHNEXT_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('WATCHNEXT_API_PORT', 8502))
+API_WORKERS = int(os.environ.get('WATCHNEXT_API_WORKERS', 4))
+
+# Engine of the scoring pipeline: 'pandas' (pipeline.py) or 'polars'
+# (pipeline_polars.py, multi-threaded, needs polars and pyarrow)
+ENGINE = os.environ.get('WATCHNEXT_ENGINE', 'pandas')
+
+# How covers are displayed: 'server' (downloaded, decoded and resized by the app)
+# or 'browser' (the app only resolves their URLs, browsers load them from IMDB)
+COVER_MODE = os.environ.get('WATCHNEXT_COVER_MODE', 'server')
+
+# Threads that download and decode covers in 'server' mode
+COVER_WORKERS = int(os.environ.get('WATCHNEXT_COVER_WORKERS', 8))
+
+# Background cache warmer of the app (see warmer.py): number of top titles of each
+# default ranking and of watched titles whose covers and connections are prefetched,
+# and maximum number of network requests it makes per process (0 disables it)
+WARMER_TOP_N = int(os.environ.get('WATCHNEXT_WARMER_TOP_N', 20))
+WARMER_MAX_REQUESTS = int(os.environ.get('WATCHNEXT_WARMER_MAX_REQUESTS', 200))
@@ -0,0 +1,155 @@
+# Cover images of titles, retrieved through the IMDB API (Cinemagoer).
+# requests, PIL and Cinemagoer are imported on first use so that they are
+# not loaded at startup by sessions that never display covers.
+import functools
+
+from cache import cached
+from config import COVER_WORKERS
+from telemetry import http_get, measured_request
+from warmer import foreground
+
+# Display sizes of posters and episode stills: about twice the width of a column
+# of the grid (5 columns in the wide layout), so that they are sharp on HiDPI screens
+POSTER_SIZE = (600, 900)
+STILL_SIZE = (600, 600)
+
+# JPEG quality of the thumbnails sent to the browser
+THUMBNAIL_QUALITY = 85
+
+# Widths (in pixels) of the images that browsers can pick from (see cover_html)
+BROWSER_WIDTHS = [190, 380, 760]
+
+
+# Shared by sessions (and prefetched by warmer.py)
+@cached(persist=True)
+def get_cover_url(tconst):
+
+    '''
+    Return the URL of the full-size cover of a title (None if it has none).
+    '''
+
+    from fetching_connections import get_cinemagoer
+
+    # TO-DO: Get image link from the web scraping
+    with measured_request('cinemagoer'):
+        content = get_cinemagoer().get_movie(tconst[2:])
+
+    return content.get('full-size cover url')
+
+
+def download_cover(tconst):
+
+    '''
+    Return the encoded bytes of the full-size cover of a title.
+    '''
+
+    return http_get(get_cover_url(tconst)).content
+
+
+# Shared by sessions (and prefetched by warmer.py). Only cached on disk: full-size
+# covers are large, and sessions keep the thumbnails they display (see app_functions)
+@cached(persist=True, memory=False)
+def get_cover(tconst):
+    return download_cover(tconst)
+
+
+def make_thumbnail(img_data, size=POSTER_SIZE, quality=THUMBNAIL_QUALITY):
+
+    '''
+    Decode an encoded image, crop it to the aspect ratio of size (keeping its centre)
+    and resize it, returning it encoded as JPEG.
+
+    JPEGs larger than size are decoded at a reduced resolution (1/2, 1/4 or 1/8 of
+    their size, but not smaller than size), which skips most of the decoding work.
+    Based on https://stackoverflow.com/questions/7391945/how-do-i-read-image-data-from-a-url-in-python
+    '''
+
+    from PIL import Image, ImageOps
+    from io import BytesIO
+
+    image = Image.open(BytesIO(img_data))
+    image.draft('RGB', size)    # Only JPEGs support it, other formats are decoded at full size
+
+    thumbnail = ImageOps.fit(image.convert('RGB'), size, method=Image.Resampling.LANCZOS)
+
+    buffer = BytesIO()
+    thumbnail.save(buffer, format='JPEG', quality=quality)
+
+    return buffer.getvalue()
+
+
+# Pool shared by sessions, created on first use
+@functools.lru_cache(maxsize=None)
+def get_pool(num_workers=COVER_WORKERS):
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    return ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='watchnext-covers')
+
+
+def fetch_cover(tconst, size=POSTER_SIZE):
+
+    # The background warmer waits while covers are being displayed
+    with foreground():
+        img_data = get_cover(tconst)
+
+    return make_thumbnail(img_data, size)
+
+
+def fetch_covers(tconsts, size=POSTER_SIZE):
+
+    '''
+    Thumbnails of the covers of tconsts, downloaded and decoded in parallel by a pool
+    of threads (PIL releases the GIL while decoding, resizing and encoding).
+    '''
+
+    return list(get_pool().map(lambda tconst: fetch_cover(tconst, size), tconsts))
+
+
+def fetch_cover_url(tconst):
+
+    # The background warmer waits while covers are being displayed
+    with foreground():
+        return get_cover_url(tconst)
+
+
+def sized_cover_url(url, width):
+
+    '''
+    URL of a cover scaled to width by the IMDB image server, e.g.
+    .../M/MV5B...@._V1_.jpg -> .../M/MV5B...@._V1_SX380.jpg
+    '''
+
+    if '._V1_' not in url:
+        return url
+
+    return '{}._V1_SX{}.jpg'.format(url.split('._V1_')[0], width)
+
+
+def cover_html(url, caption, size=POSTER_SIZE):
+
+    '''
+    HTML of a cover loaded by the browser: it picks the smallest image wide enough for
+    its column (srcset) and only loads it once it is about to be scrolled into view.
+    The box keeps the aspect ratio of size so that the page does not jump while loading.
+    '''
+
+    from html import escape
+
+    width, height = size
+    style = 'width:100%;aspect-ratio:{}/{};object-fit:cover;'.format(width, height)
+
+    if url is None:
+        image = '<div style="{}background:#333;"></div>'.format(style)
+    else:
+        image = '<img src="{}" srcset="{}" sizes="20vw" loading="lazy" decoding="async" alt="{}" style="{}">'.format(
+            escape(sized_cover_url(url, BROWSER_WIDTHS[1])),
+            escape(', '.join('{} {}w'.format(sized_cover_url(url, w), w) for w in BROWSER_WIDTHS)),
+            escape(caption),
+            style
+        )
+
+    return '<figure style="margin:0">{}<figcaption style="text-align:center;font-size:0.875rem;opacity:0.6">{}</figcaption></figure>'.format(
+        image,
+        escape(caption)
+    )
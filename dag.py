@@ -0,0 +1,126 @@
+# Run the stages of a pipeline as a dependency graph.
+#
+# A stage is a dict with a name, a function, the names of its inputs (passed to
+# the function in that order) and the names of its outputs (the function returns
+# a single value, or a tuple with one value per output):
+#
+#   {'name': 'Merging ratings', 'func': merge_ratings, 'inputs': ['imdb_titles', 'imdb_ratings'], 'outputs': ['all_titles']}
+#
+# Every stage starts as soon as all its inputs are available, on a thread pool:
+# independent stages overlap, so the total time approaches the critical path
+# (the slowest chain of dependent stages) instead of the sum of all stages.
+# Threads share the DataFrames without copying them, and pandas and numpy
+# release the GIL in most of their heavy operations (and downloads do too).
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from instrumentation import count_rows, stage
+
+
+def check_graph(stages, inputs=()):
+
+    '''
+    Return the stages in an order where every stage comes after those it depends
+    on. Raise ValueError if an output is produced twice, an input is never
+    produced, or stages depend on each other in a cycle.
+    '''
+
+    producers = {}
+    for spec in stages:
+        for output in spec['outputs']:
+            if output in producers or output in inputs:
+                raise ValueError("'{}' is produced twice (by '{}')".format(output, spec['name']))
+            producers[output] = spec['name']
+
+    available, ordered, remaining = set(inputs), [], list(stages)
+
+    while remaining:
+        ready = [spec for spec in remaining if all(name in available for name in spec['inputs'])]
+        if not ready:
+            missing = {name for spec in remaining for name in spec['inputs'] if name not in available and name not in producers}
+            if missing:
+                raise ValueError('Inputs never produced: {}'.format(sorted(missing)))
+            raise ValueError('Cycle between stages: {}'.format([spec['name'] for spec in remaining]))
+        for spec in ready:
+            available.update(spec['outputs'])
+            ordered.append(spec)
+        remaining = [spec for spec in remaining if spec not in ready]
+
+    return ordered
+
+
+def run_stage(spec, args):
+
+    '''
+    Run a stage (measured as an instrumentation stage) and return {output: value}.
+    '''
+
+    with stage(spec['name']) as record:
+        result = spec['func'](*args)
+        values = result if len(spec['outputs']) > 1 else (result,)
+        record['rows'] = count_rows(result)
+
+    return dict(zip(spec['outputs'], values))
+
+
+def run_graph(stages, inputs=None, max_workers=4, on_done=None):
+
+    '''
+    Run stages (see check_graph) on max_workers threads, from the given
+    {name: value} inputs, and return every input and output by name.
+
+    on_done(spec, seconds) is called (in the calling thread) as each stage ends.
+    If a stage fails, the stages not started yet are cancelled and its error is raised.
+    '''
+
+    results = dict(inputs or {})
+    pending = check_graph(stages, results)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='watchnext-stage') as pool:
+
+        running = {}
+
+        while pending or running:
+
+            ready = [spec for spec in pending if all(name in results for name in spec['inputs'])]
+            for spec in ready:
+                args = [results[name] for name in spec['inputs']]
+                running[pool.submit(run_stage, spec, args)] = (spec, time.perf_counter())
+            pending = [spec for spec in pending if spec not in ready]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                spec, start = running.pop(future)
+                if future.exception() is not None:
+                    for other in running:
+                        other.cancel()
+                    raise future.exception()
+                results.update(future.result())
+                if on_done is not None:
+                    on_done(spec, time.perf_counter() - start)
+
+    return results
+
+
+def critical_path(stages, seconds):
+
+    '''
+    Return (names, seconds) of the slowest chain of dependent stages, given the
+    seconds each stage took ({name: seconds}): the shortest time run_graph can take.
+    '''
+
+    producers = {output: spec for spec in stages for output in spec['outputs']}
+    finish = {}
+
+    for spec in check_graph(stages, [name for spec in stages for name in spec['inputs'] if name not in producers]):
+        parents = {producers[name]['name'] for name in spec['inputs'] if name in producers}
+        slowest = max(parents, key=lambda name: finish[name][0], default=None)
+        path = finish[slowest][1] if slowest is not None else []
+        start = finish[slowest][0] if slowest is not None else 0.0
+        finish[spec['name']] = (start + seconds.get(spec['name'], 0.0), path + [spec['name']])
+
+    end, path = max(finish.values(), key=lambda item: item[0], default=(0.0, []))
+
+    return path, end
@@ -0,0 +1,176 @@
+# Faceted filtering of the FILMS and SERIES panels.
+#
+# The rows of a score table are put in ranked order (best score first) once per
+# dataset version, and every facet value (a genre, a decade, a title type or a
+# runtime band) gets a bitmap over that order: bit i is set when the i-th best
+# title has that value. Selected values of a facet are ORed, facets are ANDed
+# with the other filters of the panel (also bitmaps), and the top titles are the
+# first set bits of the result. The bitmaps are only combined chunk by chunk
+# until enough titles are found, so the cost of a rerun depends on how deep in
+# the ranking the titles are, not on the size of the table or the number of
+# active facets.
+import datetime
+import functools
+
+import numpy as np
+import pandas as pd
+
+FACETS = ['genres', 'decade', 'titleType', 'runtime']
+
+FACET_LABELS = {'genres': 'Genres', 'decade': 'Decades', 'titleType': 'Types', 'runtime': 'Runtime'}
+
+# Unrounded score (ranked order), runtime (minutes) and displayed columns of each table (same as queries.QUERIES)
+TABLES = {
+    'films': {
+        'score': 'filmScoreRaw',
+        'runtime': 'runtimeMinutes',
+        'columns': ['tconst', 'titleType', 'primaryTitle', 'startYear', 'runtimeMinutes', 'averageRating', 'numVotes', 'filmScore']
+    },
+    'series': {
+        'score': 'seriesScoreRaw',
+        'runtime': 'totalRuntime',
+        'columns': ['tconst', 'titleType', 'primaryTitle', 'startYear', 'endYear', 'averageRating', 'numVotes', 'seriesScore', 'episodeScore', 'totalRuntime']
+    }
+}
+
+# (label, minimum minutes, maximum minutes) of the runtime bands of each table
+RUNTIME_BANDS = {
+    'films': [
+        ('Under 1h30', 0, 90),
+        ('1h30 to 2h', 90, 120),
+        ('2h to 2h30', 120, 150),
+        ('Over 2h30', 150, np.inf)
+    ],
+    'series': [
+        ('Under 10h', 0, 10*60),
+        ('10h to 1 day', 10*60, 24*60),
+        ('1 to 3 days', 24*60, 3*24*60),
+        ('Over 3 days', 3*24*60, np.inf)
+    ]
+}
+
+# Columns stored as text with '\N' for missing values (see queries.INTEGER_COLUMNS)
+INTEGER_COLUMNS = ['startYear', 'endYear', 'runtimeMinutes']
+
+# Bytes of every bitmap combined at a time (8 titles per byte)
+CHUNK_BYTES = 1024
+
+
+def to_bitmap(mask):
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+
+def value_bitmaps(values):
+
+    '''
+    {value: bitmap of the rows with that value} for a Series in ranked order (missing values are skipped).
+    '''
+
+    codes, uniques = pd.factorize(values, sort=True)
+
+    return {value: to_bitmap(codes == code) for code, value in enumerate(uniques)}
+
+
+def build_index(df, table):
+
+    '''
+    Ranked order and facet bitmaps of a score table ('films' or 'series').
+    '''
+
+    spec = TABLES[table]
+
+    # Same order as the SQL panels: best unrounded score first, then tconst
+    df_sorted = df.sort_values([spec['score'], 'tconst'], ascending=[False, True], kind='stable')
+    df_ranked = df_sorted[spec['columns']].copy()
+    for col in INTEGER_COLUMNS:
+        if col in df_ranked.columns and not pd.api.types.is_integer_dtype(df_ranked[col]):
+            df_ranked[col] = pd.to_numeric(df_ranked[col], errors='coerce').astype('Int64')
+    df_ranked.index = np.arange(len(df_ranked))
+
+    runtime = pd.to_numeric(df_ranked[spec['runtime']], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    start_year = df_ranked['startYear'].to_numpy(dtype=float, na_value=np.nan)
+
+    genres = df_sorted['genres'].reset_index(drop=True)
+    genre_dummies = genres.where(genres != '\\N').str.get_dummies(sep=',')
+
+    decades = pd.Series(start_year // 10 * 10).map(lambda decade: '{:.0f}s'.format(decade), na_action='ignore')
+
+    facets = {
+        'genres': {genre: to_bitmap(genre_dummies[genre].to_numpy()) for genre in genre_dummies.columns},
+        'decade': value_bitmaps(decades),
+        'titleType': value_bitmaps(df_ranked['titleType']),
+        'runtime': {label: to_bitmap((runtime >= low) & (runtime < high)) for label, low, high in RUNTIME_BANDS[table]}
+    }
+
+    index = {'table': table, 'ranked': df_ranked, 'runtime': runtime, 'facets': facets}
+
+    # Ended series (whatever the year of the rerun: the index is rebuilt with every dataset version)
+    if 'endYear' in df_ranked.columns:
+        index['finished'] = to_bitmap(df_ranked['endYear'].to_numpy(dtype=float, na_value=np.nan) <= datetime.date.today().year)
+
+    return index
+
+
+def facet_options(index, facet):
+
+    '''
+    Values of a facet, in display order (runtime bands from shortest, decades from latest).
+    '''
+
+    values = list(index['facets'][facet])
+
+    return values[::-1] if facet == 'decade' else values
+
+
+def unwatched_bitmap(index, watched_tconst):
+    return to_bitmap(~index['ranked']['tconst'].isin(watched_tconst).to_numpy())
+
+
+def max_runtime_bitmap(index, max_minutes):
+    return to_bitmap(index['runtime'] <= max_minutes)
+
+
+def first_positions(clauses, num_rows, num_titles):
+
+    '''
+    Ranked positions of the first num_titles rows set in every clause, where a
+    clause is a list of bitmaps of which any can be set. Bitmaps are combined one
+    chunk at a time, and only until enough rows are found.
+    '''
+
+    num_bytes = (num_rows + 7) // 8
+    found, num_found = [], 0
+
+    for start in range(0, num_bytes, CHUNK_BYTES):
+
+        chunk = np.full(min(CHUNK_BYTES, num_bytes - start), 0xFF, dtype=np.uint8)
+        for bitmaps in clauses:
+            chunk &= functools.reduce(np.bitwise_or, [bitmap[start:start+CHUNK_BYTES] for bitmap in bitmaps])
+
+        positions = np.flatnonzero(np.unpackbits(chunk)) + 8*start
+        positions = positions[positions < num_rows][:num_titles - num_found]
+        found.append(positions)
+        num_found += len(positions)
+
+        if num_found == num_titles:
+            break
+
+    return np.concatenate(found) if found else np.array([], dtype=int)
+
+
+def top_titles(index, num_titles, selected=None, extra_clauses=()):
+
+    '''
+    Return the num_titles best titles of the index (a DataFrame ranked from 1)
+    with any of the selected values of every facet ({facet: [values]}, empty facets
+    are not filtered), and set in every bitmap clause of extra_clauses.
+    '''
+
+    clauses = [[index['facets'][facet][value] for value in values] for facet, values in (selected or {}).items() if values]
+    clauses += list(extra_clauses)
+
+    positions = first_positions(clauses, len(index['ranked']), num_titles)
+    df_top = index['ranked'].iloc[positions]
+    df_top.index = np.arange(1, 1+len(df_top))
+
+    return df_top
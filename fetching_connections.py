@@ -1,18 +1,28 @@
-from bs4 import BeautifulSoup
-from imdb import Cinemagoer
-import streamlit as st
 import pandas as pd
-import requests
+import functools
+import os
 
-import app_functions as af
+from cache import cached
+from config import IMDB_URL, RANKINGS_DIR
+from telemetry import http_get, measured_request
+from warmer import foreground
 
+# bs4, requests and Cinemagoer are imported on first use: they are only
+# needed when connections or covers are fetched, not to render the rankings.
 
-cg = Cinemagoer()
+
+# Access to the IMDB API, created on first use and shared afterwards
+@functools.lru_cache(maxsize=None)
+def get_cinemagoer():
+
+    from imdb import Cinemagoer
+
+    return Cinemagoer()
 
 
 # API does not return the total amount of connections due to a button
 # that needs to be clicked to 'see more' connections
-@st.cache_resource(show_spinner=False)
+@cached(persist=True)
 def get_num_connections(tconst, connection_type):
 
     '''
@@ -22,9 +32,11 @@ def get_num_connections(tconst, connection_type):
     as a maximum. 
     '''
 
-    url_user = 'https://www.imdb.com/title/{}/movieconnections/'.format(tconst)
+    from bs4 import BeautifulSoup
+
+    url_user = '{}/title/{}/movieconnections/'.format(IMDB_URL, tconst)
     user_agent = {'User-agent': 'Mozilla/5.0'}
-    r = requests.get(url_user, headers=user_agent)
+    r = http_get(url_user, headers=user_agent)
     soup = BeautifulSoup(r.content, 'html.parser')
 
     if connection_type == 'followed by':
@@ -42,7 +54,7 @@ def get_num_connections(tconst, connection_type):
 
 
 # Find connections of a given title
-@st.cache_resource(show_spinner=False)
+@cached(persist=True)
 def find_title_connections(tconst, connection_type):
 
     '''
@@ -52,7 +64,8 @@ def find_title_connections(tconst, connection_type):
     connection_type: string, one of 'follows' or 'followed by'
     '''
 
-    title = cg.get_movie(tconst[2:], info='connections') # ALTERNATIVE:ia.get_movie_connections(tconst[2:])
+    with measured_request('cinemagoer'):
+        title = get_cinemagoer().get_movie(tconst[2:], info='connections') # ALTERNATIVE:ia.get_movie_connections(tconst[2:])
     
     '''
     title.items() FORMAT
@@ -85,181 +98,243 @@ def find_title_connections(tconst, connection_type):
 
     return ps
 
-@st.cache_data(show_spinner=False)
-def get_ordered_connections(all_content, max_num_titles, seen_tconst):
+
+# If tconst has a prequel, tconst 'follows' the prequel. When listing the prequel 
+# in the table, it will say that the prequel is 'Followed by' tconst (and viceversa).
+# e.g. Terminator 2 'follows' The Terminator. The Terminator is 'Followed by' the Terminator 2.
+# e.g. Breaking Bad is 'followed by' El Camino. El Camino 'Follows' Breaking Bad.
+CONNECTION_TYPES = {
+    'follows': 'Followed by', 
+    'followed by': 'Follows'
+}
+
+CONNECTIONS_COLUMNS = ['tconst', 'primaryTitle', 'connection', 'titleType', 'startYear', 'endYear', 'runtimeMinutes', 'numVotes', 'averageRating']
+
+
+def find_franchise(all_content, tconst, tconst_title, seen_tconst, searched_tconsts,
+                   count_connections=get_num_connections, find_connections=find_title_connections):
 
     '''
-    Return at least max_num_titles unwatched titles.
+    Return a mini DataFrame with the title followed by its unwatched prequels and sequels
+    (in the order of IMDB), adding every title found to searched_tconsts.
     '''
 
-    # Create mini DataFrames for each title and their connections. Each one has the correct order of the connections.
-    # Then concat all of them together to get a DataFrame of connections.
-    mini_dfs = []
+    searched_tconsts.add(tconst)
+
+    # Put tconst already in resulting dataframe
+    mini_df = all_content.loc[all_content['tconst'] == tconst].copy()
+    
+    # Iterate through sequels and prequels
+    for conn_type in CONNECTION_TYPES.keys():
+        search_round = 1
+        num_connections = count_connections(tconst, conn_type)   # Web-scrape number of connections
+        
+        # Connection tconst are returned in the same order as on IMDB
+        connection_tconsts = find_connections(tconst, conn_type)
+        
+        print(
+            '{} - Search round {} ({}/{}): {}'.format(
+                conn_type,
+                search_round,
+                len(connection_tconsts),
+                num_connections, 
+                connection_tconsts
+            ), 
+            end='\n\n' if conn_type == 'followed by' else '\n'
+        )
+
+        if len(connection_tconsts) != 0:
+            for conn_tconst in connection_tconsts:
+                searched_tconsts.add(conn_tconst)   # Mark connections as seen
+
+            connection_rows = all_content.loc[all_content['tconst'].isin(connection_tconsts)].copy()
 
-    # Avoid searching for connections of a title 
-    # that has been previously searched.
-    searched_tconsts = set()
+            # Keep order of the list connection_tconsts in DataFrame
+            # https://stackoverflow.com/questions/23414161/pandas-isin-with-output-keeping-order-of-input-list
+            connection_rows['tconst_order'] = pd.Categorical(
+                values=connection_rows['tconst'],
+                categories=connection_tconsts,
+                ordered=True
+            )
 
-    # If tconst has a prequel, tconst 'follows' the prequel. When listing the prequel 
-    # in the table, it will say that the prequel is 'Followed by' tconst (and viceversa).
-    # e.g. Terminator 2 'follows' The Terminator. The Terminator is 'Followed by' the Terminator 2.
-    # e.g. Breaking Bad is 'followed by' El Camino. El Camino 'Follows' Breaking Bad.
-    connection_types = {
-        'follows': 'Followed by', 
-        'followed by': 'Follows'
-    }
+            connection_rows.sort_values('tconst_order', inplace=True)
 
-    # Go through each title in subset
-    num_titles_with_connections = 0
 
-    # Print out to the screen title being searched
-    log = st.empty()
+            # Connection rows is derived from a merge between all_content and ratings.
+            # Number of connections could be 1, but connection rows could be 0 for a 
+            # title that has not yet been launched and/or received any ratings.
+            if len(connection_rows) != 0:
+
+                # Define type of connection (e.g. Follows The Dark Knight (tconst)))
+                connection_rows['connection'] = '{} {} ({})'.format(
+                    CONNECTION_TYPES[conn_type],
+                    tconst_title,
+                    tconst
+                )
+
+                # Not all connections of tconst are retrieved through Cinemagoer due to an 
+                # expandable button. Therefore we need to iterate through the connections' 
+                # connections until the number of connections of tconst is reached.
+                while len(connection_rows) < num_connections:
+                    
+                    # First 5 prequels/sequels are retrieved initially
+                    # In the case of 6+ prequels/sequels, get 5th and find its successors
+                    last_tconst = connection_rows.iloc[-1]['tconst']
+                    last_tconst_title = connection_rows.loc[connection_rows['tconst'] == last_tconst, 'primaryTitle'].values[0]
+                    print('Searching connections of {} ({})'.format(last_tconst_title, last_tconst))
+
+                    # Connections hidden in the expandable button which follow the last one retrieved
+                    missed_connection_tconsts = find_connections(last_tconst, 'followed by')
+                    # missed_connection_tconsts = [mct for mct in missed_connection_tconsts if mct not in connection_rows['tconst']]
+                    print('Missed connection tconsts:', missed_connection_tconsts)
+                    for mct in missed_connection_tconsts:
+                        searched_tconsts.add(mct)
+
+                    missed_connection_rows = all_content.loc[all_content['tconst'].isin(missed_connection_tconsts)].copy()
+
+                    # It could be the case that a connection is found through the API, but it is not in the dataset due to
+                    # non-existent ratings. If that state is reached, do not continue search.
+                    if len(missed_connection_rows) == 0:
+                        print('Lost connections:', missed_connection_tconsts, end='\n\n')
+                        break
+
+                    # Define type of connection (e.g. Follows The Dark Knight (tconst)))
+                    missed_connection_rows['connection'] = '{} {} ({})'.format(
+                        CONNECTION_TYPES[conn_type],
+                        tconst_title,
+                        tconst
+                    )
+
+                    connection_rows = pd.concat([connection_rows, missed_connection_rows])  # Update connections
+                    search_round += 1
+                    print('{} - Search round {}: {}\n\n'.format(conn_type, search_round, list(connection_rows['tconst'])))
+                    # print('Connection tconsts:', list(connection_rows['tconst']))
+                    print('{} --- {} --- Connections found: {}/{}\n'.format(
+                        last_tconst, 
+                        conn_type, 
+                        len(connection_rows), 
+                        num_connections)
+                    )
+
+                    '''
+                    21. Searching... Star Wars: Episode V - The Empire Strikes Back (tt0080684)
+                    tt0080684 --- follows --- Connections found: 1 ['tt0076759'] --- Total connections: 1
+                    tt0080684 --- followed by --- Connections found: 5 ['tt0086190', 'tt2488496', 'tt0121766', 'tt0120915', 'tt0121765'] --- Total connections: 7
+                    Searching connections of Star Wars: Episode II - Attack of the Clones (tt0121765)
+                    Missed connection tconsts: ['tt2527336', 'tt2527338']
+                    Connection tconsts: ['tt0086190', 'tt2488496', 'tt0121766', 'tt0120915', 'tt0121765', 'tt2527336', 'tt2527338']
+                    tt0121765 --- followed by --- Connections found: 7 --- Total connections: 7
+                    '''
+
+            # Avoid concating if connections and original have been watched already.
+            is_unwatched_connection = ~(connection_rows['tconst'].isin(seen_tconst))
+            if is_unwatched_connection.sum() > 0:
+                unwatched_connections = connection_rows.loc[is_unwatched_connection]
+                mini_df = pd.concat([mini_df, unwatched_connections])
+
+    return mini_df
+
+
+def new_search():
+
+    '''
+    State of a connections search (see search_connections): position in the watched
+    titles (oldest first), titles already searched and franchises found so far.
+    '''
+
+    return {'position': 0, 'searched_tconsts': set(), 'franchises': [], 'finished': False}
+
+
+def search_connections(all_content, seen_tconst, search=None, log=None,
+                       count_connections=get_num_connections, find_connections=find_title_connections):
+
+    '''
+    Search the connections of watched titles, from the oldest watched, and yield each
+    franchise with unwatched titles (see find_franchise) as soon as it is found.
+
+    search: state of new_search, updated after each title. The search can be stopped at
+            any point (closing the generator, or a Streamlit rerun) and resumed from where
+            it stopped by calling search_connections again with the same state.
+    log: optional function called with a progress message for each title searched
+    count_connections, find_connections: functions used to fetch the number of connections
+                                         and the connections of a title (replaceable offline)
+    '''
+
+    if search is None:
+        search = new_search()
 
     # Iterate from oldest seen to most recently seen
-    for i, tconst in enumerate(seen_tconst[::-1]):
+    seen_tconst = list(seen_tconst)
+    oldest_first = seen_tconst[::-1]
 
+    for i in range(search['position'], len(oldest_first)):
+
+        tconst = oldest_first[i]
         tconst_title = all_content.loc[all_content['tconst'] == tconst, 'primaryTitle'].values[0]
-        
-        if tconst in searched_tconsts:
+        franchise = None
+
+        # Avoid searching for connections of a title that has been previously searched
+        if tconst in search['searched_tconsts']:
             print('{}. NOT searching... {} ({})'.format(i+1, tconst_title, tconst), end='\n\n')
-            with log.container():
-                st.write('{}. NOT searching... {} ({})'.format(i+1, tconst_title, tconst))
+            if log is not None:
+                log('{}. NOT searching... {} ({})'.format(i+1, tconst_title, tconst))
         else:
             print('{}. Searching... {} ({})'.format(i+1, tconst_title, tconst), end='\n\n')
-            with log.container():
-                st.write('{}. Searching... {} ({})'.format(i+1, tconst_title, tconst))
-
-            searched_tconsts.add(tconst)
-
-            # Put tconst already in resulting dataframe
-            mini_df = all_content.loc[all_content['tconst'] == tconst].copy()
-            
-            # Iterate through sequels and prequels
-            for conn_type in connection_types.keys():
-                search_round = 1
-                num_connections = get_num_connections(tconst, conn_type)   # Web-scrape number of connections
-                
-                # Connection tconst are returned in the same order as on IMDB
-                connection_tconsts = find_title_connections(tconst, conn_type)
-                
-                print(
-                    '{} - Search round {} ({}/{}): {}'.format(
-                        conn_type,
-                        search_round,
-                        len(connection_tconsts),
-                        num_connections, 
-                        connection_tconsts
-                    ), 
-                    end='\n\n' if conn_type == 'followed by' else '\n'
+            if log is not None:
+                log('{}. Searching... {} ({})'.format(i+1, tconst_title, tconst))
+
+            # The state is only updated once the title has been searched, so that a search
+            # interrupted in the middle of a title searches it again when resumed
+            searched_tconsts = set()
+            with foreground():  # The background warmer waits
+                franchise = find_franchise(
+                    all_content, tconst, tconst_title, seen_tconst, searched_tconsts, count_connections, find_connections
                 )
+            search['searched_tconsts'] |= searched_tconsts
 
-                if len(connection_tconsts) != 0:
-                    for conn_tconst in connection_tconsts:
-                        searched_tconsts.add(conn_tconst)   # Mark connections as seen
+            # If title and its connections have all been seen: skip it and don't add to the watchlist
+            if franchise['tconst'].isin(seen_tconst).all():
+                franchise = None
 
-                    connection_rows = all_content.loc[all_content['tconst'].isin(connection_tconsts)].copy()
+        search['position'] = i+1
 
-                    # Keep order of the list connection_tconsts in DataFrame
-                    # https://stackoverflow.com/questions/23414161/pandas-isin-with-output-keeping-order-of-input-list
-                    connection_rows['tconst_order'] = pd.Categorical(
-                        values=connection_rows['tconst'],
-                        categories=connection_tconsts,
-                        ordered=True
-                    )
+        if franchise is not None:
+            search['franchises'].append(franchise)
+            print('Number of titles unseen:', len(search['franchises']), end='\n\n')
+            yield franchise
 
-                    connection_rows.sort_values('tconst_order', inplace=True)
-
-
-                    # Connection rows is derived from a merge between all_content and ratings.
-                    # Number of connections could be 1, but connection rows could be 0 for a 
-                    # title that has not yet been launched and/or received any ratings.
-                    if len(connection_rows) != 0:
-
-                        # Define type of connection (e.g. Follows The Dark Knight (tconst)))
-                        connection_rows['connection'] = '{} {} ({})'.format(
-                            connection_types[conn_type],
-                            tconst_title,
-                            tconst
-                        )
-
-                        # Not all connections of tconst are retrieved through Cinemagoer due to an 
-                        # expandable button. Therefore we need to iterate through the connections' 
-                        # connections until the number of connections of tconst is reached.
-                        while len(connection_rows) < num_connections:
-                            
-                            # First 5 prequels/sequels are retrieved initially
-                            # In the case of 6+ prequels/sequels, get 5th and find its successors
-                            last_tconst = connection_rows.iloc[-1]['tconst']
-                            last_tconst_title = connection_rows.loc[connection_rows['tconst'] == last_tconst, 'primaryTitle'].values[0]
-                            print('Searching connections of {} ({})'.format(last_tconst_title, last_tconst))
-
-                            # Connections hidden in the expandable button which follow the last one retrieved
-                            missed_connection_tconsts = find_title_connections(last_tconst, 'followed by')
-                            # missed_connection_tconsts = [mct for mct in missed_connection_tconsts if mct not in connection_rows['tconst']]
-                            print('Missed connection tconsts:', missed_connection_tconsts)
-                            for mct in missed_connection_tconsts:
-                                searched_tconsts.add(mct)
-
-                            missed_connection_rows = all_content.loc[all_content['tconst'].isin(missed_connection_tconsts)].copy()
-
-                            # It could be the case that a connection is found through the API, but it is not in the dataset due to
-                            # non-existent ratings. If that state is reached, do not continue search.
-                            if len(missed_connection_rows) == 0:
-                                print('Lost connections:', missed_connection_tconsts, end='\n\n')
-                                break
-
-                            # Define type of connection (e.g. Follows The Dark Knight (tconst)))
-                            missed_connection_rows['connection'] = '{} {} ({})'.format(
-                                connection_types[conn_type],
-                                tconst_title,
-                                tconst
-                            )
-
-                            connection_rows = pd.concat([connection_rows, missed_connection_rows])  # Update connections
-                            search_round += 1
-                            print('{} - Search round {}: {}\n\n'.format(conn_type, search_round, list(connection_rows['tconst'])))
-                            # print('Connection tconsts:', list(connection_rows['tconst']))
-                            print('{} --- {} --- Connections found: {}/{}\n'.format(
-                                last_tconst, 
-                                conn_type, 
-                                len(connection_rows), 
-                                num_connections)
-                            )
-
-                            '''
-                            21. Searching... Star Wars: Episode V - The Empire Strikes Back (tt0080684)
-                            tt0080684 --- follows --- Connections found: 1 ['tt0076759'] --- Total connections: 1
-                            tt0080684 --- followed by --- Connections found: 5 ['tt0086190', 'tt2488496', 'tt0121766', 'tt0120915', 'tt0121765'] --- Total connections: 7
-                            Searching connections of Star Wars: Episode II - Attack of the Clones (tt0121765)
-                            Missed connection tconsts: ['tt2527336', 'tt2527338']
-                            Connection tconsts: ['tt0086190', 'tt2488496', 'tt0121766', 'tt0120915', 'tt0121765', 'tt2527336', 'tt2527338']
-                            tt0121765 --- followed by --- Connections found: 7 --- Total connections: 7
-                            '''
-
-                    # Avoid concating if connections and original have been watched already.
-                    is_unwatched_connection = ~(connection_rows['tconst'].isin(seen_tconst))
-                    if is_unwatched_connection.sum() > 0:
-                        unwatched_connections = connection_rows.loc[is_unwatched_connection]
-                        mini_df = pd.concat([mini_df, unwatched_connections])
+    search['finished'] = True
 
-            # If title and its connections have all been seen: skip it and don't add to the watchlist
-            # Otherwise order by year
-            is_unwatched_connection = ~(mini_df['tconst'].isin(seen_tconst))
-            if is_unwatched_connection.sum() > 0:
-                # mini_df['index'] = mini_df.index
-                # mini_df = mini_df.sort_values(['startYear', 'index'])
-                mini_dfs.append(mini_df)
-                num_titles_with_connections += 1
-                print('Number of titles unseen:', num_titles_with_connections, end='\n\n')
-                if num_titles_with_connections >= max_num_titles:
-                    break
-
-    connections_ordered = pd.concat(mini_dfs)
-    # print(connections_ordered)
-    cols_of_interest = ['tconst', 'primaryTitle', 'connection', 'titleType', 'startYear', 'endYear', 'runtimeMinutes', 'numVotes', 'averageRating']
-    connections_ordered = connections_ordered[cols_of_interest]
+
+def connections_table(franchises):
+
+    '''
+    Concat the franchises of search_connections into a DataFrame of connections.
+    '''
+
+    if len(franchises) == 0:
+        return pd.DataFrame(columns=CONNECTIONS_COLUMNS)
+
+    connections_ordered = pd.concat(franchises)[CONNECTIONS_COLUMNS]
     connections_ordered.reset_index(drop=True, inplace=True)
 
-    connections_ordered.to_csv('Rankings/connections.csv')
+    return connections_ordered
+
+
+def get_ordered_connections(all_content, max_num_titles, seen_tconst, log=None,
+                            count_connections=get_num_connections, find_connections=find_title_connections):
+
+    '''
+    Return at least max_num_titles unwatched titles (see search_connections for the arguments).
+    '''
+
+    search = new_search()
+
+    for _ in search_connections(all_content, seen_tconst, search, log, count_connections, find_connections):
+        if len(search['franchises']) >= max_num_titles:
+            break
+
+    connections_ordered = connections_table(search['franchises'])
+    connections_ordered.to_csv(os.path.join(RANKINGS_DIR, 'connections.csv'))
 
-    return connections_ordered
\ No newline at end of file
+    return connections_ordered
@@ -1,11 +1,14 @@
 # Script that fetches ratings directly from IMDB
-import requests
 import pandas as pd
-import streamlit as st
 from bs4 import BeautifulSoup
 from datetime import date
 
-url_imdb = 'https://www.imdb.com'
+import ratings_store
+from config import IMDB_URL, IMDB_USER_ID
+from instrumentation import log_event
+from telemetry import http_get
+
+url_imdb = IMDB_URL
 
 month_to_num = {
     'Jan': '01',
@@ -26,7 +29,7 @@ month_to_num = {
 def get_soup(id_user):
 
     url_user = '{}/user/{}/ratings?sort=date_added,desc&ratingFilter=0&mode=detail&ref_=undefined&lastPosition=0'.format(url_imdb, id_user)
-    r = requests.get(url_user)
+    r = http_get(url_user)
     soup = BeautifulSoup(r.content, 'html.parser')
 
     return soup
@@ -75,7 +78,7 @@ def get_next_page(current_num_page, soup):
 
     # Scrape next page
     current_url = '{}{}'.format(url_imdb, next_page) 
-    r = requests.get(current_url)
+    r = http_get(current_url)
     soup = BeautifulSoup(r.content, 'html.parser')
 
     current_num_page += 1
@@ -118,8 +121,7 @@ def extract_info(soup):
 
     return tconst_and_ratings, tconst_and_years_of_rating
 
-@st.cache_data(show_spinner=False)      # Run only once (when session begins)
-def get_user_ratings(id_user='ur103598244'):
+def get_user_ratings(id_user=IMDB_USER_ID):
 
     soup = get_soup(id_user)
     num_pages = get_num_pages(soup)
@@ -154,12 +156,11 @@ def get_user_ratings(id_user='ur103598244'):
 
     else:
 
-        df_user_ratings = pd.read_csv('IMDB_Data/IMDB_Exported_Ratings.csv', index_col=0)
-        df_user_ratings['dateRating'] = df_user_ratings['Date Rated'].apply(lambda x: int(x[:4]))    # YYYY-MM-DD -> YYYY
-        df_user_ratings['tconst'] = df_user_ratings.index
-        df_user_ratings.rename(columns={'Your Rating':'userRating'}, inplace=True)
-        df_user_ratings = df_user_ratings[['tconst', 'userRating', 'dateRating']]
-        df_user_ratings.to_csv('df_user_ratings.csv')
+        # The status of the ratings page is counted per host (see telemetry.py)
+        log_event('Ratings page not readable', kind='network', user=id_user)
+
+        # Ratings exported from IMDB (new export files are imported first)
+        df_user_ratings = ratings_store.get_user_ratings(id_user)
 
     return df_user_ratings
         
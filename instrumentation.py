@@ -0,0 +1,207 @@
+# Lightweight instrumentation of the load pipeline: wall time, CPU time,
+# peak RSS growth and row counts per stage, cache hits/misses of cached
+# functions, written as JSON lines to LOG_DIR/pipeline.jsonl.
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import LOG_DIR
+
+try:
+    import resource     # Not available on Windows
+except ImportError:
+    resource = None
+
+# Most recent records, shown in the sidebar panel of the app
+RECORDS = deque(maxlen=500)
+
+# Calls and misses of each cached function (hits = calls - misses)
+CACHE_STATS = defaultdict(lambda: {'calls': 0, 'misses': 0, 'seconds': 0.0})
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def peak_rss_mb():
+
+    '''
+    Peak resident set size of the process so far (None if unavailable).
+    '''
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def current_rss_mb():
+
+    '''
+    Current resident set size of the process (None if unavailable).
+    '''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def count_rows(result):
+
+    '''
+    Number of rows of a DataFrame result (or of each DataFrame in a list/tuple).
+    '''
+
+    if hasattr(result, 'shape') and len(getattr(result, 'shape', ())) > 0:
+        return result.shape[0]
+    if isinstance(result, (list, tuple)):
+        rows = [count_rows(r) for r in result]
+        return rows if any(r is not None for r in rows) else None
+
+    return None
+
+
+def log_event(name, **fields):
+
+    '''
+    Store a record in memory and append it as a JSON line to LOG_DIR/pipeline.jsonl.
+    '''
+
+    record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'name': name}
+    record.update(fields)
+
+    with _lock:
+        RECORDS.append(record)
+        try:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            with open(os.path.join(LOG_DIR, 'pipeline.jsonl'), 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        except OSError:
+            pass    # Telemetry must never break the app
+
+    return record
+
+
+@contextmanager
+def stage(name, **fields):
+
+    '''
+    Measure a block of code. Rows (or any other field) can be added to the
+    yielded dict inside the block, e.g.
+
+        with stage('Merging ratings information') as record:
+            df = ...
+            record['rows'] = len(df)
+    '''
+
+    record = dict(fields)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    start_peak = peak_rss_mb()
+
+    try:
+        yield record
+    finally:
+        end_peak = peak_rss_mb()
+        record['wall_seconds'] = round(time.perf_counter() - start_wall, 4)
+        record['cpu_seconds'] = round(time.process_time() - start_cpu, 4)
+        record['peak_rss_delta_mb'] = round(end_peak - start_peak, 1) if end_peak is not None else None
+        rss = current_rss_mb()
+        record['rss_mb'] = round(rss, 1) if rss is not None else None
+        log_event(name, kind='stage', **record)
+
+
+def instrumented(func):
+
+    '''
+    Decorator measuring every call of func as a stage (rows taken from the result).
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__) as record:
+            result = func(*args, **kwargs)
+            record['rows'] = count_rows(result)
+        return result
+
+    return wrapper
+
+
+def instrumented_cache(cache_decorator):
+
+    '''
+    Wrap a caching decorator (e.g. st.cache_data(...)) so that calls and misses are
+    counted in CACHE_STATS. Only misses run the function, so they are measured as stages.
+    '''
+
+    def decorator(func):
+
+        name = func.__name__
+
+        # Only misses reach the wrapped function
+        @functools.wraps(func)
+        def count_miss(*args, **kwargs):
+            _local.missed = True
+            with _lock:
+                CACHE_STATS[name]['misses'] += 1
+            return func(*args, **kwargs)
+
+        compute = cache_decorator(instrumented(count_miss))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            # Cached functions may call each other, so restore the outer flag afterwards
+            outer_missed = getattr(_local, 'missed', False)
+            _local.missed = False
+
+            start = time.perf_counter()
+            try:
+                result = compute(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                is_hit = not _local.missed
+                _local.missed = outer_missed
+
+            with _lock:
+                CACHE_STATS[name]['calls'] += 1
+                CACHE_STATS[name]['seconds'] += seconds
+
+            if is_hit:
+                log_event(name, kind='cache_hit', wall_seconds=round(seconds, 4))
+
+            return result
+
+        wrapper.clear = getattr(compute, 'clear', None)
+
+        return wrapper
+
+    return decorator
+
+
+def cache_summary():
+
+    '''
+    Return a list of dicts with calls, hits, misses and total seconds per cached function.
+    '''
+
+    with _lock:
+        return [
+            {
+                'function': name,
+                'calls': stats['calls'],
+                'hits': stats['calls'] - stats['misses'],
+                'misses': stats['misses'],
+                'seconds': round(stats['seconds'], 4)
+            }
+            for name, stats in sorted(CACHE_STATS.items())
+        ]
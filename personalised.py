@@ -0,0 +1,145 @@
+# Personalised ranking learned from the user's own ratings.
+#
+# Every eligible title (films and series with a global score) is described by a
+# sparse vector of features: genres, decade, runtime band and title type. The
+# user profile is the rating-weighted sum of the feature vectors of rated titles,
+# and the affinity of a title is the product of its vector with the profile.
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import pipeline
+
+# Upper bounds (in minutes) of the runtime bands
+RUNTIME_BANDS = [30, 60, 90, 120, 150, 180, np.inf]
+
+
+def feature_codes(values, prefix):
+
+    '''
+    Factorise a column into integer codes and feature names (missing values get no feature).
+    '''
+
+    codes, uniques = pd.factorize(values)
+    names = ['{}:{}'.format(prefix, u) for u in uniques]
+
+    return codes, names
+
+
+def build_feature_matrix(df_candidates):
+
+    '''
+    Build the sparse title x feature matrix (CSR, float32, rows with unit L2 norm
+    so that titles with many genres do not dominate).
+
+    Returns the matrix and the feature names.
+    '''
+
+    n_titles = len(df_candidates)
+    rows, cols, names = [], [], []
+
+    # Genres: multi-valued, e.g. 'Action,Adventure,Sci-Fi'
+    genres = df_candidates['genres'].where(df_candidates['genres'] != '\\N').str.split(',').explode()
+    genres = genres.dropna()
+    codes, genre_names = feature_codes(genres, 'genre')
+    rows.append(genres.index.to_numpy())
+    cols.append(codes)
+    names += genre_names
+
+    # Single-valued features: decade, runtime band and title type
+    start_year = pd.to_numeric(df_candidates['startYear'], errors='coerce')
+    runtime = pd.to_numeric(df_candidates['runtimeMinutes'], errors='coerce')
+    single_valued = {
+        'decade': (start_year // 10 * 10).astype('Int64'),
+        'runtime': pd.cut(runtime, bins=[0] + RUNTIME_BANDS, right=False).astype(str).where(runtime.notna()),
+        'type': df_candidates['titleType']
+    }
+
+    for prefix, values in single_valued.items():
+        codes, feature_names = feature_codes(values, prefix)
+        is_known = codes >= 0
+        rows.append(np.flatnonzero(is_known))
+        cols.append(codes[is_known] + len(names))
+        names += feature_names
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    matrix = sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(n_titles, len(names))
+    )
+
+    # Unit L2 norm per title
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sp.diags(1 / norms.astype(np.float32)) @ matrix
+
+    return matrix.tocsr(), names
+
+
+def learn_user_profile(matrix, df_candidates, df_user_ratings):
+
+    '''
+    Profile of the user in feature space: feature vectors of rated titles weighted
+    by how much the user liked them compared to their mean rating.
+    '''
+
+    positions = pd.Index(df_candidates['tconst']).get_indexer(df_user_ratings['tconst'])
+    is_candidate = positions >= 0
+    positions = positions[is_candidate]
+    ratings = df_user_ratings['userRating'].to_numpy(dtype=np.float32)[is_candidate]
+
+    if len(positions) == 0:
+        return np.zeros(matrix.shape[1], dtype=np.float32)
+
+    weights = ratings - ratings.mean()
+    if not weights.any():
+        weights = np.ones_like(weights)     # All ratings equal: every rated feature counts the same
+
+    profile = matrix[positions].T @ weights
+    profile /= np.abs(weights).sum()
+
+    return np.asarray(profile, dtype=np.float32).ravel()
+
+
+def personalised_scores(matrix, global_scores, profile, weight=0.5):
+
+    '''
+    Blend the global score (0-10) with the affinity to the profile, rescaled to 0-10.
+    weight: share of the affinity in the blend (0 = global ranking only)
+    '''
+
+    global_scores = np.asarray(global_scores, dtype=np.float32)
+    affinity = matrix @ profile
+
+    # No rated titles among the candidates: nothing to personalise
+    spread = affinity.max() - affinity.min() if len(affinity) else 0
+    if spread == 0:
+        return global_scores
+
+    affinity = 10 * (affinity - affinity.min()) / spread
+
+    return (1 - weight) * global_scores + weight * affinity
+
+
+def top_personalised(df_candidates, matrix, df_user_ratings, num_titles=20, weight=0.5, show_watched=False):
+
+    '''
+    Return the num_titles candidates with the highest personalised score
+    (partial selection, see pipeline.top_k_positions).
+    '''
+
+    profile = learn_user_profile(matrix, df_candidates, df_user_ratings)
+    scores = personalised_scores(matrix, df_candidates['score'].to_numpy(), profile, weight)
+
+    mask = None
+    if not show_watched:
+        mask = ~df_candidates['tconst'].isin(df_user_ratings['tconst']).to_numpy()
+
+    top = pipeline.top_k_positions(scores, num_titles, mask)
+
+    df_top = df_candidates.iloc[top].drop(columns='genres').rename(columns={'score': 'globalScore'})
+    df_top.insert(len(df_top.columns) - 1, 'personalScore', np.round(scores[top], 2))
+    df_top.index = np.arange(1, 1+len(df_top))
+
+    return df_top
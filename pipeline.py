@@ -0,0 +1,556 @@
+# Scoring pipeline of WatchNext as plain functions (no Streamlit), shared
+# by the Streamlit app (see app_functions.py) and the command-line interface.
+import pandas as pd
+import numpy as np
+import functools
+import gzip
+import os
+
+from datetime import datetime
+
+from config import DATASETS_URL, ENGINE, STARTUP_WORKERS
+from instrumentation import log_event
+from telemetry import open_url
+
+# Flow is as follows:
+# 1. Download IMBD datasets (just once!)
+# 2. Get all content depending on choice in order to normalise its scores
+# 3. Show all or rated or unrated
+
+DATASET_FILES = {
+    'title_basics': 'title.basics.tsv.gz',
+    'title_ratings': 'title.ratings.tsv.gz',
+    'title_episode': 'title.episode.tsv.gz'
+}
+
+SERIES_TYPES = ['tvSeries', 'tvMiniSeries', 'tvEpisode']
+
+FILM_COLUMNS = [
+    'tconst',
+    'titleType',
+    'primaryTitle',
+    'startYear',
+    'runtimeMinutes',
+    'averageRating',
+    'numVotes',
+    'filmScore'
+]
+
+SERIES_COLUMNS = [
+    'tconst',
+    'titleType',
+    'primaryTitle',
+    'startYear',
+    'endYear',
+    'averageRating',
+    'numVotes',
+    'seriesScore',
+    'episodeScore',
+    'totalRuntime'
+]
+
+# Films and series that can be recommended ('score' is filmScore or seriesScore)
+CANDIDATE_COLUMNS = [
+    'tconst',
+    'titleType',
+    'primaryTitle',
+    'startYear',
+    'runtimeMinutes',
+    'averageRating',
+    'numVotes',
+    'score',
+    'genres'
+]
+
+# Download latest IMDB datasets
+def unzip_and_load_datasets(data_dir=None, datasets_url=DATASETS_URL):
+
+    '''
+    Based on https://stackoverflow.com/questions/18146389/urlopen-trouble-while-trying-to-download-a-gzip-file
+
+    data_dir: local folder with the .tsv.gz files (skips the download)
+    datasets_url: base URL of the IMDB datasets
+    '''
+
+    datasets = []
+
+    for key, file_name in DATASET_FILES.items():
+        if data_dir is not None:
+            df = pd.read_csv(os.path.join(data_dir, file_name), sep='\t', low_memory=False)
+        else:
+            inmemory = open_url('{}/{}'.format(datasets_url, file_name))
+            fStream = gzip.GzipFile(fileobj=inmemory, mode='rb')
+            df = pd.read_csv(fStream, sep='\t', low_memory=False)
+        datasets.append(df)
+        print('Loaded {}'.format(key))
+        # df.to_csv('IMDB_Data/{}.csv'.format(key))
+
+    return datasets
+
+# Get ratings and votes for each title
+def merge_ratings(df_imdb_titles, df_imdb_ratings):
+    return df_imdb_titles.merge(df_imdb_ratings, on='tconst')   
+
+# Get episode info
+def merge_episode_info(df_imdb_episodes, df_imdb_titles):
+    return df_imdb_episodes.merge(df_imdb_titles[['tconst', 'runtimeMinutes', 'averageRating', 'numVotes']], on='tconst')
+
+def normalise_content(df, content_type):
+
+    # Remove outlier ratings
+    if content_type in ['Series', 'Films']:
+        df = df.loc[df['numVotes'] >= 5000].copy()
+
+    # Create score metric
+    df['score'] = df['averageRating'] * df['numVotes']
+    # Normalise scores in 0-10 range
+    df['score'] = 10 * (df['score'] - df['score'].min()) / (df['score'].max() - df['score'].min())
+    # Apply sigmoid function (out of 10)
+    df['score'] = 10 / (1 + np.exp(-df['score']))
+    # Score is mean of average rating and normalised metric
+    df['score'] = (df['score'] + df['averageRating']) / 2
+    # Rankings order titles by the unrounded score (many titles share a rounded one)
+    if content_type in ['Series', 'Films']:
+        df['scoreRaw'] = df['score']
+    df['score'] = round(df['score'], 2)
+    # Not sorted: rankings only select the top titles they display (see top_k)
+    df.reset_index(drop=True, inplace=True)
+
+    return df
+
+def calculate_episode_metric(df_imdb_episodes):
+
+    # Group episodes by the series to which they belong and calculate their mean score
+    df_episode_score = df_imdb_episodes.groupby('parentTconst').agg({'score': 'mean'})
+    df_episode_score['score'] = round(df_episode_score['score'], 2)
+    df_episode_score.reset_index(inplace=True)
+
+    return df_episode_score
+
+def calculate_runtime_metric(df_imdb_episodes):
+
+    # Fix cases with errors runtimes
+    errors_list = df_imdb_episodes.loc[df_imdb_episodes['runtimeMinutes'].str.isnumeric() == False, 'runtimeMinutes'].unique()
+    df_runtime_errors = df_imdb_episodes.loc[df_imdb_episodes['runtimeMinutes'].isin(errors_list)]
+   
+    # If series has episodes without Nan runtimes, use mean of the series (otherwise use mean of all series)
+    df_runtime_without_errors = df_imdb_episodes[~df_imdb_episodes['runtimeMinutes'].isin(errors_list)].copy()
+    df_runtime_without_errors['runtimeMinutes'] = df_runtime_without_errors['runtimeMinutes'].astype(int)
+
+    # Mean of all episode lengths
+    mean_runtime = df_runtime_without_errors['runtimeMinutes'].mean()
+
+    # Mean of episode length by series
+    df_mean_runtime_series = df_runtime_without_errors.groupby('parentTconst').agg({'runtimeMinutes': 'mean'})
+    df_mean_runtime_series.reset_index(inplace=True)
+
+    # 1. Use existing series info (use how='left' to keep series without runtimes for step 2)
+    df_runtime_errors = df_runtime_errors.merge(df_mean_runtime_series[['parentTconst', 'runtimeMinutes']], how='left', on='parentTconst')
+    df_runtime_errors.drop('runtimeMinutes_x', axis=1, inplace=True)
+    df_runtime_errors.rename(columns={'runtimeMinutes_y': 'runtimeMinutes'}, inplace=True)
+
+    # 2. If there is no info for series, runtimeMinutes columns will have become Nans -> use global mean
+    df_runtime_errors.loc[df_runtime_errors['runtimeMinutes'].isna(), 'runtimeMinutes'] = mean_runtime
+
+    # Calculate total runtime per series
+    df_runtime_score = pd.concat([df_runtime_without_errors, df_runtime_errors])
+    log_event('calculate_runtime_metric', kind='rows', episodes_after_rebuilding_runtimes=len(df_runtime_score))   # Should match number of episodes
+    df_runtime_score = df_runtime_score.groupby('parentTconst').agg({'runtimeMinutes': 'sum'})
+    df_runtime_score.rename(columns={'runtimeMinutes': 'totalRuntime'}, inplace=True)
+    df_runtime_score['totalRuntime'] = round(df_runtime_score['totalRuntime']).astype(int)
+    df_runtime_score.reset_index(inplace=True)
+
+    return df_runtime_score
+
+def calculate_combined_metric(df_series_score, df_episode_score, df_runtime_score):
+
+    # Merge score with episode score
+    df_combined = pd.merge(
+        left=df_series_score,
+        right=df_episode_score,
+        left_on='tconst',
+        right_on='parentTconst'
+    )
+
+    # Merge with runtime score
+    df_combined = df_combined.merge(df_runtime_score, on='parentTconst')
+    df_combined.drop(columns='parentTconst', inplace=True)
+
+    df_combined = df_combined[
+        [
+            'tconst',
+            'titleType',
+            'primaryTitle',
+            'originalTitle',
+            'startYear',
+            'endYear',
+            'averageRating',
+            'numVotes',
+            'seriesScore',
+            'episodeScore',
+            'totalRuntime',
+        ]
+    ]
+
+    # Using numVotes to combine with runtime score
+    df_combined['combinedMetric'] = (df_combined['seriesScore'] * df_combined['episodeScore']) / 2 # Normal version
+    # df_combined = normalise_scores(df_combined, score_col='combinedMetric')
+    # Rank with top_k(df_combined, 'combinedMetric', k) where needed
+
+    return df_combined
+
+def build_episode_index(titles, episodes):
+
+    '''
+    Precompute the episodes of every rated series once, so that missed episodes
+    can be looked up per series instead of scanning and merging the full tables.
+
+    Returns a dict with:
+        episodes: episodes sorted by (parentTconst, seasonNumber, episodeNumber) with
+                  parentTitle, primaryTitle and numeric season/episode/year columns
+        parents: sorted unique parentTconst values
+        starts, stops: positions of the episodes of each parent in episodes
+    '''
+
+    # Because titles were merged with ratings, unrated episodes and series are dropped
+    df_index = pd.merge(
+        left=episodes[['tconst', 'parentTconst', 'seasonNumber', 'episodeNumber']],
+        right=titles[['tconst', 'primaryTitle', 'startYear']],
+        on='tconst'
+    )
+
+    # Get primaryTitle of series
+    parent_titles = titles[['tconst', 'primaryTitle']].set_index('tconst')['primaryTitle']
+    df_index['parentTitle'] = df_index['parentTconst'].map(parent_titles)
+    df_index = df_index.loc[df_index['parentTitle'].notna()]
+
+    # Unreleased episodes and episodes without numbering show as '\\N', so convert them to -1
+    for col in ['seasonNumber', 'episodeNumber', 'startYear']:
+        df_index[col] = pd.to_numeric(df_index[col], errors='coerce').fillna(-1).astype(int)
+
+    df_index = df_index.sort_values(['parentTconst', 'seasonNumber', 'episodeNumber'], kind='mergesort')
+    df_index = df_index[['tconst', 'parentTconst', 'seasonNumber', 'episodeNumber', 'parentTitle', 'primaryTitle', 'startYear']]
+    df_index.reset_index(drop=True, inplace=True)
+
+    # Episodes of a series are contiguous after sorting
+    parents, starts, counts = np.unique(df_index['parentTconst'].to_numpy(), return_index=True, return_counts=True)
+
+    return {
+        'episodes': df_index,
+        'parents': parents,
+        'starts': starts,
+        'stops': starts + counts
+    }
+
+
+def get_episodes_of_series(episode_index, parent_tconsts):
+
+    '''
+    Return the indexed episodes of the given series, sorted by series, season and episode number.
+    '''
+
+    parents = episode_index['parents']
+    parent_tconsts = np.unique(np.asarray(parent_tconsts, dtype=object))
+
+    # Binary search each series in the index (parents are sorted)
+    positions = np.searchsorted(parents, parent_tconsts)
+    positions = np.minimum(positions, len(parents)-1)
+    positions = positions[parents[positions] == parent_tconsts] if len(parents) else positions[:0]
+
+    if len(positions) == 0:
+        return episode_index['episodes'].iloc[:0].copy()
+
+    rows = np.concatenate([
+        np.arange(start, stop) for start, stop in zip(episode_index['starts'][positions], episode_index['stops'][positions])
+    ])
+
+    return episode_index['episodes'].iloc[rows].copy()
+
+
+def get_new_episodes(episode_index, df_user_ratings):
+
+    '''
+    Use year of user ratings to look for episodes released after that year
+    '''
+
+    # Only keep episodes of watched series (rated more than once: since the first rating)
+    year_rating = df_user_ratings.groupby('tconst')['dateRating'].min()
+    episodes_of_watched_series = get_episodes_of_series(episode_index, year_rating.index)
+
+    # Find unaired pilots, special episodes...
+    unexpected_numbers = [-1,0]
+    unexpected_episodes = episodes_of_watched_series.loc[(episodes_of_watched_series['seasonNumber'].isin(unexpected_numbers)) | (episodes_of_watched_series['episodeNumber'].isin(unexpected_numbers))].copy()
+    unexpected_episodes.reset_index(inplace=True)
+
+    # Unreleased episodes have startYear -1, so they are never new
+    episodes_of_watched_series['dateRating'] = episodes_of_watched_series['parentTconst'].map(year_rating).astype(int)
+    episodes_of_watched_series['newEpisode'] = episodes_of_watched_series['startYear'] > episodes_of_watched_series['dateRating']
+
+    unwatched_episodes = episodes_of_watched_series.loc[episodes_of_watched_series['newEpisode']]
+    unwatched_episodes.reset_index(inplace=True)
+
+    return unwatched_episodes, unexpected_episodes
+
+
+def split_content(df_imdb_titles):
+
+    '''
+    Split titles (merged with ratings) into films and series.
+    '''
+
+    is_series = df_imdb_titles['titleType'].isin(SERIES_TYPES)
+    df_films = df_imdb_titles.loc[~is_series]
+    df_series = df_imdb_titles.loc[is_series]
+
+    return df_films, df_series
+
+
+def add_series_metrics(df_series, episode_metric, runtime_metric):
+
+    '''
+    Add the mean episode score (episodeScore) and total runtime (totalRuntime) of each series.
+    '''
+
+    df_series = pd.merge(
+        left=df_series,
+        right=episode_metric,
+        left_on='tconst',
+        right_on='parentTconst'
+    )
+
+    df_series = pd.merge(
+        left=df_series,
+        right=runtime_metric,
+        on='parentTconst'
+    )
+
+    df_series.drop(columns='parentTconst', inplace=True)
+
+    return df_series
+
+
+def score_content(df, content_type, score_column, normalise=normalise_content):
+    return normalise(df, content_type).rename(columns={'score': score_column, 'scoreRaw': score_column + 'Raw'})
+
+
+def episode_scores(df_episodes, calculate=calculate_episode_metric):
+    return calculate(df_episodes).rename(columns={'score': 'episodeScore'})
+
+
+def score_stages(stage_funcs=None):
+
+    '''
+    Stages of build_score_tables as a dependency graph (see dag.py), from the
+    inputs imdb_titles, imdb_ratings and imdb_episodes (the raw datasets) to the
+    outputs all_titles, episode_index, films and series.
+
+    stage_funcs replaces pipeline functions by name (e.g. with cached versions
+    taking the same arguments), the others are called directly.
+    '''
+
+    funcs = {
+        'merge_ratings': merge_ratings,
+        'merge_episode_info': merge_episode_info,
+        'normalise_content': normalise_content,
+        'calculate_episode_metric': calculate_episode_metric,
+        'calculate_runtime_metric': calculate_runtime_metric,
+        'build_episode_index': build_episode_index
+    }
+    funcs.update(stage_funcs or {})
+
+    return [
+        {'name': 'Merging ratings', 'func': funcs['merge_ratings'], 'inputs': ['imdb_titles', 'imdb_ratings'], 'outputs': ['all_titles']},
+        {'name': 'Merging episode info', 'func': funcs['merge_episode_info'], 'inputs': ['imdb_episodes', 'all_titles'], 'outputs': ['rated_episodes']},
+        {'name': 'Splitting content', 'func': split_content, 'inputs': ['all_titles'], 'outputs': ['unscored_films', 'unscored_series']},
+        {
+            'name': 'Normalising films',
+            'func': functools.partial(score_content, content_type='Films', score_column='filmScore', normalise=funcs['normalise_content']),
+            'inputs': ['unscored_films'],
+            'outputs': ['films']
+        },
+        {
+            'name': 'Normalising series',
+            'func': functools.partial(score_content, content_type='Series', score_column='seriesScore', normalise=funcs['normalise_content']),
+            'inputs': ['unscored_series'],
+            'outputs': ['scored_series']
+        },
+        {
+            'name': 'Normalising episodes',
+            'func': functools.partial(funcs['normalise_content'], content_type='Episodes'),
+            'inputs': ['rated_episodes'],
+            'outputs': ['scored_episodes']
+        },
+        {
+            'name': 'Episode metric',
+            'func': functools.partial(episode_scores, calculate=funcs['calculate_episode_metric']),
+            'inputs': ['scored_episodes'],
+            'outputs': ['episode_metric']
+        },
+        {'name': 'Runtime metric', 'func': funcs['calculate_runtime_metric'], 'inputs': ['scored_episodes'], 'outputs': ['runtime_metric']},
+        {'name': 'Series metrics', 'func': add_series_metrics, 'inputs': ['scored_series', 'episode_metric', 'runtime_metric'], 'outputs': ['series']},
+        {'name': 'Indexing episodes', 'func': funcs['build_episode_index'], 'inputs': ['all_titles', 'imdb_episodes'], 'outputs': ['episode_index']}
+    ]
+
+
+def build_score_tables(datasets, max_workers=STARTUP_WORKERS):
+
+    '''
+    Run the whole scoring pipeline on the raw IMDB datasets (independent stages
+    in parallel, see score_stages).
+
+    Returns a dict with all_titles (titles merged with ratings), episodes (raw),
+    episode_index, films (filmScore) and series (seriesScore, episodeScore, totalRuntime).
+    filmScoreRaw and seriesScoreRaw are the unrounded scores by which titles are ranked.
+    '''
+
+    import dag
+
+    df_imdb_titles, df_imdb_ratings, df_imdb_episodes = datasets
+
+    results = dag.run_graph(
+        score_stages(),
+        {'imdb_titles': df_imdb_titles, 'imdb_ratings': df_imdb_ratings, 'imdb_episodes': df_imdb_episodes},
+        max_workers
+    )
+
+    return {
+        'all_titles': results['all_titles'],
+        'episodes': df_imdb_episodes,
+        'episode_index': results['episode_index'],
+        'films': results['films'],
+        'series': results['series']
+    }
+
+
+def compute_score_tables(data_dir=None, engine=ENGINE):
+
+    '''
+    Load the IMDB datasets and build the score tables (see build_score_tables)
+    with the given engine, 'pandas' or 'polars'. Both return identical tables.
+    '''
+
+    if engine == 'polars':
+        # Optional dependency, only imported when selected
+        import pipeline_polars
+        return pipeline_polars.build_score_tables(pipeline_polars.unzip_and_load_datasets(data_dir))
+
+    if engine != 'pandas':
+        raise ValueError("Unknown engine '{}' (expected 'pandas' or 'polars')".format(engine))
+
+    return build_score_tables(unzip_and_load_datasets(data_dir))
+
+
+def top_k_positions(scores, k=None, mask=None, ties=None):
+
+    '''
+    Positions of the k highest scores (only where mask is True), highest first.
+    The k-th highest score is found with a partition and only the k selected
+    scores are sorted, so this is linear in the number of scores. Ties are broken
+    by ties (e.g. the tconst of each score, same order as queries.QUERIES), or by
+    position if None, including ties at the k-th score. Missing scores come last.
+    k=None ranks every (masked) score.
+    '''
+
+    scores = np.asarray(scores, dtype=float)
+    positions = np.arange(len(scores)) if mask is None else np.flatnonzero(np.asarray(mask))
+
+    k = len(positions) if k is None else min(k, len(positions))
+    if k <= 0:
+        return np.array([], dtype=int)
+
+    values = scores[positions]
+    values = np.where(np.isnan(values), -np.inf, values)
+
+    def tie_order(selected):
+        # Stable, so that positions break the ties that ties does not
+        if ties is None:
+            return selected
+        return selected[np.argsort(np.asarray(ties[positions[selected]]), kind='stable')]
+
+    if k < len(positions):
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values > kth)
+        # Fill up with the first of the scores tied with the k-th one
+        tied = tie_order(np.flatnonzero(values == kth))
+        selected = np.concatenate([above, tied[:k - len(above)]])
+    else:
+        selected = np.arange(len(positions))
+
+    # Sort by decreasing score, then by ties (or position)
+    selected = tie_order(np.sort(selected))
+    selected = selected[np.argsort(-values[selected], kind='stable')]
+
+    return positions[selected]
+
+
+def top_k(df, column, k=None, mask=None, tie_column=None):
+
+    '''
+    Rows of df with the k highest values of column (only where mask is True),
+    ranked from 1 to k in the index. Ties are broken by tie_column (by row if None).
+    '''
+
+    ties = None if tie_column is None else df[tie_column].array
+    df_top = df.iloc[top_k_positions(df[column].to_numpy(), k, mask, ties)]
+    df_top.index = np.arange(1, 1+len(df_top))
+
+    return df_top
+
+
+def filter_films(df_films, watched_tconst, show_watched=False, max_duration_hours=None, num_titles=None):
+
+    '''
+    Top num_titles films (all if None) by unrounded filmScore then tconst, filtered
+    by watched status and maximum duration (in hours).
+    '''
+
+    mask = np.ones(len(df_films), dtype=bool)
+
+    if not show_watched:
+        mask &= ~df_films['tconst'].isin(watched_tconst).to_numpy()
+
+    if max_duration_hours is not None:
+        # Unknown runtimes ('\\N') become NaN and are filtered out
+        runtime = pd.to_numeric(df_films['runtimeMinutes'], errors='coerce').to_numpy()
+        mask &= runtime <= max_duration_hours*60
+
+    return top_k(df_films, 'filmScoreRaw', num_titles, mask, tie_column='tconst')[FILM_COLUMNS]
+
+
+def filter_series(df_series, watched_tconst, show_watched=False, show_unfinished=False, max_duration_days=None, num_titles=None):
+
+    '''
+    Top num_titles series (all if None) by unrounded seriesScore then tconst, filtered
+    by watched status, whether they have ended and maximum duration (in days).
+    '''
+
+    mask = np.ones(len(df_series), dtype=bool)
+
+    if not show_watched:
+        mask &= ~df_series['tconst'].isin(watched_tconst).to_numpy()
+
+    if not show_unfinished:
+        end_year = pd.to_numeric(df_series['endYear'], errors='coerce').to_numpy()
+        mask &= end_year <= datetime.now().year
+
+    if max_duration_days is not None:
+        mask &= df_series['totalRuntime'].to_numpy() <= max_duration_days*24*60   # Days to minutes
+
+    return top_k(df_series, 'seriesScoreRaw', num_titles, mask, tie_column='tconst')[SERIES_COLUMNS]
+
+
+def candidate_titles(df_films, df_series):
+
+    '''
+    Films and series that can be recommended, with their global score in 'score'.
+    '''
+
+    df_candidates = pd.concat(
+        [
+            df_films.rename(columns={'filmScore': 'score'})[CANDIDATE_COLUMNS],
+            df_series.rename(columns={'seriesScore': 'score'})[CANDIDATE_COLUMNS]
+        ],
+        ignore_index=True
+    )
+
+    return df_candidates
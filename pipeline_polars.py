@@ -0,0 +1,249 @@
+# Polars engine of the scoring pipeline (WATCHNEXT_ENGINE=polars).
+#
+# The same stages as pipeline.py, written as lazy Polars query plans. The tables
+# are converted to pandas at the end and are identical to those of the pandas
+# engine, float for float (see test_pipeline_polars.py and
+# benchmarks/compare_engines.py), so the app, the CLI and the rankings do not
+# depend on the engine.
+#
+# Parity costs part of the parallelism. Reading, joins, filters and sorts run on
+# every core, but the float operations whose last digit differs in Polars run
+# single-threaded in NumPy and pandas: divisions, exp and rounding of the scores
+# (numpy_divide, numpy_round) and the mean and sum of the episode group-bys
+# (group_by_like_pandas).
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+import pipeline
+from config import DATASETS_URL
+from telemetry import open_url
+
+# Strings that pandas.read_csv reads as missing values (its default na_values)
+PANDAS_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+
+def infer_column_type(column):
+
+    '''
+    Type a column read as strings like pandas.read_csv does: integers if every
+    value is an integer (floats if some are missing), floats, otherwise strings.
+    '''
+
+    num_missing = column.null_count()
+
+    as_int = column.str.to_integer(strict=False)
+    if as_int.null_count() == num_missing:
+        return as_int if num_missing == 0 else as_int.cast(pl.Float64)
+
+    as_float = column.cast(pl.Float64, strict=False)
+    if as_float.null_count() == num_missing:
+        return as_float
+
+    return column
+
+
+def read_dataset(source):
+
+    df = pl.read_csv(source, separator='\t', infer_schema=False, null_values=PANDAS_NA_VALUES)
+
+    return df.with_columns([infer_column_type(df[col]) for col in df.columns])
+
+
+# Download latest IMDB datasets
+def unzip_and_load_datasets(data_dir=None, datasets_url=DATASETS_URL):
+
+    '''
+    Same as pipeline.unzip_and_load_datasets, returning Polars DataFrames.
+    '''
+
+    datasets = []
+
+    for key, file_name in pipeline.DATASET_FILES.items():
+        if data_dir is not None:
+            df = read_dataset(os.path.join(data_dir, file_name))
+        else:
+            inmemory = open_url('{}/{}'.format(datasets_url, file_name))
+            df = read_dataset(gzip.GzipFile(fileobj=inmemory, mode='rb').read())
+        datasets.append(df)
+        print('Loaded {}'.format(key))
+
+    return datasets
+
+
+# The stages below take and return LazyFrames (DataFrames for the metrics of
+# episodes). Joins keep the order of the left rows, as pandas.merge does.
+
+def merge_ratings(titles, ratings):
+    return titles.join(ratings, on='tconst', how='inner', maintain_order='left')
+
+def merge_episode_info(episodes, titles):
+    return episodes.join(
+        titles.select(['tconst', 'runtimeMinutes', 'averageRating', 'numVotes']),
+        on='tconst',
+        how='inner',
+        maintain_order='left'
+    )
+
+def numpy_round(expr, decimals=0):
+
+    '''
+    Round with NumPy (as pandas does): Polars rounds differently in the last digit.
+    '''
+
+    return expr.map_batches(lambda s: pl.Series(np.round(s.to_numpy(), decimals)), return_dtype=pl.Float64)
+
+def numpy_divide(numerator, denominator):
+
+    '''
+    Divide with NumPy (as pandas does): Polars multiplies by the inverse of a scalar
+    denominator, which changes the last digit of the unrounded scores.
+    '''
+
+    return pl.map_batches([numerator, denominator], lambda s: pl.Series(s[0].to_numpy() / s[1].to_numpy()), return_dtype=pl.Float64)
+
+def split_content(titles):
+    is_series = pl.col('titleType').is_in(pipeline.SERIES_TYPES)
+    return titles.filter(~is_series), titles.filter(is_series)
+
+def normalise_content(lf, content_type):
+
+    # Remove outlier ratings
+    if content_type in ['Series', 'Films']:
+        lf = lf.filter(pl.col('numVotes') >= 5000)
+
+    # Same operations (in the same order) as pipeline.normalise_content, with
+    # division, exp and rounding done by NumPy so that the floats are identical
+    score = pl.col('averageRating') * pl.col('numVotes')
+    score = numpy_divide(10 * (score - score.min()), score.max() - score.min())
+    score = 10 / (1 + (-score).map_batches(np.exp, return_dtype=pl.Float64))
+    score = (score + pl.col('averageRating')) / 2
+
+    if content_type in ['Series', 'Films']:
+        return lf.with_columns([numpy_round(score, 2).alias('score'), score.alias('scoreRaw')])
+
+    return lf.with_columns(numpy_round(score, 2).alias('score'))
+
+def group_by_like_pandas(df, key, column, how):
+
+    '''
+    Aggregate column by key (sorted), in the same row order and with the same
+    compensated sums as pandas. Polars adds up partitions in parallel, which can
+    change the last digit of float sums and so their rounding.
+    '''
+
+    keys = df[key].unique().sort()
+    codes = keys.search_sorted(df[key])
+    values = pd.Series(df[column].to_numpy()).groupby(codes.to_numpy()).agg(how)
+
+    return pl.DataFrame({key: keys, column: values.to_numpy()})
+
+def calculate_episode_metric(df_episodes):
+
+    # Group episodes by the series to which they belong and calculate their mean score
+    episode_score = group_by_like_pandas(df_episodes, 'parentTconst', 'score', 'mean')
+
+    return episode_score.with_columns(numpy_round(pl.col('score'), 2))
+
+def calculate_runtime_metric(df_episodes):
+
+    # Episodes with non-numeric runtimes get the mean runtime of their series,
+    # or the mean runtime of all episodes if their series has none
+    episodes = df_episodes.lazy()
+    is_numeric = pl.col('runtimeMinutes').cast(pl.String).str.contains(r'^[0-9]+$')
+    runtime = pl.col('runtimeMinutes').cast(pl.String).cast(pl.Int64, strict=False)
+
+    with_runtime = episodes.filter(is_numeric).select(['parentTconst', runtime.cast(pl.Float64).alias('runtimeMinutes')])
+    mean_runtime = with_runtime.select(pl.col('runtimeMinutes').mean().alias('meanRuntime'))
+    mean_runtime_series = with_runtime.group_by('parentTconst').agg(pl.col('runtimeMinutes').mean())
+
+    without_runtime = (
+        episodes.filter(~is_numeric)
+        .select('parentTconst')
+        .join(mean_runtime_series, on='parentTconst', how='left', maintain_order='left')
+        .join(mean_runtime, how='cross')
+        .select(['parentTconst', pl.col('runtimeMinutes').fill_null(pl.col('meanRuntime'))])
+    )
+
+    # Calculate total runtime per series
+    runtimes = pl.concat([with_runtime, without_runtime]).collect()
+    runtime_score = group_by_like_pandas(runtimes, 'parentTconst', 'runtimeMinutes', 'sum')
+
+    return runtime_score.select([
+        'parentTconst',
+        numpy_round(pl.col('runtimeMinutes')).cast(pl.Int64).alias('totalRuntime')
+    ])
+
+def add_series_metrics(series, episode_metric, runtime_metric):
+    return (
+        series.join(episode_metric, left_on='tconst', right_on='parentTconst', how='inner', maintain_order='left')
+        .join(runtime_metric, left_on='tconst', right_on='parentTconst', how='inner', maintain_order='left')
+    )
+
+def index_episodes(titles, episodes):
+
+    '''
+    Episodes table of pipeline.build_episode_index.
+    '''
+
+    parent_titles = titles.select([pl.col('tconst').alias('parentTconst'), pl.col('primaryTitle').alias('parentTitle')])
+
+    # Missing or '\\N' numbers and years become -1
+    as_int = lambda col: pl.col(col).cast(pl.String).cast(pl.Float64, strict=False).cast(pl.Int64).fill_null(-1)
+
+    return (
+        episodes.select(['tconst', 'parentTconst', 'seasonNumber', 'episodeNumber'])
+        .join(titles.select(['tconst', 'primaryTitle', 'startYear']), on='tconst', how='inner', maintain_order='left')
+        .join(parent_titles, on='parentTconst', how='inner', maintain_order='left')
+        .with_columns([as_int('seasonNumber'), as_int('episodeNumber'), as_int('startYear')])
+        .sort(['parentTconst', 'seasonNumber', 'episodeNumber'], maintain_order=True)
+        .select(['tconst', 'parentTconst', 'seasonNumber', 'episodeNumber', 'parentTitle', 'primaryTitle', 'startYear'])
+    )
+
+
+def build_score_tables(datasets):
+
+    '''
+    Same as pipeline.build_score_tables on the Polars DataFrames of unzip_and_load_datasets,
+    returning pandas objects.
+    '''
+
+    titles, ratings, episodes = [df.lazy() for df in datasets]
+
+    titles = merge_ratings(titles, ratings)
+    df_episodes = normalise_content(merge_episode_info(episodes, titles), 'Episodes')
+
+    films, series = split_content(titles)
+    films = normalise_content(films, 'Films').rename({'score': 'filmScore', 'scoreRaw': 'filmScoreRaw'})
+    series = normalise_content(series, 'Series').rename({'score': 'seriesScore', 'scoreRaw': 'seriesScoreRaw'})
+
+    # Shared parts of the plans (e.g. the merge with ratings) are computed once
+    titles, films, series, df_episodes, df_index = pl.collect_all(
+        [titles, films, series, df_episodes, index_episodes(titles, episodes)]
+    )
+
+    episode_metric = calculate_episode_metric(df_episodes).rename({'score': 'episodeScore'})
+    runtime_metric = calculate_runtime_metric(df_episodes)
+    series = add_series_metrics(series.lazy(), episode_metric.lazy(), runtime_metric.lazy()).collect()
+
+    df_index = df_index.to_pandas()
+    parents, starts, counts = np.unique(df_index['parentTconst'].to_numpy(), return_index=True, return_counts=True)
+
+    return {
+        'all_titles': titles.to_pandas(),
+        'episodes': datasets[2].to_pandas(),
+        'episode_index': {
+            'episodes': df_index,
+            'parents': parents,
+            'starts': starts,
+            'stops': starts + counts
+        },
+        'films': films.to_pandas(),
+        'series': series.to_pandas()
+    }
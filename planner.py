@@ -0,0 +1,153 @@
+# Watch planner: the unwatched films and series with the highest total score
+# that fit in a time budget (a knapsack over runtime and score).
+#
+# Runtimes are rounded up to buckets (so that plans never exceed the budget),
+# and titles are sorted by score per minute. Taking them in that order until the
+# budget is full is nearly optimal: only titles close to where it stops (the
+# break point) can be swapped for better ones. Titles well before it are taken,
+# titles well after it are left out, and the CORE_SIZE titles around it are
+# solved exactly by dynamic programming over (series taken, budget used). The
+# fractional solution gives an upper bound on the best total score.
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Columns of the table of the dynamic programme: runtimes are rounded up to budget / MAX_BUCKETS minutes
+MAX_BUCKETS = 1000
+
+# Titles around the break point that are solved exactly
+CORE_SIZE = 1000
+
+PLAN_COLUMNS = ['tconst', 'titleType', 'primaryTitle', 'startYear', 'minutes', 'score']
+
+
+def plan_candidates(df_films, df_series, watched_tconst, max_title_minutes=None, finished_only=False):
+
+    '''
+    Unwatched films and series with their runtime (minutes, totalRuntime for series),
+    score, and whether they are series (isSeries).
+    '''
+
+    df_films = df_films.assign(
+        minutes=pd.to_numeric(df_films['runtimeMinutes'], errors='coerce'),
+        score=df_films['filmScore'],
+        isSeries=False
+    )
+
+    if finished_only:
+        df_series = df_series.loc[pd.to_numeric(df_series['endYear'], errors='coerce') <= datetime.date.today().year]
+    df_series = df_series.assign(minutes=df_series['totalRuntime'], score=df_series['seriesScore'], isSeries=True)
+
+    df_candidates = pd.concat([df_films[PLAN_COLUMNS + ['isSeries']], df_series[PLAN_COLUMNS + ['isSeries']]], ignore_index=True)
+
+    is_candidate = ~df_candidates['tconst'].isin(watched_tconst) & (df_candidates['minutes'] > 0)
+    if max_title_minutes is not None:
+        is_candidate &= df_candidates['minutes'] <= max_title_minutes
+
+    return df_candidates.loc[is_candidate].reset_index(drop=True)
+
+
+def solve_core(weights, scores, is_series, capacity, max_series=None):
+
+    '''
+    Positions of the items with the highest total score whose weights add up to
+    at most capacity, with at most max_series series (exact dynamic programme).
+    '''
+
+    # More slots than series would never be used
+    num_slots = 1 if max_series is None else min(max_series, int(is_series.sum())) + 1
+    counts_series = is_series if max_series is not None else np.zeros(len(weights), dtype=bool)
+
+    # best[s, c]: highest score with weight at most c and at most s series
+    best = np.zeros((num_slots, capacity + 1))
+    taken = np.zeros((len(weights), num_slots, capacity + 1), dtype=bool)
+
+    for i, (weight, score) in enumerate(zip(weights, scores)):
+        candidate = np.full_like(best, -np.inf)
+        if counts_series[i]:
+            candidate[1:, weight:] = best[:-1, :capacity + 1 - weight] + score
+        else:
+            candidate[:, weight:] = best[:, :capacity + 1 - weight] + score
+        taken[i] = candidate > best
+        best = np.maximum(best, candidate)
+
+    chosen, slot, budget = [], num_slots - 1, capacity
+    for i in range(len(weights) - 1, -1, -1):
+        if taken[i, slot, budget]:
+            chosen.append(i)
+            budget -= weights[i]
+            slot -= int(counts_series[i])
+
+    return np.array(chosen[::-1], dtype=int)
+
+
+def solve(minutes, scores, is_series, budget_minutes, max_series=None):
+
+    '''
+    Return (positions of the chosen titles, upper bound of the total score) of the
+    knapsack of titles with minutes and scores in budget_minutes, with at most
+    max_series series (no limit if None).
+    '''
+
+    minutes, scores, is_series = np.asarray(minutes, dtype=float), np.asarray(scores, dtype=float), np.asarray(is_series, dtype=bool)
+
+    bucket = max(1.0, budget_minutes / MAX_BUCKETS)
+    capacity = int(budget_minutes // bucket)
+    weights = np.ceil(minutes / bucket).astype(int)
+
+    # Best score per minute first (then best score)
+    fits = np.flatnonzero(weights <= capacity)
+    density = scores[fits] / weights[fits]
+    order = fits[np.lexsort((-scores[fits], -density))]
+    if len(order) == 0:
+        return np.array([], dtype=int), 0.0
+
+    # Break point: the first title that does not fit after all the better ones
+    cumulative = np.cumsum(weights[order])
+    stop = np.searchsorted(cumulative, capacity, side='right')
+    upper_bound = scores[order[:stop]].sum()
+    if stop < len(order):
+        upper_bound += (capacity - (cumulative[stop - 1] if stop > 0 else 0)) * scores[order[stop]] / weights[order[stop]]
+
+    start, end = max(0, stop - CORE_SIZE // 2), min(len(order), stop + CORE_SIZE // 2)
+    fixed = order[:start]
+    core = order[start:end]
+
+    # With a limit, series before the core are not fixed but solved with it
+    if max_series is not None:
+        core = np.concatenate([fixed[is_series[fixed]][:CORE_SIZE], core])
+        fixed = fixed[~is_series[fixed]]
+
+    chosen = solve_core(weights[core], scores[core], is_series[core], capacity - weights[fixed].sum(), max_series)
+
+    return np.concatenate([fixed, core[chosen]]), upper_bound
+
+
+def plan(df_candidates, budget_minutes, max_series=None):
+
+    '''
+    Return (plan, summary): the candidates (see plan_candidates) with the highest total
+    score in budget_minutes, best first and ranked from 1, and their number, total
+    minutes, total score and upper bound of the best total score.
+    '''
+
+    positions, upper_bound = solve(
+        df_candidates['minutes'].to_numpy(dtype=float),
+        df_candidates['score'].to_numpy(dtype=float),
+        df_candidates['isSeries'].to_numpy(dtype=bool),
+        budget_minutes,
+        max_series
+    )
+
+    df_plan = df_candidates.iloc[positions].sort_values(['score', 'tconst'], ascending=[False, True])[PLAN_COLUMNS]
+    df_plan.index = np.arange(1, 1+len(df_plan))
+
+    summary = {
+        'titles': len(df_plan),
+        'minutes': int(df_plan['minutes'].sum()),
+        'score': round(float(df_plan['score'].sum()), 2),
+        'upper_bound': round(float(upper_bound), 2)
+    }
+
+    return df_plan, summary
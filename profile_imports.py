@@ -0,0 +1,90 @@
+# Import-time profile of the app startup path.
+#
+# Runs `python -X importtime` on the modules imported by watch_next.py before the
+# first render and reports the time spent per top-level package, checking that
+# the scraping, image and Cinemagoer stacks are not loaded up front.
+#
+# Usage:
+#   python profile_imports.py
+#   python profile_imports.py --modules fetching_connections --top 30
+import argparse
+import subprocess
+import sys
+
+from collections import defaultdict
+
+# Modules imported by watch_next.py before the FILMS/SERIES panels are rendered
+STARTUP_MODULES = ['streamlit', 'numpy', 'pandas', 'app_functions', 'pipeline']
+
+# Packages that should only be loaded on first use (covers, connections, user ratings, polars engine, SQL queries)
+DEFERRED_PACKAGES = ['imdb', 'bs4', 'PIL', 'requests', 'polars', 'duckdb', 'fetching_connections', 'fetching_ratings']
+
+
+def run_importtime(modules):
+
+    '''
+    Return a list of (package, self_us, cumulative_us, depth) for every module
+    imported by a fresh interpreter that imports modules.
+    '''
+
+    code = 'import {}'.format(', '.join(modules))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # e.g. 'import time:       512 |       1745 |   pandas.core.frame'
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    return entries
+
+
+def summarise(entries):
+
+    '''
+    Aggregate self time by top-level package (e.g. pandas.core.frame -> pandas).
+    '''
+
+    per_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        per_package[name.split('.')[0]] += self_us
+
+    return sorted(per_package.items(), key=lambda x: x[1], reverse=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Import-time profile of the WatchNext startup path.')
+    parser.add_argument('--modules', nargs='+', default=STARTUP_MODULES)
+    parser.add_argument('--top', type=int, default=15, help='number of packages to list')
+    args = parser.parse_args()
+
+    entries = run_importtime(args.modules)
+    loaded = {name.split('.')[0] for name, _, _, _ in entries}
+    total_us = sum(self_us for _, self_us, _, _ in entries)
+
+    print('Import profile of: {}'.format(', '.join(args.modules)))
+    print('Modules imported: {}  Total: {:.1f} ms'.format(len(entries), total_us / 1000), end='\n\n')
+
+    print('{:<30} {:>10} {:>7}'.format('Package', 'Time (ms)', '%'))
+    for package, self_us in summarise(entries)[:args.top]:
+        print('{:<30} {:>10.1f} {:>6.1f}%'.format(package, self_us / 1000, 100 * self_us / total_us))
+
+    eager = [package for package in DEFERRED_PACKAGES if package in loaded]
+    print('\nDeferred packages loaded at startup: {}'.format(', '.join(eager) if eager else 'none'))
+
+    return 1 if eager and args.modules == STARTUP_MODULES else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# SQL over the score tables of a dataset version.
+#
+# The films, series and episodes tables are saved as Parquet files in the
+# snapshot (see export_tables) and queried with DuckDB, which only reads the
+# columns and row groups that a query needs (filters are pushed down to the
+# Parquet scan). The ratings of the user are available as the table user_ratings.
+#
+# The panels of the app are named queries (QUERIES). Other questions only need
+# SQL, e.g. finished mini-series from the 90s under 10 hours rated 8.0 or more:
+#
+#   run_query(connection, '''
+#       SELECT primaryTitle, startYear, endYear, averageRating, totalRuntime
+#       FROM series
+#       WHERE titleType = 'tvMiniSeries' AND startYear BETWEEN 1990 AND 1999
+#         AND endYear <= year(current_date) AND totalRuntime <= $max_minutes
+#         AND averageRating >= 8.0
+#       ORDER BY seriesScoreRaw DESC
+#   ''', {'max_minutes': 10*60})
+#
+# Scores are rounded for display: rank by filmScoreRaw and seriesScoreRaw (unrounded).
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+import snapshots
+
+TABLES = ['films', 'series', 'episodes']
+
+# Columns stored as text with '\N' for missing values in the IMDB datasets,
+# saved as (nullable) integers so that they can be compared in SQL
+INTEGER_COLUMNS = ['startYear', 'endYear', 'runtimeMinutes']
+
+# Rows per Parquet row group: the unit of data skipped by pushed-down filters
+ROW_GROUP_SIZE = 100_000
+
+QUERIES = {
+
+    # Panels of the app (same filters as pipeline.filter_films/filter_series/get_new_episodes)
+
+    'top_films': '''
+        SELECT tconst, titleType, primaryTitle, startYear, runtimeMinutes, averageRating, numVotes, filmScore
+        FROM films
+        WHERE ($show_watched OR NOT EXISTS (SELECT 1 FROM user_ratings WHERE user_ratings.tconst = films.tconst))
+          AND ($max_minutes IS NULL OR runtimeMinutes <= $max_minutes)
+        ORDER BY filmScoreRaw DESC, tconst
+        LIMIT $num_titles
+    ''',
+
+    'top_series': '''
+        SELECT tconst, titleType, primaryTitle, startYear, endYear, averageRating, numVotes, seriesScore, episodeScore, totalRuntime
+        FROM series
+        WHERE ($show_watched OR NOT EXISTS (SELECT 1 FROM user_ratings WHERE user_ratings.tconst = series.tconst))
+          AND ($show_unfinished OR endYear <= year(current_date))
+          AND ($max_minutes IS NULL OR totalRuntime <= $max_minutes)
+        ORDER BY seriesScoreRaw DESC, tconst
+        LIMIT $num_titles
+    ''',
+
+    # Unreleased episodes have startYear -1, so they are never new. Series rated
+    # more than once count from their first rating, as in pipeline.get_new_episodes
+    'missed_episodes': '''
+        WITH watched AS (
+            SELECT tconst, MIN(CAST(dateRating AS INTEGER)) AS dateRating
+            FROM user_ratings
+            GROUP BY tconst
+        )
+        SELECT episodes.*, watched.dateRating
+        FROM episodes
+        JOIN watched ON episodes.parentTconst = watched.tconst
+        WHERE episodes.startYear > watched.dateRating
+        ORDER BY parentTconst, seasonNumber, episodeNumber, episodes.tconst
+    ''',
+
+    # Other rankings
+
+    'top_films_by_genre_and_decade': '''
+        WITH film_genres AS (
+            SELECT unnest(string_split(genres, ',')) AS genre, startYear // 10 * 10 AS decade, *
+            FROM films
+            WHERE genres != '\\N' AND startYear IS NOT NULL AND numVotes >= $min_votes
+        )
+        SELECT genre, decade, tconst, primaryTitle, startYear, averageRating, numVotes, filmScore
+        FROM film_genres
+        QUALIFY row_number() OVER (PARTITION BY genre, decade ORDER BY filmScoreRaw DESC, tconst) <= $num_titles
+        ORDER BY genre, decade, filmScore DESC, tconst
+    '''
+}
+
+
+def parquet_path(version, table):
+    return snapshots.snapshot_path(version, '{}.parquet'.format(table))
+
+
+def sql_tables(tables):
+
+    '''
+    Tables of build_score_tables as they are queried in SQL.
+    '''
+
+    df_films = tables['films'].drop(columns='endYear')
+    df_series = tables['series']
+    df_episodes = tables['episode_index']['episodes']
+
+    sql = {}
+    for name, df in zip(TABLES, [df_films, df_series, df_episodes]):
+        df = df.copy()
+        for col in INTEGER_COLUMNS:
+            if col in df.columns and not pd.api.types.is_integer_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
+        sql[name] = df
+
+    return sql
+
+
+def export_tables(tables, version):
+
+    '''
+    Save the films, series and episodes tables of a version as Parquet files.
+    '''
+
+    for name, df in sql_tables(tables).items():
+        path = parquet_path(version, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rename once fully written so that readers never see a partial file
+        df.to_parquet(path + '.tmp', index=False, row_group_size=ROW_GROUP_SIZE)
+        os.replace(path + '.tmp', path)
+
+
+def has_tables(version):
+    return all(os.path.exists(parquet_path(version, name)) for name in TABLES)
+
+
+def connect(version):
+
+    '''
+    In-memory DuckDB database with a view over the Parquet file of every table.
+    Use a cursor per thread (run_query does).
+    '''
+
+    connection = duckdb.connect()
+
+    for name in TABLES:
+        path = parquet_path(version, name).replace("'", "''")
+        connection.execute("CREATE VIEW {} AS SELECT * FROM read_parquet('{}')".format(name, path))
+
+    return connection
+
+
+def run_query(connection, sql, params=None, df_user_ratings=None):
+
+    '''
+    Run sql with its $name parameters taken from params, and return a DataFrame
+    ranked from 1. df_user_ratings (tconst, userRating, dateRating) is the table
+    user_ratings, only visible to this query.
+    '''
+
+    cursor = connection.cursor()
+
+    try:
+        if df_user_ratings is not None:
+            cursor.register('user_ratings', df_user_ratings)
+        df = cursor.execute(sql, params or {}).df()
+    finally:
+        cursor.close()
+
+    df.index = np.arange(1, 1+len(df))
+
+    return df
+
+
+def run_named_query(connection, name, params=None, df_user_ratings=None):
+    return run_query(connection, QUERIES[name], params, df_user_ratings)
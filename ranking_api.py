@@ -0,0 +1,350 @@
+# HTTP API serving the rankings of WatchNext to other tools, next to the
+# Streamlit app, with JSON responses:
+#
+#   GET /films?top=20&max_hours=2&show_watched=false&user=ur103598244
+#   GET /series?top=20&max_days=5&show_watched=false&show_ongoing=false&user=...
+#   GET /episodes?user=...
+#   GET /connections?num_titles=5&user=...
+#   GET /metrics                                  (latency of every endpoint, per worker)
+#   GET /metrics?format=prometheus                (outbound requests and caches, see telemetry.py)
+#   GET /health
+#
+# Several worker processes (uvicorn, async) serve the same score tables: the
+# parent publishes them as Arrow files once (see shared_tables.py) and every
+# worker maps them, so they are held once in memory whatever the number of
+# workers. Like the app, every worker serves the live snapshot of
+# snapshot_manager.py: a new dataset version is built in the background and
+# swapped in once ready. Rankings are computed on a thread pool, so that reading
+# the ratings store or scraping never blocks the other requests. Watched titles
+# are those of the user in the ratings store (see ratings_store.py, imported by
+# the app or `watch_next_cli.py import-ratings`).
+#
+# Throughput is measured by benchmarks/load_api.py.
+#
+# Every response has an ETag derived from the dataset version, the request and
+# the version of the ratings store, so a client sending it back in If-None-Match
+# gets a 304 without anything being computed, and computed responses are kept
+# in memory until one of them changes.
+#
+# Usage:
+#   python ranking_api.py --port 8502 --workers 4
+import argparse
+import hashlib
+import os
+import time
+
+from collections import OrderedDict, defaultdict, deque
+
+import numpy as np
+
+import pipeline
+import ratings_store
+import snapshot_manager
+import snapshots
+import telemetry
+from config import API_HOST, API_PORT, API_WORKERS, DATA_DIR, ENGINE, IMDB_USER_ID
+
+# Computed responses kept per worker
+RESPONSE_CACHE_SIZE = 1024
+
+# Latencies kept per endpoint for the percentiles of /metrics
+LATENCY_WINDOW = 10_000
+
+_responses = OrderedDict()
+_ratings = {}
+_latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_counts = defaultdict(lambda: {'requests': 0, 'not_modified': 0, 'cached': 0, 'errors': 0})
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def load_tables(data_dir=DATA_DIR, engine=ENGINE):
+
+    '''
+    Load (or map) the score tables of the current dataset version and make them the live snapshot.
+    '''
+
+    version = snapshots.dataset_version(data_dir)
+    snapshot_manager.install(version, snapshot_manager.load_tables(version, data_dir, engine))
+
+
+def live_snapshot():
+
+    '''
+    (version, tables) of the live snapshot, after starting to build a new
+    dataset version in the background if there is one (see snapshot_manager.check).
+    '''
+
+    snapshot_manager.check()
+
+    return snapshot_manager.live()
+
+
+def user_ratings(user):
+
+    '''
+    Ratings of user in the ratings store, read again only when the store changes.
+    '''
+
+    store_version = ratings_store.store_version()
+    if user not in _ratings or _ratings[user][0] != store_version:
+        _ratings[user] = (store_version, ratings_store.read_user_ratings(user))
+
+    return _ratings[user][1]
+
+
+def param(query, name, convert, default):
+
+    value = query.get(name)
+    if value is None:
+        return default
+
+    try:
+        return convert(value)
+    except ValueError:
+        raise BadRequest('Invalid value for {}: {!r}'.format(name, value))
+
+
+def boolean(value):
+
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def top_films(tables, query):
+
+    df_user_ratings = user_ratings(param(query, 'user', str, IMDB_USER_ID))
+
+    return pipeline.filter_films(
+        tables['films'],
+        df_user_ratings['tconst'],
+        show_watched=param(query, 'show_watched', boolean, False),
+        max_duration_hours=param(query, 'max_hours', float, 2.0),
+        num_titles=param(query, 'top', int, 20)
+    )
+
+
+def top_series(tables, query):
+
+    df_user_ratings = user_ratings(param(query, 'user', str, IMDB_USER_ID))
+
+    return pipeline.filter_series(
+        tables['series'],
+        df_user_ratings['tconst'],
+        show_watched=param(query, 'show_watched', boolean, False),
+        show_unfinished=param(query, 'show_ongoing', boolean, False),
+        max_duration_days=param(query, 'max_days', int, 5),
+        num_titles=param(query, 'top', int, 20)
+    )
+
+
+def missed_episodes(tables, query):
+
+    df_user_ratings = user_ratings(param(query, 'user', str, IMDB_USER_ID))
+    df_new_episodes, _ = pipeline.get_new_episodes(tables['episode_index'], df_user_ratings)
+
+    return df_new_episodes.drop(columns='index')
+
+
+def connections(tables, query):
+
+    # Only needed for connections (web-scraping)
+    from fetching_connections import connections_table, new_search, search_connections
+
+    df_user_ratings = user_ratings(param(query, 'user', str, IMDB_USER_ID))
+    num_titles = param(query, 'num_titles', int, 5)
+
+    search = new_search()
+    for _ in search_connections(tables['all_titles'], df_user_ratings['tconst'], search):
+        if len(search['franchises']) >= num_titles:
+            break
+
+    return connections_table(search['franchises'])
+
+
+# Endpoint: (function, whether it depends on the ratings store)
+ENDPOINTS = {
+    'films': (top_films, True),
+    'series': (top_series, True),
+    'episodes': (missed_episodes, True),
+    'connections': (connections, True)
+}
+
+
+def to_json(df):
+
+    '''
+    JSON records of a ranking (ranked from 1), as bytes.
+    '''
+
+    df = df.reset_index(drop=True)
+    df.insert(0, 'rank', np.arange(1, 1+len(df)))
+
+    return df.to_json(orient='records', date_format='iso').encode()
+
+
+def etag(version, name, query, uses_ratings):
+
+    key = repr((version, name, sorted(query.items()), ratings_store.store_version() if uses_ratings else None))
+
+    return '"{}"'.format(hashlib.sha1(key.encode()).hexdigest()[:20])
+
+
+def record_latency(name, seconds, outcome=None):
+
+    _latencies[name].append(seconds)
+    _counts[name]['requests'] += 1
+    if outcome is not None:
+        _counts[name][outcome] += 1
+
+
+def metrics():
+
+    '''
+    Requests, 304s, cache hits, errors and latency percentiles (ms) of every endpoint of this worker.
+    '''
+
+    summary = {'pid': os.getpid(), 'version': snapshot_manager.live()[0], 'endpoints': {}}
+
+    for name, latencies in _latencies.items():
+        milliseconds = 1000 * np.array(latencies)
+        summary['endpoints'][name] = dict(
+            _counts[name],
+            p50_ms=round(float(np.percentile(milliseconds, 50)), 3),
+            p95_ms=round(float(np.percentile(milliseconds, 95)), 3),
+            p99_ms=round(float(np.percentile(milliseconds, 99)), 3),
+            max_ms=round(float(milliseconds.max()), 3)
+        )
+
+    return summary
+
+
+def create_app():
+
+    '''
+    Starlette application of a worker (the tables are loaded when it starts).
+    '''
+
+    from contextlib import asynccontextmanager
+
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    async def ranking(request):
+
+        name = request.path_params['name']
+        if name not in ENDPOINTS:
+            return JSONResponse({'error': 'Unknown ranking {!r}'.format(name)}, status_code=404)
+
+        func, uses_ratings = ENDPOINTS[name]
+        start = time.perf_counter()
+        query = dict(request.query_params)
+
+        # Pinned for the whole request, whatever swaps meanwhile
+        version, tables = live_snapshot()
+        tag = etag(version, name, query, uses_ratings)
+        if tag in request.headers.get('if-none-match', ''):
+            record_latency(name, time.perf_counter() - start, 'not_modified')
+            return Response(status_code=304, headers={'ETag': tag})
+
+        outcome = 'cached'
+        body = _responses.get(tag)
+        if body is None:
+            outcome = None
+            try:
+                # Reading the ratings store or scraping blocks: run on a thread so that the other requests are served meanwhile
+                df = await run_in_threadpool(func, tables, query)
+            except BadRequest as error:
+                record_latency(name, time.perf_counter() - start, 'errors')
+                return JSONResponse({'error': str(error)}, status_code=400)
+            body = to_json(df)
+            _responses[tag] = body
+            if len(_responses) > RESPONSE_CACHE_SIZE:
+                _responses.popitem(last=False)
+        else:
+            _responses.move_to_end(tag)
+
+        record_latency(name, time.perf_counter() - start, outcome)
+
+        return Response(body, media_type='application/json', headers={'ETag': tag, 'Cache-Control': 'no-cache'})
+
+    async def metrics_endpoint(request):
+        if request.query_params.get('format') == 'prometheus':
+            return PlainTextResponse(telemetry.prometheus_text(), media_type='text/plain; version=0.0.4')
+        return JSONResponse(metrics())
+
+    async def health(request):
+        return JSONResponse({'status': 'ok', 'version': snapshot_manager.live()[0], 'pid': os.getpid()})
+
+    @asynccontextmanager
+    async def lifespan(app):
+        load_tables()
+        yield
+
+    return Starlette(
+        routes=[
+            Route('/health', health),
+            Route('/metrics', metrics_endpoint),
+            Route('/{name}', ranking)
+        ],
+        lifespan=lifespan
+    )
+
+
+def http_protocol(*args, **kwargs):
+
+    '''
+    HTTP protocol of uvicorn sending responses without delay (TCP_NODELAY). With
+    several workers, uvicorn binds the socket itself and asyncio leaves Nagle's
+    algorithm on, so the body of every response waited ~40 ms for the delayed ACK of its headers.
+    '''
+
+    import socket
+
+    from uvicorn.protocols.http.auto import AutoHTTPProtocol
+
+    protocol = AutoHTTPProtocol(*args, **kwargs)
+    connection_made = protocol.connection_made
+
+    def no_delay(transport):
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection_made(transport)
+
+    protocol.connection_made = no_delay
+
+    return protocol
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='HTTP API of the WatchNext rankings.')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=API_WORKERS)
+    args = parser.parse_args(argv)
+
+    import shared_tables
+    import uvicorn
+
+    # Published once here, so that every worker maps the same files instead of building its own tables
+    version = snapshots.dataset_version(DATA_DIR)
+    if not shared_tables.is_published(version):
+        shared_tables.publish(snapshot_manager.load_tables(version, DATA_DIR, ENGINE), version)
+
+    uvicorn.run(
+        'ranking_api:create_app', factory=True, http='ranking_api:http_protocol',
+        host=args.host, port=args.port, workers=args.workers, log_level='warning'
+    )
+
+
+if __name__ == '__main__':
+    main()
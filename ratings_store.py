@@ -0,0 +1,225 @@
+# Ratings imported from IMDB export files ("Your ratings" > Export on IMDB),
+# used when the ratings page of a user cannot be scraped.
+#
+# Any number of export CSVs (one per user) are read with only the columns that
+# are needed and their dates parsed at once, merged into a single Parquet file
+# (one row per user and title, typed columns) and read back per user. An export
+# lists every rating of its user, so it replaces the ratings of that user from
+# earlier imports (ratings deleted on IMDB go away). A folder can be
+# watched: each import only reads the export files that are new or changed since
+# the previous one (tracked in a manifest next to the store).
+import json
+import os
+import re
+
+import pandas as pd
+
+from config import IMDB_USER_ID, RATINGS_EXPORTS_DIR, RATINGS_STORE_DIR
+from instrumentation import log_event
+
+STORE_FILE = 'ratings.parquet'
+MANIFEST_FILE = 'imported_exports.json'
+
+# Columns of the export files, and their names in the store
+EXPORT_COLUMNS = {'Const': 'tconst', 'Your Rating': 'userRating', 'Date Rated': 'dateRated'}
+
+STORE_COLUMNS = ['user', 'tconst', 'userRating', 'dateRated', 'dateRating']
+
+
+def store_path(name, store_dir=RATINGS_STORE_DIR):
+    return os.path.join(store_dir, name)
+
+
+def export_user(path, default=IMDB_USER_ID):
+
+    '''
+    User of an export file: the IMDB user id in its name (e.g. ur103598244.csv), default otherwise.
+    '''
+
+    found = re.search(r'ur\d+', os.path.basename(path))
+
+    return found.group(0) if found else default
+
+
+def is_export(path):
+
+    '''
+    Whether a CSV file has the columns of an export file (only its header is read).
+    '''
+
+    try:
+        columns = pd.read_csv(path, nrows=0).columns
+    except pd.errors.EmptyDataError:
+        return False
+
+    return set(EXPORT_COLUMNS) <= set(columns)
+
+
+def read_export(path, user=None):
+
+    '''
+    Read an export CSV into the columns of the store (dates parsed at once, full date kept).
+    '''
+
+    df = pd.read_csv(path, usecols=list(EXPORT_COLUMNS), dtype={'Const': 'str', 'Your Rating': 'int8', 'Date Rated': 'str'})
+    df = df.rename(columns=EXPORT_COLUMNS)
+
+    df['dateRated'] = pd.to_datetime(df['dateRated'], format='%Y-%m-%d')
+    # Year of rating, compared with the release year of episodes (see pipeline.get_new_episodes)
+    df['dateRating'] = df['dateRated'].dt.year.astype('int16')
+    df.insert(0, 'user', pd.Series(user or export_user(path), index=df.index, dtype='str'))
+
+    return df[STORE_COLUMNS]
+
+
+def load_store(store_dir=RATINGS_STORE_DIR):
+
+    path = store_path(STORE_FILE, store_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame({
+            'user': pd.Series(dtype='str'),
+            'tconst': pd.Series(dtype='str'),
+            'userRating': pd.Series(dtype='int8'),
+            'dateRated': pd.Series(dtype='datetime64[us]'),
+            'dateRating': pd.Series(dtype='int16')
+        })
+
+    return pd.read_parquet(path)
+
+
+def merge_ratings(df_store, df_new, users):
+
+    '''
+    Replace the ratings of users in df_store by theirs in df_new (none for a user
+    whose export is empty).
+    '''
+
+    df = pd.concat([df_store.loc[~df_store['user'].isin(users)], df_new], ignore_index=True)
+    df = df.drop_duplicates(['user', 'tconst'], keep='last')
+
+    return df.sort_values(['user', 'dateRated', 'tconst'], ascending=[True, False, True], kind='stable').reset_index(drop=True)
+
+
+def save_store(df, store_dir=RATINGS_STORE_DIR):
+
+    path = store_path(STORE_FILE, store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    # Rename once fully written so that readers never see a partial file
+    df.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return path
+
+
+def import_exports(paths, user=None, store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Import export files into the store, with the user of each file (see export_user)
+    unless user is given. The ratings of a user are replaced by those of their last
+    file (in the order of paths). Other CSVs are skipped (and logged). Return the
+    number of ratings read.
+    '''
+
+    frames = {}
+    num_read = 0
+    for path in paths:
+        if is_export(path):
+            df = read_export(path, user)
+            frames[user or export_user(path)] = df
+            num_read += len(df)
+        else:
+            log_event('Not a ratings export', kind='skipped', path=path)
+
+    if not frames:
+        return 0
+
+    save_store(merge_ratings(load_store(store_dir), pd.concat(frames.values(), ignore_index=True), list(frames)), store_dir)
+
+    return num_read
+
+
+def import_folder(folder=RATINGS_EXPORTS_DIR, store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Import the export files of a folder that are new or changed since the last
+    import (oldest first, by name when modified at the same time). Return the
+    paths read (files that are not exports are skipped, see import_exports).
+    '''
+
+    if not os.path.isdir(folder):
+        return []
+
+    manifest_path = store_path(MANIFEST_FILE, store_dir)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    files = {}
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.lower().endswith('.csv') and os.path.isfile(path):
+            stat = os.stat(path)
+            files[path] = [stat.st_mtime, stat.st_size]
+
+    new_paths = sorted((path for path, signature in files.items() if manifest.get(path) != signature), key=lambda path: (files[path][0], path))
+    if not new_paths:
+        return []
+
+    import_exports(new_paths, store_dir=store_dir)
+
+    manifest.update({path: files[path] for path in new_paths})
+    os.makedirs(store_dir, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return new_paths
+
+
+def summary(store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Number of ratings and dates of the first and last one, per user of the store.
+    '''
+
+    return load_store(store_dir).groupby('user').agg(
+        ratings=('tconst', 'size'),
+        firstRated=('dateRated', 'min'),
+        lastRated=('dateRated', 'max')
+    ).reset_index()
+
+
+def store_version(store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Modification time of the store (None if empty): changes with every import.
+    '''
+
+    path = store_path(STORE_FILE, store_dir)
+
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def read_user_ratings(id_user=IMDB_USER_ID, store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Ratings of a user in the store (tconst, userRating, dateRating, dateRated), most recent first.
+    '''
+
+    path = store_path(STORE_FILE, store_dir)
+    # Only the row groups of the user are read
+    df = pd.read_parquet(path, filters=[('user', '==', id_user)]) if os.path.exists(path) else load_store(store_dir)
+
+    return df[['tconst', 'userRating', 'dateRating', 'dateRated']].reset_index(drop=True)
+
+
+def get_user_ratings(id_user=IMDB_USER_ID, folder=RATINGS_EXPORTS_DIR, store_dir=RATINGS_STORE_DIR):
+
+    '''
+    Same as read_user_ratings, after importing the new export files of folder.
+    '''
+
+    import_folder(folder, store_dir)
+
+    return read_user_ratings(id_user, store_dir)
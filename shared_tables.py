@@ -0,0 +1,101 @@
+# Score tables shared by every process of a host (e.g. several Streamlit
+# servers behind a load balancer, or the CLI).
+#
+# The first process to build the tables of a dataset version publishes them as
+# uncompressed Arrow IPC files in the snapshot. The others memory-map the files
+# read-only instead of downloading, parsing and scoring the datasets again: the
+# columns of the DataFrames point into the mapped files, so their pages are held
+# once by the OS page cache whatever the number of processes, and attaching
+# takes milliseconds.
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import snapshots
+
+# DataFrames of pipeline.build_score_tables (the episode index is rebuilt from its episodes)
+SHARED_TABLES = ['all_titles', 'episodes', 'films', 'series', 'episode_index']
+
+
+def shared_path(version, name):
+    return snapshots.snapshot_path(version, '{}.arrow'.format(name))
+
+
+def table_frame(tables, name):
+    return tables['episode_index']['episodes'] if name == 'episode_index' else tables[name]
+
+
+def is_published(version):
+    return all(os.path.exists(shared_path(version, name)) for name in SHARED_TABLES)
+
+
+def publish(tables, version):
+
+    '''
+    Write the tables of build_score_tables as Arrow IPC files of the snapshot.
+    '''
+
+    for name in SHARED_TABLES:
+        table = pa.Table.from_pandas(table_frame(tables, name), preserve_index=False)
+
+        path = shared_path(version, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rename once fully written so that readers never map a partial file
+        with pa.OSFile(path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(path + '.tmp', path)
+
+
+def map_table(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def to_frame(table):
+
+    '''
+    DataFrame whose columns are read-only views of the Arrow table (no copy:
+    split_blocks keeps every numeric column on its own buffer).
+    '''
+
+    return table.to_pandas(split_blocks=True)
+
+
+def episode_index_arrays(parent_tconsts):
+
+    '''
+    parents, starts and stops of pipeline.build_episode_index, from the (sorted)
+    parentTconst column of the indexed episodes.
+    '''
+
+    num_episodes = len(parent_tconsts)
+    if num_episodes == 0:
+        empty = np.array([], dtype=int)
+        return np.array([], dtype=object), empty, empty
+
+    # A series starts where parentTconst changes
+    is_start = pc.not_equal(parent_tconsts[1:], parent_tconsts[:-1])
+    starts = np.concatenate([[0], np.flatnonzero(is_start.to_numpy(zero_copy_only=False)) + 1])
+    parents = parent_tconsts.take(pa.array(starts)).to_numpy(zero_copy_only=False).astype(object)
+
+    return parents, starts, np.append(starts[1:], num_episodes)
+
+
+def attach(version):
+
+    '''
+    Map the published tables of a version (None if they have not been published),
+    in the format of pipeline.build_score_tables.
+    '''
+
+    if not is_published(version):
+        return None
+
+    arrow_tables = {name: map_table(shared_path(version, name)) for name in SHARED_TABLES}
+    tables = {name: to_frame(table) for name, table in arrow_tables.items()}
+
+    parents, starts, stops = episode_index_arrays(arrow_tables['episode_index'].column('parentTconst'))
+    tables['episode_index'] = {'episodes': tables['episode_index'], 'parents': parents, 'starts': starts, 'stops': stops}
+
+    return tables
@@ -0,0 +1,222 @@
+# "More like this": approximate nearest neighbours between films and series.
+#
+# Each candidate title (see pipeline.candidate_titles) is embedded as a dense,
+# unit-length vector of genres, year, runtime, rating and votes, so that the dot
+# product of two vectors is their cosine similarity. Vectors are grouped with
+# k-means into inverted lists (IVF): a lookup only scans the lists of the
+# clusters closest to the query instead of every title. Other titles (e.g. with
+# too few votes, found by the search) are embedded when they are looked up, with
+# the genres and standardisation of the candidates stored in the index.
+import os
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+import snapshots
+
+INDEX_FILE = 'similar_titles.npz'
+
+# Relative importance of each group of features in the similarity
+GENRE_WEIGHT = 1.0
+NUMERIC_WEIGHT = 0.5
+
+
+def genre_dummies(df_titles):
+
+    genres = df_titles['genres'].where(df_titles['genres'] != '\\N', '')
+
+    return genres.str.get_dummies(sep=',').astype(np.float32)
+
+
+def numeric_features(df_titles):
+
+    return pd.DataFrame({
+        'year': pd.to_numeric(df_titles['startYear'], errors='coerce'),
+        'runtime': np.log1p(pd.to_numeric(df_titles['runtimeMinutes'], errors='coerce')),
+        'rating': df_titles['averageRating'].astype(float),
+        'votes': np.log1p(df_titles['numVotes'].astype(float)),
+    })
+
+
+def embedding_scale(df_candidates):
+
+    '''
+    Genres of the candidates, and mean and standard deviation of their numeric features.
+    '''
+
+    numeric = numeric_features(df_candidates)
+
+    return {
+        'genre_names': genre_dummies(df_candidates).columns.to_numpy(dtype=str),
+        'numeric_mean': numeric.mean().to_numpy(),
+        'numeric_std': numeric.std().replace(0, 1).to_numpy()
+    }
+
+
+def embed_titles(df_titles, scale=None):
+
+    '''
+    Return a float32 matrix with one unit-length row per title, with the genres and
+    standardisation of scale (see embedding_scale; by default that of df_titles).
+    '''
+
+    if scale is None:
+        scale = embedding_scale(df_titles)
+
+    # Genres unknown to the candidates are ignored
+    df_genres = genre_dummies(df_titles).reindex(columns=scale['genre_names'], fill_value=0)
+    n_genres = df_genres.sum(axis=1).replace(0, 1).to_numpy()[:, None]
+    genre_vectors = GENRE_WEIGHT * df_genres.to_numpy() / np.sqrt(n_genres)
+
+    # Standardise, and put missing values at the mean
+    numeric = (numeric_features(df_titles) - scale['numeric_mean']) / scale['numeric_std']
+    numeric_vectors = NUMERIC_WEIGHT * numeric.fillna(0).to_numpy(dtype=np.float32)
+
+    vectors = np.hstack([genre_vectors, numeric_vectors]).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+
+    return vectors / norms
+
+
+def assign_clusters(vectors, centroids, chunk_size=100_000):
+
+    '''
+    Index of the most similar centroid of each vector (in chunks to bound memory).
+    '''
+
+    return np.concatenate([
+        np.argmax(vectors[i:i+chunk_size] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), chunk_size)
+    ])
+
+
+def train_centroids(vectors, n_clusters, n_iter=15, sample_size=100_000, seed=0):
+
+    '''
+    Spherical k-means on a sample of the vectors.
+    '''
+
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = assign_clusters(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        is_used = norms[:, 0] > 0
+        centroids[is_used] = sums[is_used] / norms[is_used]
+
+    return centroids
+
+
+def build_index(df_candidates, n_clusters=None, seed=0):
+
+    '''
+    Build the IVF index of the candidates. Vectors (and tconsts) are stored sorted
+    by cluster, the vectors of cluster c being at offsets[c]:offsets[c+1].
+    '''
+
+    scale = embedding_scale(df_candidates)
+    vectors = embed_titles(df_candidates, scale)
+    tconsts = df_candidates['tconst'].to_numpy(dtype=str)
+
+    if n_clusters is None:
+        n_clusters = max(1, int(np.sqrt(len(vectors))))
+    n_clusters = min(n_clusters, len(vectors))
+
+    centroids = train_centroids(vectors, n_clusters, seed=seed)
+    assignment = assign_clusters(vectors, centroids)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_clusters))])
+
+    # tconsts in alphabetical order with their position in the index, for lookups by tconst
+    index_tconsts = tconsts[order]
+    lookup = np.argsort(index_tconsts)
+
+    return {
+        'centroids': centroids,
+        'vectors': vectors[order],
+        'tconsts': index_tconsts,
+        'offsets': offsets,
+        'lookup_tconsts': index_tconsts[lookup],
+        'lookup_positions': lookup,
+        **scale
+    }
+
+
+def save_index(index, version):
+
+    path = snapshots.snapshot_path(version, INDEX_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Rename once fully written so that readers never see a partial index
+    np.savez(path + '.tmp.npz', **index)
+    os.replace(path + '.tmp.npz', path)
+
+    return path
+
+
+def load_index(version):
+
+    '''
+    Load the index of a snapshot (None if it has not been built).
+    '''
+
+    if not os.path.exists(snapshots.snapshot_path(version, INDEX_FILE)):
+        return None
+
+    with np.load(snapshots.snapshot_path(version, INDEX_FILE)) as data:
+        return {key: data[key] for key in data.files}
+
+
+def find_position(index, tconst):
+
+    '''
+    Position of tconst in the index (None if it is not indexed).
+    '''
+
+    lookup_tconsts = index['lookup_tconsts']
+    i = np.searchsorted(lookup_tconsts, tconst)
+    if i == len(lookup_tconsts) or lookup_tconsts[i] != tconst:
+        return None
+
+    return index['lookup_positions'][i]
+
+
+def more_like_this(index, tconst, num_titles=10, exclude_tconsts=(), num_probes=8, df_titles=None):
+
+    '''
+    Return a DataFrame (tconst, similarity) with the num_titles titles most similar
+    to tconst, skipping tconst itself and exclude_tconsts (e.g. watched titles).
+    Only the num_probes clusters closest to tconst are searched. A title that is
+    not indexed is embedded from its row in df_titles (e.g. all_titles); the
+    result is empty if it is not there either.
+    '''
+
+    position = find_position(index, tconst)
+    if position is not None:
+        query = index['vectors'][position]
+    else:
+        df_title = df_titles.loc[df_titles['tconst'] == tconst] if df_titles is not None else None
+        if df_title is None or len(df_title) == 0:
+            return pd.DataFrame({'tconst': [], 'similarity': []})
+        query = embed_titles(df_title.head(1), index)[0]
+
+    centroids, offsets = index['centroids'], index['offsets']
+
+    num_probes = min(num_probes, len(centroids))
+    probes = np.argpartition(-(centroids @ query), num_probes - 1)[:num_probes]
+    rows = np.concatenate([np.arange(offsets[c], offsets[c+1]) for c in probes])
+
+    similarity = index['vectors'][rows] @ query
+    is_excluded = (index['tconsts'][rows] == tconst) | np.isin(index['tconsts'][rows], np.asarray(list(exclude_tconsts), dtype=str))
+    top = pipeline.top_k_positions(similarity, num_titles, mask=~is_excluded)
+
+    return pd.DataFrame({
+        'tconst': index['tconsts'][rows[top]],
+        'similarity': np.round(similarity[top], 3)
+    })
@@ -0,0 +1,203 @@
+# Hot-swappable dataset snapshots, double buffered.
+#
+# The app serves the live snapshot (score tables of one dataset version) to new
+# sessions. Once the IMDB datasets have a new version, a thread builds its
+# snapshot in the background (tables, shared tables, title search index and SQL
+# tables) while the live one keeps serving, then swaps the live version in one
+# assignment. Sessions started before keep the version they pinned until they
+# switch or go away; a version that is neither live nor pinned by a recently
+# active session is freed (dropped from here and from the versioned caches).
+import threading
+import time
+
+import instrumentation
+import pipeline
+import snapshots
+from cache import clear_versioned
+from config import DATA_DIR, ENGINE, SNAPSHOT_CHECK_SECONDS, SNAPSHOT_IDLE_SECONDS
+
+_lock = threading.Lock()
+_live = None            # Version served to new sessions
+_tables = {}            # Tables of every version held: the live one and those pinned by sessions
+_sessions = {}          # Session id: (pinned version, time of its last rerun)
+_builder = None         # Thread building the next version
+_last_check = None
+_free_callbacks = []    # Called with every freed version (e.g. to clear the caches of the app)
+
+STATUS = {'building': None, 'swaps': 0, 'freed': 0, 'failed': 0}
+
+
+def load_tables(version, data_dir=DATA_DIR, engine=ENGINE):
+
+    '''
+    Score tables of a version: mapped if another process has published them,
+    otherwise loaded from the snapshot, computed and saved first if needed.
+    '''
+
+    import shared_tables
+
+    tables = shared_tables.attach(version)
+    if tables is not None:
+        return tables
+
+    if version in snapshots.list_versions():
+        return snapshots.load_score_tables(version)
+
+    tables = pipeline.compute_score_tables(data_dir, engine)
+    snapshots.save_score_tables(tables, version)
+
+    return tables
+
+
+def prepare(tables, version):
+
+    '''
+    Build what the first session of a version needs, so that it does not wait
+    for it: shared tables, title search index and SQL tables.
+    '''
+
+    import queries
+    import shared_tables
+    import title_search
+
+    if not shared_tables.is_published(version):
+        shared_tables.publish(tables, version)
+
+    if title_search.load_index(version) is None:
+        title_search.save_index(title_search.build_index(tables['all_titles']), version)
+
+    if not queries.has_tables(version):
+        queries.export_tables(tables, version)
+
+
+def build(version, data_dir, engine):
+
+    global _builder
+
+    try:
+        with instrumentation.stage('Building snapshot {}'.format(version)):
+            tables = load_tables(version, data_dir, engine)
+            prepare(tables, version)
+        install(version, tables)
+    except Exception as error:     # e.g. download errors: the live version keeps serving, retried at the next check
+        with _lock:
+            STATUS['failed'] += 1
+        instrumentation.log_event('build_snapshot', kind='error', version=version, error=str(error))
+    finally:
+        with _lock:
+            _builder = None
+            STATUS['building'] = None
+
+
+def install(version, tables):
+
+    '''
+    Make tables the live snapshot (older versions are freed once no session uses them).
+    '''
+
+    global _live
+
+    with _lock:
+        _tables[version] = tables
+        if _live is not None and _live != version:
+            STATUS['swaps'] += 1
+        _live = version
+
+    sweep()
+
+
+def live():
+
+    '''
+    Return (version, tables) of the live snapshot, (None, None) before the first one.
+    '''
+
+    with _lock:
+        return _live, _tables.get(_live)
+
+
+def check(data_dir=DATA_DIR, engine=ENGINE, interval=SNAPSHOT_CHECK_SECONDS):
+
+    '''
+    Start building the snapshot of the current dataset version in the background
+    if it is not the live one (at most every interval seconds, one build at a time).
+    '''
+
+    global _builder, _last_check
+
+    with _lock:
+        now = time.monotonic()
+        if _live is None or _builder is not None or (_last_check is not None and now - _last_check < interval):
+            return
+        _last_check = now
+
+    version = snapshots.dataset_version(data_dir)
+
+    with _lock:
+        if version == _live or _builder is not None:
+            return
+        STATUS['building'] = version
+        _builder = threading.Thread(target=build, args=(version, data_dir, engine), name='watchnext-snapshot', daemon=True)
+        _builder.start()
+
+
+def on_free(callback):
+
+    '''
+    Call callback(version) whenever a version is freed (see sweep).
+    '''
+
+    _free_callbacks.append(callback)
+
+
+def pin(session_id, version):
+
+    '''
+    Record that a session (rerun now) uses version, so that it is not freed.
+    '''
+
+    with _lock:
+        _sessions[session_id] = (version, time.monotonic())
+
+
+def sweep(idle_seconds=SNAPSHOT_IDLE_SECONDS):
+
+    '''
+    Forget sessions without a rerun for idle_seconds, and free the versions that
+    are neither live nor pinned. Return the freed versions.
+    '''
+
+    now = time.monotonic()
+
+    with _lock:
+        for session_id, (_, last_seen) in list(_sessions.items()):
+            if now - last_seen > idle_seconds:
+                del _sessions[session_id]
+
+        pinned = {version for version, _ in _sessions.values()}
+        freed = [version for version in _tables if version != _live and version not in pinned]
+        for version in freed:
+            del _tables[version]
+        STATUS['freed'] += len(freed)
+
+    for version in freed:
+        clear_versioned(version=version)
+        for callback in _free_callbacks:
+            callback(version)
+        instrumentation.log_event('free_snapshot', version=version)
+
+    return freed
+
+
+def status():
+
+    '''
+    Live version, version being built, versions held (with their number of sessions),
+    and counts of swaps, freed versions and failed builds.
+    '''
+
+    with _lock:
+        sessions = {version: 0 for version in _tables}
+        for version, _ in _sessions.values():
+            sessions[version] = sessions.get(version, 0) + 1
+        return dict(STATUS, live=_live, sessions=sessions)
@@ -0,0 +1,92 @@
+# Dataset snapshots: score tables and indexes derived from one version of the
+# IMDB datasets, persisted under SNAPSHOT_DIR/schema-<SNAPSHOT_SCHEMA>/<version>/
+# so that they can be precomputed offline (see watch_next_cli.py precompute) and
+# reused.
+import os
+import pickle
+
+from datetime import date, datetime
+
+import pipeline
+from config import SNAPSHOT_DIR
+
+# Format of what snapshots hold: bump it whenever a table or index changes (e.g.
+# new columns), so that snapshots built by older code are rebuilt, not loaded
+# 2: filmScoreRaw and seriesScoreRaw
+# 3: scale of the embeddings in the "more like this" index (see similar_titles.embedding_scale)
+SNAPSHOT_SCHEMA = 3
+
+
+def dataset_version(data_dir=None):
+
+    '''
+    Version of the IMDB datasets: the current day when downloading (IMDB
+    refreshes them daily), or the modification time of the newest local file.
+    '''
+
+    if data_dir is None:
+        return date.today().isoformat()
+
+    newest = max(
+        os.path.getmtime(os.path.join(data_dir, file_name))
+        for file_name in pipeline.DATASET_FILES.values()
+    )
+
+    return datetime.fromtimestamp(newest).strftime('%Y-%m-%d-%H%M%S')
+
+
+def schema_dir():
+    return os.path.join(SNAPSHOT_DIR, 'schema-{}'.format(SNAPSHOT_SCHEMA))
+
+
+def snapshot_path(version, name):
+    return os.path.join(schema_dir(), version, name)
+
+
+def list_versions():
+
+    '''
+    Versions with a complete snapshot, oldest first.
+    '''
+
+    if not os.path.isdir(schema_dir()):
+        return []
+
+    return sorted(
+        version for version in os.listdir(schema_dir())
+        if os.path.exists(snapshot_path(version, 'score_tables.pkl'))
+    )
+
+
+def latest_version():
+    versions = list_versions()
+    return versions[-1] if versions else None
+
+
+def save_object(obj, version, name):
+
+    '''
+    Pickle obj to the snapshot (written to a temporary file first, so that
+    readers never see a partially written file).
+    '''
+
+    path = snapshot_path(version, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+    return path
+
+
+def load_object(version, name):
+    with open(snapshot_path(version, name), 'rb') as f:
+        return pickle.load(f)
+
+
+def save_score_tables(tables, version):
+    return save_object(tables, version, 'score_tables.pkl')
+
+
+def load_score_tables(version):
+    return load_object(version, 'score_tables.pkl')
@@ -0,0 +1,253 @@
+# Telemetry of the network side of WatchNext: every outbound request (scraping,
+# covers, Cinemagoer, dataset downloads) is measured per host, with a latency
+# histogram, responses per status code, bytes received, errors and retries.
+# Together with the hits and misses of the caches (see instrumentation.CACHE_STATS
+# and cache.CACHED_STATS), it is exported in the Prometheus text format:
+#
+#   - by the app and the CLI to LOG_DIR/watchnext.prom (for the textfile
+#     collector of the Prometheus node exporter)
+#   - by the HTTP API at /metrics?format=prometheus (see ranking_api.py)
+import os
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import LOG_DIR, REQUEST_BACKOFF_SECONDS, REQUEST_RETRIES
+
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Responses worth retrying: rate limited or server errors (a 403 of IMDB is not)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+METRICS_FILE = 'watchnext.prom'
+
+# Outbound requests per host
+REQUEST_STATS = defaultdict(lambda: {
+    'buckets': [0] * len(LATENCY_BUCKETS),
+    'requests': 0,
+    'seconds': 0.0,
+    'max_seconds': 0.0,
+    'statuses': defaultdict(int),
+    'errors': defaultdict(int),
+    'bytes': 0,
+    'retries': 0
+})
+
+_lock = threading.Lock()
+
+
+def record_request(host, seconds, status=None, num_bytes=0, error=None):
+
+    with _lock:
+        stats = REQUEST_STATS[host]
+        stats['requests'] += 1
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                stats['buckets'][i] += 1
+        if status is not None:
+            stats['statuses'][status] += 1
+        if error is not None:
+            stats['errors'][error] += 1
+        stats['bytes'] += num_bytes
+
+
+@contextmanager
+def measured_request(host):
+
+    '''
+    Measure a request to host made inside the block. The status code and bytes
+    received can be set in the yielded dict; an exception is counted as an error.
+    '''
+
+    record = {'status': None, 'bytes': 0}
+    start = time.perf_counter()
+
+    try:
+        yield record
+    except Exception as error:
+        record_request(host, time.perf_counter() - start, record['status'], record['bytes'], type(error).__name__)
+        raise
+
+    record_request(host, time.perf_counter() - start, record['status'], record['bytes'])
+
+
+def http_get(url, retries=REQUEST_RETRIES, backoff_seconds=REQUEST_BACKOFF_SECONDS, **kwargs):
+
+    '''
+    requests.get measured per host. Connection errors, timeouts and the statuses of
+    RETRY_STATUSES are retried up to retries times, waiting backoff_seconds, then
+    twice as long each time. Return the response (of the last try).
+    '''
+
+    import requests
+
+    host = urlparse(url).netloc
+
+    for attempt in range(retries + 1):
+
+        if attempt > 0:
+            with _lock:
+                REQUEST_STATS[host]['retries'] += 1
+            time.sleep(backoff_seconds * 2**(attempt - 1))
+
+        try:
+            with measured_request(host) as record:
+                response = requests.get(url, **kwargs)
+                record['status'] = response.status_code
+                record['bytes'] = len(response.content)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            continue
+
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+
+
+def open_url(url):
+
+    '''
+    urlopen measured per host, until the response starts (the body is read by the
+    caller as a stream). Bytes are taken from its Content-Length.
+    '''
+
+    from urllib.request import urlopen
+
+    with measured_request(urlparse(url).netloc) as record:
+        response = urlopen(url)
+        record['status'] = response.status
+        record['bytes'] = int(response.headers.get('Content-Length') or 0)
+
+    return response
+
+
+def request_summary():
+
+    '''
+    Requests, errors, retries, responses per status code, MB received and latency (ms) per host.
+    '''
+
+    with _lock:
+        return [
+            {
+                'host': host,
+                'requests': stats['requests'],
+                'errors': sum(stats['errors'].values()),
+                'retries': stats['retries'],
+                'statuses': ', '.join('{}: {}'.format(status, count) for status, count in sorted(stats['statuses'].items())),
+                'MB': round(stats['bytes'] / 2**20, 2),
+                'mean (ms)': round(1000 * stats['seconds'] / stats['requests'], 1) if stats['requests'] else None,
+                'max (ms)': round(1000 * stats['max_seconds'], 1)
+            }
+            for host, stats in sorted(REQUEST_STATS.items())
+        ]
+
+
+def labels(**values):
+
+    # Backslashes, quotes and newlines are escaped in label values
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for key, value in values.items()}
+
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in escaped.items()) + '}'
+
+
+def metric(lines, name, kind, description, samples):
+
+    '''
+    Add a metric ([(suffix, labels, value)]) to lines, with its HELP and TYPE comments.
+    '''
+
+    lines.append('# HELP {} {}'.format(name, description))
+    lines.append('# TYPE {} {}'.format(name, kind))
+    for suffix, sample_labels, value in samples:
+        lines.append('{}{}{} {}'.format(name, suffix, sample_labels, value))
+
+
+def prometheus_text():
+
+    '''
+    Metrics of the outbound requests and of the caches in the Prometheus text format.
+    '''
+
+    import cache
+    import instrumentation
+
+    with _lock:
+        requests = {
+            host: dict(stats, statuses=dict(stats['statuses']), errors=dict(stats['errors']), buckets=list(stats['buckets']))
+            for host, stats in sorted(REQUEST_STATS.items())
+        }
+
+    lines = []
+
+    histogram = []
+    for host, stats in requests.items():
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            histogram.append(('_bucket', labels(host=host, le=bound), count))
+        histogram.append(('_bucket', labels(host=host, le='+Inf'), stats['requests']))
+        histogram.append(('_sum', labels(host=host), round(stats['seconds'], 6)))
+        histogram.append(('_count', labels(host=host), stats['requests']))
+    metric(lines, 'watchnext_http_request_duration_seconds', 'histogram', 'Latency of outbound requests.', histogram)
+
+    metric(lines, 'watchnext_http_responses_total', 'counter', 'Responses of outbound requests by status code.', [
+        ('', labels(host=host, status=status), count) for host, stats in requests.items() for status, count in sorted(stats['statuses'].items())
+    ])
+    metric(lines, 'watchnext_http_errors_total', 'counter', 'Outbound requests that failed without a response, by exception.', [
+        ('', labels(host=host, error=error), count) for host, stats in requests.items() for error, count in sorted(stats['errors'].items())
+    ])
+    metric(lines, 'watchnext_http_retries_total', 'counter', 'Outbound requests retried.', [
+        ('', labels(host=host), stats['retries']) for host, stats in requests.items()
+    ])
+    metric(lines, 'watchnext_http_received_bytes_total', 'counter', 'Bytes received by outbound requests.', [
+        ('', labels(host=host), stats['bytes']) for host, stats in requests.items()
+    ])
+
+    # Streamlit caches (instrumented_cache), and the memory and disk layers of cache.cached
+    caches = [(row['function'], 'streamlit', {'memory': row['hits']}, row['misses']) for row in instrumentation.cache_summary()]
+    caches += [
+        (row['function'], 'cached', {'memory': row['memory_hits'], 'disk': row['disk_hits']}, row['misses'])
+        for row in cache.cached_summary()
+    ]
+
+    metric(lines, 'watchnext_cache_hits_total', 'counter', 'Calls of cached functions served from the cache.', [
+        ('', labels(function=function, cache=kind, layer=layer), hits)
+        for function, kind, layer_hits, _ in caches for layer, hits in layer_hits.items()
+    ])
+    metric(lines, 'watchnext_cache_misses_total', 'counter', 'Calls of cached functions that ran the function.', [
+        ('', labels(function=function, cache=kind), misses) for function, kind, _, misses in caches
+    ])
+    metric(lines, 'watchnext_cache_hit_ratio', 'gauge', 'Share of the calls of cached functions served from the cache.', [
+        ('', labels(function=function, cache=kind), round(sum(layer_hits.values()) / (sum(layer_hits.values()) + misses), 4))
+        for function, kind, layer_hits, misses in caches if sum(layer_hits.values()) + misses > 0
+    ])
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path=None):
+
+    '''
+    Write prometheus_text to path (default: LOG_DIR/watchnext.prom), replacing it at once.
+    '''
+
+    path = path or os.path.join(LOG_DIR, METRICS_FILE)
+
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # A temporary file per writer, so that sessions writing at once never mix their files
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path) or '.', suffix='.tmp', delete=False) as f:
+            f.write(prometheus_text())
+        # Temporary files are only readable by their owner: the exporter may run as another user
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+    except OSError:
+        pass    # Telemetry must never break the app
+
+    return path
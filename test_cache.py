@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+import cache
+
+
+def test_versioned_keys_by_version_and_small_arguments_only():
+    calls = []
+
+    @cache.versioned()
+    def table(version, max_minutes, _df):
+        calls.append((version, max_minutes))
+        return _df.loc[_df['minutes'] <= max_minutes]
+
+    df = pd.DataFrame({'minutes': [30, 90, 150]})
+
+    assert len(table('v1', 100, df)) == 2
+    # Another DataFrame is not part of the key: served from the cache
+    assert len(table('v1', 100, df.head(1))) == 2
+    assert len(table('v2', 100, df)) == 2
+    assert calls == [('v1', 100), ('v2', 100)]
+
+    table.clear()
+
+
+def test_versioned_evicts_least_recently_used_results():
+    calls = []
+
+    # Room for two arrays of 1 MB
+    @cache.versioned(max_mb=2.5)
+    def block(version, seed):
+        calls.append(seed)
+        return np.full(2**17, seed, dtype=np.float64)
+
+    block('v1', 1)
+    block('v1', 2)
+    block('v1', 1)      # 1 is now the most recently used
+    block('v1', 3)      # Evicts 2
+    block('v1', 1)
+    block('v1', 2)
+
+    assert calls == [1, 2, 3, 2]
+
+    block.clear()
+
+
+def test_versioned_does_not_keep_results_larger_than_the_cache():
+    calls = []
+
+    @cache.versioned(max_mb=0.5)
+    def block(version):
+        calls.append(version)
+        return np.zeros(2**17)
+
+    block('v1')
+    block('v1')
+
+    assert calls == ['v1', 'v1']
+
+
+def test_clear_versioned_drops_one_version():
+    calls = []
+
+    @cache.versioned()
+    def value(version, x):
+        calls.append(version)
+        return x
+
+    value('v1', 1)
+    value('v2', 1)
+    cache.clear_versioned(version='v1')
+    value('v1', 1)
+    value('v2', 1)
+
+    assert calls == ['v1', 'v2', 'v1']
+
+    value.clear()
+
+
+def test_versioned_results_are_shared_copies():
+    @cache.versioned()
+    def table(version):
+        return pd.DataFrame({'a': [1, 2]})
+
+    df = table('v1')
+    df.loc[0, 'a'] = 10
+    df['b'] = 0
+
+    assert table('v1').columns.tolist() == ['a']
+    assert table('v1')['a'].tolist() == [1, 2]
+
+    table.clear()
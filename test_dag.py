@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+import dag
+
+
+def spec(name, func, inputs, outputs):
+    return {'name': name, 'func': func, 'inputs': inputs, 'outputs': outputs}
+
+
+def test_run_graph_passes_outputs_to_dependent_stages():
+    stages = [
+        spec('sum', lambda a, b: a + b, ['a', 'b'], ['total']),
+        spec('split', lambda total: (total // 2, total % 2), ['total'], ['half', 'rest']),
+        spec('double', lambda a: 2 * a, ['a'], ['double'])
+    ]
+    done = []
+
+    results = dag.run_graph(stages, {'a': 3, 'b': 4}, on_done=lambda stage, seconds: done.append(stage['name']))
+
+    assert results == {'a': 3, 'b': 4, 'total': 7, 'half': 3, 'rest': 1, 'double': 6}
+    assert sorted(done) == ['double', 'split', 'sum']
+    assert done.index('sum') < done.index('split')
+
+
+def test_run_graph_overlaps_independent_stages():
+    # Both stages wait for each other: they only finish if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(name):
+        barrier.wait()
+        return name
+
+    stages = [
+        spec('left', meet, ['left_name'], ['left']),
+        spec('right', meet, ['right_name'], ['right'])
+    ]
+
+    results = dag.run_graph(stages, {'left_name': 'l', 'right_name': 'r'}, max_workers=2)
+
+    assert (results['left'], results['right']) == ('l', 'r')
+
+
+def test_check_graph_rejects_cycles():
+    stages = [
+        spec('first', lambda b: b, ['b'], ['a']),
+        spec('second', lambda a: a, ['a'], ['b'])
+    ]
+
+    with pytest.raises(ValueError, match='Cycle'):
+        dag.run_graph(stages)
+
+
+def test_check_graph_rejects_missing_and_repeated_outputs():
+    with pytest.raises(ValueError, match='never produced'):
+        dag.check_graph([spec('first', lambda a: a, ['missing'], ['a'])])
+
+    with pytest.raises(ValueError, match='produced twice'):
+        dag.check_graph([spec('first', lambda: 1, [], ['a']), spec('second', lambda: 2, [], ['a'])])
+
+
+def test_run_graph_raises_the_error_of_a_failed_stage_without_running_its_dependents():
+    started = []
+
+    def fail():
+        raise RuntimeError('download failed')
+
+    def slow():
+        time.sleep(0.2)
+        return 1
+
+    stages = [
+        spec('fail', fail, [], ['a']),
+        spec('slow', slow, [], ['b']),
+        spec('after', lambda a, b: started.append('after'), ['a', 'b'], ['c'])
+    ]
+
+    with pytest.raises(RuntimeError, match='download failed'):
+        dag.run_graph(stages, max_workers=2)
+
+    assert started == []
+
+
+def test_critical_path_is_the_slowest_chain():
+    stages = [
+        spec('load', None, [], ['raw']),
+        spec('fast', None, ['raw'], ['a']),
+        spec('slow', None, ['raw'], ['b']),
+        spec('merge', None, ['a', 'b'], ['c'])
+    ]
+
+    path, seconds = dag.critical_path(stages, {'load': 1.0, 'fast': 0.5, 'slow': 2.0, 'merge': 1.0})
+
+    assert path == ['load', 'slow', 'merge']
+    assert seconds == 4.0
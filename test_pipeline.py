@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+
+def stable_ranking(scores, mask=None, ties=None):
+
+    # Full sort: decreasing score (missing last), then ties, then position
+    positions = np.arange(len(scores)) if mask is None else np.flatnonzero(mask)
+    values = np.where(np.isnan(scores[positions]), -np.inf, scores[positions])
+    keys = [positions] + ([] if ties is None else [np.asarray(ties)[positions]]) + [-values]
+
+    return positions[np.lexsort(keys)]
+
+
+def test_top_k_positions_ties_at_kth_score_keep_position_order():
+    scores = np.array([3.0] * 20 + [5.0])
+    assert pipeline.top_k_positions(scores, 3).tolist() == [20, 0, 1]
+
+
+def test_top_k_positions_matches_full_sort_with_duplicated_scores():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, 500).astype(float)
+    scores[rng.integers(0, 500, 20)] = np.nan
+    mask = rng.random(500) < 0.7
+
+    for k in [1, 3, 10, 50, 349, 500, None]:
+        expected = stable_ranking(scores, mask)[:k]
+        assert pipeline.top_k_positions(scores, k, mask).tolist() == expected.tolist()
+
+
+def test_top_k_positions_breaks_ties_by_ties():
+    rng = np.random.default_rng(1)
+    scores = rng.integers(0, 3, 200).astype(float)
+    # Not in position order: 8-digit tconsts sort before 7-digit ones starting with a higher digit
+    ties = np.array(['tt{:07d}'.format(i) if i % 2 else 'tt{:08d}'.format(i) for i in rng.permutation(200)])
+
+    for k in [1, 5, 70, 200]:
+        expected = stable_ranking(scores, ties=ties)[:k]
+        assert pipeline.top_k_positions(scores, k, ties=ties).tolist() == expected.tolist()
+
+
+def test_filter_films_ranks_equal_scores_by_tconst():
+    df_films = pd.DataFrame({
+        'tconst': ['tt0000003', 'tt0000002', 'tt0000001', 'tt0000004'],
+        'titleType': 'movie',
+        'primaryTitle': ['C', 'B', 'A', 'D'],
+        'startYear': '2000',
+        'runtimeMinutes': '100',
+        'averageRating': 7.0,
+        'numVotes': 10_000,
+        'filmScore': 7.5,
+        'filmScoreRaw': [7.5, 7.5, 7.5, 7.6]
+    })
+
+    df_top = pipeline.filter_films(df_films, [], num_titles=3)
+
+    assert df_top['tconst'].tolist() == ['tt0000004', 'tt0000001', 'tt0000002']
+    assert df_top.index.tolist() == [1, 2, 3]
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pl = pytest.importorskip('polars')
+
+import pipeline
+import pipeline_polars
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from generate_datasets import generate
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp('imdb')
+    generate(100_000, str(output_dir), seed=3)
+    return str(output_dir)
+
+
+def test_engines_build_identical_tables(data_dir):
+
+    reference = pipeline.compute_score_tables(data_dir, 'pandas')
+    tables = pipeline.compute_score_tables(data_dir, 'polars')
+
+    for name in ['all_titles', 'episodes', 'films', 'series']:
+        pd.testing.assert_frame_equal(tables[name], reference[name], check_exact=True)
+
+    pd.testing.assert_frame_equal(tables['episode_index']['episodes'], reference['episode_index']['episodes'], check_exact=True)
+    for key in ['parents', 'starts', 'stops']:
+        assert np.array_equal(tables['episode_index'][key], reference['episode_index'][key])
+
+    # Not a trivial comparison: there are titles to rank
+    assert len(tables['films']) > 0 and len(tables['series']) > 0
+
+
+def test_numpy_divide_matches_numpy():
+
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 1e6, 10_000)
+    df = pl.DataFrame({'value': values})
+
+    divided = df.select(pipeline_polars.numpy_divide(pl.col('value') - pl.col('value').min(), pl.col('value').max() - pl.col('value').min()))
+
+    assert np.array_equal(divided.to_series().to_numpy(), (values - values.min()) / (values.max() - values.min()))
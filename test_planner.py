@@ -0,0 +1,67 @@
+import itertools
+
+import numpy as np
+
+import planner
+
+
+def brute_force(minutes, scores, is_series, budget_minutes, max_series=None):
+
+    # Best total score of every subset that fits (minutes are whole, so buckets are exact)
+    best = 0.0
+    for size in range(1, len(minutes) + 1):
+        for subset in itertools.combinations(range(len(minutes)), size):
+            subset = list(subset)
+            if minutes[subset].sum() > budget_minutes:
+                continue
+            if max_series is not None and is_series[subset].sum() > max_series:
+                continue
+            best = max(best, scores[subset].sum())
+
+    return best
+
+
+def random_titles(rng, num_titles):
+
+    minutes = rng.integers(20, 400, num_titles).astype(float)
+    scores = np.round(rng.uniform(4, 9, num_titles), 2)
+    is_series = rng.random(num_titles) < 0.4
+
+    return minutes, scores, is_series
+
+
+def test_solve_matches_brute_force():
+    rng = np.random.default_rng(0)
+
+    for _ in range(30):
+        minutes, scores, is_series = random_titles(rng, int(rng.integers(1, 11)))
+        budget = float(rng.integers(60, 1000))
+
+        for max_series in [None, 0, 1, 2]:
+            positions, upper_bound = planner.solve(minutes, scores, is_series, budget, max_series)
+            best = brute_force(minutes, scores, is_series, budget, max_series)
+
+            assert minutes[positions].sum() <= budget
+            assert max_series is None or is_series[positions].sum() <= max_series
+            assert np.isclose(scores[positions].sum(), best)
+            # The limit of series only lowers the best score, so the bound holds with it too
+            assert upper_bound >= best - 1e-9
+
+
+def test_solve_never_exceeds_budget_with_buckets():
+    # Budgets over MAX_BUCKETS minutes round runtimes up to buckets of several minutes
+    rng = np.random.default_rng(1)
+    minutes, scores, is_series = random_titles(rng, 3000)
+
+    for budget in [1500.0, 2999.0, 40 * 60.0]:
+        positions, upper_bound = planner.solve(minutes, scores, is_series, budget)
+        assert len(np.unique(positions)) == len(positions)
+        assert minutes[positions].sum() <= budget
+        assert scores[positions].sum() <= upper_bound + 1e-9
+
+
+def test_solve_without_titles_that_fit():
+    positions, upper_bound = planner.solve([500.0, 600.0], [8.0, 9.0], [False, True], 120.0)
+
+    assert len(positions) == 0
+    assert upper_bound == 0.0
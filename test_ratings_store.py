@@ -0,0 +1,66 @@
+import os
+
+import pandas as pd
+
+import ratings_store
+
+
+def write_export(path, ratings, mtime):
+
+    # ratings: [(tconst, rating, 'YYYY-MM-DD')]
+    pd.DataFrame(ratings, columns=['Const', 'Your Rating', 'Date Rated']).assign(Title='x').to_csv(path, index=False)
+    os.utime(path, (mtime, mtime))
+
+
+def test_import_folder_reads_new_exports_oldest_first(tmp_path):
+    folder, store_dir = tmp_path / 'exports', tmp_path / 'store'
+    folder.mkdir()
+
+    # The newest export of ur1 has the older name: it must still replace the other
+    write_export(folder / 'b_ur1.csv', [('tt01', 5, '2020-01-01'), ('tt02', 6, '2020-02-01')], 1_000)
+    write_export(folder / 'a_ur1.csv', [('tt01', 9, '2021-01-01')], 2_000)
+    write_export(folder / 'ur2.csv', [('tt03', 7, '2019-05-01')], 1_000)
+
+    paths = ratings_store.import_folder(str(folder), str(store_dir))
+
+    assert [os.path.basename(path) for path in paths] == ['b_ur1.csv', 'ur2.csv', 'a_ur1.csv']
+    df = ratings_store.read_user_ratings('ur1', str(store_dir))
+    assert df[['tconst', 'userRating']].values.tolist() == [['tt01', 9]]
+    assert ratings_store.read_user_ratings('ur2', str(store_dir))['tconst'].tolist() == ['tt03']
+
+
+def test_import_folder_skips_unchanged_files_and_other_csvs(tmp_path):
+    folder, store_dir = tmp_path / 'exports', tmp_path / 'store'
+    folder.mkdir()
+
+    write_export(folder / 'ur1.csv', [('tt01', 8, '2022-03-04')], 1_000)
+    pd.DataFrame({'tconst': ['tt09'], 'rating': [3]}).to_csv(folder / 'notes.csv', index=False)
+    (folder / 'readme.txt').write_text('not a CSV')
+
+    first = ratings_store.import_folder(str(folder), str(store_dir))
+    version = ratings_store.store_version(str(store_dir))
+
+    assert sorted(os.path.basename(path) for path in first) == ['notes.csv', 'ur1.csv']
+    assert ratings_store.summary(str(store_dir))['user'].tolist() == ['ur1']
+
+    # Nothing changed: nothing read again, store untouched
+    assert ratings_store.import_folder(str(folder), str(store_dir)) == []
+    assert ratings_store.store_version(str(store_dir)) == version
+
+    # A changed export is read again
+    write_export(folder / 'ur1.csv', [('tt01', 8, '2022-03-04'), ('tt05', 4, '2023-01-01')], 3_000)
+    assert [os.path.basename(path) for path in ratings_store.import_folder(str(folder), str(store_dir))] == ['ur1.csv']
+    assert ratings_store.read_user_ratings('ur1', str(store_dir))['tconst'].tolist() == ['tt05', 'tt01']
+
+
+def test_import_exports_replaces_ratings_deleted_on_imdb(tmp_path):
+    store_dir = str(tmp_path / 'store')
+
+    write_export(tmp_path / 'ur1.csv', [('tt01', 8, '2022-03-04'), ('tt02', 7, '2022-03-05')], 1_000)
+    ratings_store.import_exports([str(tmp_path / 'ur1.csv')], store_dir=store_dir)
+    write_export(tmp_path / 'ur1.csv', [('tt02', 7, '2022-03-05')], 2_000)
+    ratings_store.import_exports([str(tmp_path / 'ur1.csv')], store_dir=store_dir)
+
+    df = ratings_store.read_user_ratings('ur1', store_dir)
+    assert df['tconst'].tolist() == ['tt02']
+    assert df['dateRating'].tolist() == [2022]
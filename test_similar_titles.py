@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import similar_titles
+
+
+def candidates(num_titles=400, seed=0):
+
+    rng = np.random.default_rng(seed)
+    genres = np.array(['Drama', 'Comedy', 'Horror,Thriller', 'Action,Adventure', 'Animation,Family', '\\N'])
+
+    return pd.DataFrame({
+        'tconst': ['tt{:05d}'.format(i) for i in range(num_titles)],
+        'genres': genres[rng.integers(0, len(genres), num_titles)],
+        'startYear': rng.integers(1950, 2024, num_titles).astype(str),
+        'runtimeMinutes': rng.integers(60, 180, num_titles).astype(str),
+        'averageRating': np.round(rng.uniform(5, 9, num_titles), 1),
+        'numVotes': rng.integers(5_000, 1_000_000, num_titles)
+    })
+
+
+def test_more_like_this_skips_the_title_and_excluded_ones():
+    df = candidates()
+    index = similar_titles.build_index(df)
+
+    df_similar = similar_titles.more_like_this(index, 'tt00000', num_titles=5, exclude_tconsts=['tt00001', 'tt00002'], num_probes=len(index['centroids']))
+
+    assert len(df_similar) == 5
+    assert not df_similar['tconst'].isin(['tt00000', 'tt00001', 'tt00002']).any()
+    assert df_similar['similarity'].is_monotonic_decreasing
+
+
+def test_more_like_this_embeds_titles_that_are_not_indexed():
+    df = candidates()
+    index = similar_titles.build_index(df.iloc[1:])
+    num_probes = len(index['centroids'])
+
+    # Not indexed: nothing without its row, the same neighbours as if it were indexed with it
+    assert len(similar_titles.more_like_this(index, 'tt00000', num_titles=5)) == 0
+
+    df_similar = similar_titles.more_like_this(index, 'tt00000', num_titles=5, num_probes=num_probes, df_titles=df)
+    query = similar_titles.embed_titles(df.iloc[:1], index)[0]
+    expected = np.argsort(-(index['vectors'] @ query), kind='stable')[:5]
+
+    assert df_similar['tconst'].tolist() == index['tconsts'][expected].tolist()
+
+
+def test_embed_titles_with_the_scale_of_the_index_matches_the_index():
+    df = candidates()
+    index = similar_titles.build_index(df)
+
+    position = similar_titles.find_position(index, 'tt00042')
+    vector = similar_titles.embed_titles(df.loc[df['tconst'] == 'tt00042'], index)[0]
+
+    assert np.allclose(vector, index['vectors'][position])
@@ -0,0 +1,68 @@
+import pandas as pd
+
+import title_search
+
+
+def titles():
+
+    return pd.DataFrame({
+        'tconst': ['tt01', 'tt02', 'tt03', 'tt04', 'tt05', 'tt06'],
+        'titleType': ['movie', 'movie', 'movie', 'tvSeries', 'movie', 'movie'],
+        'primaryTitle': ['The Dark Knight', 'The Dark Knight Rises', 'Dark Water', 'Dark', 'Léon: The Professional', 'Amélie'],
+        'originalTitle': ['The Dark Knight', 'The Dark Knight Rises', 'Honogurai mizu no soko kara', 'Dark', 'Léon', "Le fabuleux destin d'Amélie Poulain"],
+        'startYear': ['2008', '2012', '2002', '2017', '1994', '2001'],
+        'averageRating': [9.0, 8.4, 6.7, 8.7, 8.5, 8.3],
+        'numVotes': [2_800_000, 1_700_000, 60_000, 450_000, 1_200_000, 780_000]
+    })
+
+
+def search(query, num_titles=10):
+
+    index = title_search.build_index(titles())
+
+    return title_search.search(index, query, num_titles)
+
+
+def test_normalise_titles_drops_case_accents_and_punctuation():
+    names = pd.Series(['Léon: The Professional', '  WALL·E ', None])
+
+    assert title_search.normalise_titles(names).tolist() == ['leon the professional', 'wall e', '']
+
+
+def test_prefix_matches_come_first_by_number_of_votes():
+    # Titles starting with the query, then those containing it (even with more votes)
+    assert search('dark')['tconst'].tolist() == ['tt04', 'tt03', 'tt01', 'tt02']
+    assert search('dark', num_titles=2)['tconst'].tolist() == ['tt04', 'tt03']
+
+
+def test_prefix_of_several_words():
+    assert search('the dark knight')['tconst'].tolist()[:2] == ['tt01', 'tt02']
+
+
+def test_original_titles_and_accents_are_matched():
+    assert search('honogurai')['tconst'].tolist() == ['tt03']
+    assert search('LEON')['tconst'].tolist()[:1] == ['tt05']
+    assert search('le fabuleux destin')['tconst'].tolist() == ['tt06']
+
+
+def test_words_in_another_order_or_with_a_typo_are_found_by_trigrams():
+    df_found = search('knight dark rises')
+
+    assert df_found['tconst'].iloc[0] == 'tt02'
+    assert 0.5 <= df_found['similarity'].iloc[0] < 1
+
+    assert search('the dark knigth')['tconst'].iloc[0] == 'tt01'
+
+
+def test_empty_and_unknown_queries_find_nothing():
+    assert len(search('')) == 0
+    assert len(search('?!')) == 0
+    assert len(search('zzzzqqqq')) == 0
+
+
+def test_search_titles_adds_the_result_columns():
+    df = titles()
+    df_found = title_search.search_titles(title_search.build_index(df), df, 'dark knight', num_titles=2)
+
+    assert df_found.columns.tolist() == ['tconst', 'similarity'] + title_search.RESULT_COLUMNS[1:]
+    assert df_found.index.tolist() == [1, 2]
@@ -0,0 +1,212 @@
+# Search titles by name, for type-ahead lookups.
+#
+# primaryTitle and originalTitle of every title are normalised (lowercase, no
+# accents or punctuation) and indexed twice:
+# - sorted by name, so that the titles starting with a query are a range found
+#   by binary search (prefix matching)
+# - by trigram (3 consecutive bytes of the UTF-8 name), so that titles with the
+#   words in another order, a typo or a missing word are found too (the share of
+#   the trigrams of the query that a title contains is its similarity)
+# Titles starting with the query come first, then the most similar ones, and
+# ties are ranked by number of votes.
+import os
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+import snapshots
+
+INDEX_FILE = 'title_search.npz'
+
+# Names are sorted by their first bytes only, which bounds the memory of the index
+# (queries longer than that match the titles starting with their first bytes)
+KEY_BYTES = 24
+
+# Share of the trigrams of a query that a title must contain to be returned
+MIN_SIMILARITY = 0.5
+
+# Columns of the indexed titles shown with the results
+RESULT_COLUMNS = ['tconst', 'titleType', 'primaryTitle', 'startYear', 'averageRating', 'numVotes']
+
+
+def normalise_titles(titles):
+
+    '''
+    Lowercase, without accents or punctuation: 'Léon: The Professional' -> 'leon the professional'.
+    '''
+
+    # Arrow strings: their regular expressions know which characters are letters in any script
+    titles = titles.astype(pd.StringDtype('pyarrow'))
+
+    return (
+        titles.str.normalize('NFKD')
+        .str.replace('[\u0300-\u036f]', '', regex=True)   # Accents, once split from their letters
+        .str.casefold()
+        .str.replace(r'[^\pL\pN]+', ' ', regex=True)
+        .str.strip()
+        .fillna('')
+    )
+
+
+def name_trigrams(names):
+
+    '''
+    Return (trigram codes, position of their name) for every trigram of names.
+    Names start with a space, so that trigrams of the first letters of a word count too.
+    '''
+
+    encoded = [' {}'.format(name).encode() for name in names]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.int32)
+    owners = np.repeat(np.arange(len(encoded)), lengths)
+
+    codes = (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+    is_whole = owners[:-2] == owners[2:]      # Trigrams within a single name
+
+    return codes[is_whole], owners[:-2][is_whole]
+
+
+def build_index(df_titles):
+
+    '''
+    Build the search index of df_titles (tconst, primaryTitle, originalTitle, numVotes).
+    '''
+
+    num_titles = len(df_titles)
+    primary = normalise_titles(df_titles['primaryTitle']).to_numpy(dtype=object)
+    original = normalise_titles(df_titles['originalTitle']).to_numpy(dtype=object)
+
+    # Original titles are only indexed when they differ from the primary ones
+    has_original = original != primary
+    names = np.concatenate([primary, original[has_original]])
+    name_titles = np.concatenate([np.arange(num_titles), np.flatnonzero(has_original)])
+    is_named = names != ''
+    names, name_titles = names[is_named], name_titles[is_named]
+
+    # Prefix matching: names sorted by their first bytes
+    keys = np.array([name.encode()[:KEY_BYTES] for name in names], dtype='S{}'.format(KEY_BYTES))
+    order = np.argsort(keys, kind='stable')
+
+    # Trigram matching: titles containing each trigram (sorted by trigram, then title)
+    # (sorting and dropping repeats: much faster than np.unique on tens of millions of pairs)
+    codes, owners = name_trigrams(names)
+    pairs = np.sort((codes.astype(np.int64) << 32) | name_titles[owners])
+    pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])]
+    starts = np.flatnonzero(np.append(True, (pairs[1:] >> 32) != (pairs[:-1] >> 32)))
+    trigram_codes = pairs[starts] >> 32
+
+    return {
+        'tconsts': df_titles['tconst'].to_numpy(dtype='S'),
+        'num_votes': df_titles['numVotes'].to_numpy(dtype=np.int64),
+        'keys': keys[order],
+        'key_titles': name_titles[order].astype(np.int32),
+        'trigram_codes': trigram_codes.astype(np.int32),
+        'trigram_offsets': np.append(starts, len(pairs)),
+        'postings': (pairs & 0xFFFFFFFF).astype(np.int32)
+    }
+
+
+def save_index(index, version):
+
+    path = snapshots.snapshot_path(version, INDEX_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Rename once fully written so that readers never see a partial index
+    np.savez(path + '.tmp.npz', **index)
+    os.replace(path + '.tmp.npz', path)
+
+    return path
+
+
+def load_index(version):
+
+    '''
+    Load the index of a snapshot (None if it has not been built).
+    '''
+
+    if not os.path.exists(snapshots.snapshot_path(version, INDEX_FILE)):
+        return None
+
+    with np.load(snapshots.snapshot_path(version, INDEX_FILE)) as data:
+        return {key: data[key] for key in data.files}
+
+
+def prefix_matches(index, query, num_titles):
+
+    '''
+    Positions of the num_titles most voted titles with a name starting with query.
+    '''
+
+    key = query.encode()[:KEY_BYTES]
+    keys = index['keys']
+
+    start = np.searchsorted(keys, key, side='left')
+    # No UTF-8 byte is 0xFF: every name starting with key sorts before key + 0xFF
+    stop = np.searchsorted(keys, key, side='right') if len(key) == KEY_BYTES else np.searchsorted(keys, key + b'\xff', side='left')
+
+    titles = index['key_titles'][start:stop]
+    # A title can match by both of its names: take more names than needed, then drop repeated titles
+    top = pipeline.top_k_positions(index['num_votes'][titles], 2*num_titles)
+
+    return pd.unique(titles[top])[:num_titles]
+
+
+def trigram_matches(index, query, num_titles, exclude=()):
+
+    '''
+    Positions and similarities of the num_titles titles sharing the most trigrams with query
+    (at least MIN_SIMILARITY of them), skipping the positions in exclude.
+    '''
+
+    query_codes = np.unique(name_trigrams([query])[0])
+    codes, offsets = index['trigram_codes'], index['trigram_offsets']
+
+    found = np.searchsorted(codes, query_codes).clip(max=len(codes)-1)
+    found = found[codes[found] == query_codes]
+    if len(query_codes) == 0 or len(found) == 0:
+        return np.array([], dtype=int), np.array([])
+
+    titles = np.concatenate([index['postings'][offsets[i]:offsets[i+1]] for i in found])
+    counts = np.bincount(titles, minlength=len(index['tconsts']))
+
+    is_similar = counts >= MIN_SIMILARITY * len(query_codes)
+    is_similar[np.asarray(exclude, dtype=int)] = False
+
+    # Most shared trigrams first, then most votes (exact in float64 for queries under 2**8 trigrams)
+    score = counts.astype(np.float64) * 2**45 + index['num_votes']
+    top = pipeline.top_k_positions(score, num_titles, mask=is_similar)
+
+    return top, counts[top] / len(query_codes)
+
+
+def search(index, query, num_titles=10):
+
+    '''
+    Return a DataFrame (tconst, similarity) with the num_titles best matches of query:
+    titles starting with it (similarity 1) by number of votes, then similar titles.
+    '''
+
+    query = normalise_titles(pd.Series([query])).iloc[0]
+    if query == '':
+        return pd.DataFrame({'tconst': [], 'similarity': []})
+
+    prefix = prefix_matches(index, query, num_titles)
+    similar, similarity = trigram_matches(index, query, num_titles - len(prefix), exclude=prefix) if len(prefix) < num_titles else ([], [])
+
+    return pd.DataFrame({
+        'tconst': index['tconsts'][np.concatenate([prefix, similar]).astype(int)].astype(str),
+        'similarity': np.round(np.concatenate([np.ones(len(prefix)), similarity]), 2)
+    })
+
+
+def search_titles(index, df_titles, query, num_titles=10):
+
+    '''
+    Same as search, with the RESULT_COLUMNS of df_titles (the indexed titles), ranked from 1.
+    '''
+
+    df_found = search(index, query, num_titles)
+    df_found = df_found.merge(df_titles.loc[df_titles['tconst'].isin(df_found['tconst']), RESULT_COLUMNS], on='tconst')
+    df_found.index = np.arange(1, 1+len(df_found))
+
+    return df_found
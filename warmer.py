@@ -0,0 +1,147 @@
+# Background cache warmer: after the datasets load, covers and connections
+# that the first views are likely to need (top titles of the default rankings,
+# first watched titles searched for connections) are fetched by a thread into
+# the shared caches of covers.py and fetching_connections.py, so that panels
+# render from the cache instead of waiting for IMDB.
+#
+# Jobs run by priority (visible panels first), only cache misses count against
+# the network budget, and the thread waits while foreground requests (those of
+# a session displaying a panel) are running.
+import itertools
+import queue
+import threading
+
+from contextlib import contextmanager
+
+from config import COVER_MODE, WARMER_MAX_REQUESTS
+
+# Lower runs first: panels shown on load, then panels behind a toggle
+PRIORITIES = {'films': 0, 'series': 0, 'connections': 1}
+
+_jobs = queue.PriorityQueue()
+_order = itertools.count()      # Ties are run in the order they were scheduled
+_scheduled = set()
+_thread = None
+
+_lock = threading.Lock()
+_idle = threading.Condition(_lock)
+_num_foreground = 0
+
+PROGRESS = {'scheduled': 0, 'done': 0, 'cached': 0, 'failed': 0, 'skipped': 0, 'requests': 0, 'paused': 0}
+
+
+@contextmanager
+def foreground():
+
+    '''
+    Mark a block of code as a foreground request: the warmer waits until it ends.
+    '''
+
+    global _num_foreground
+
+    with _lock:
+        _num_foreground += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _num_foreground -= 1
+            _idle.notify_all()
+
+
+def job_calls(kind, tconst):
+
+    '''
+    Cached functions (and their arguments) that a job calls.
+    '''
+
+    if kind == 'cover':
+        from covers import get_cover, get_cover_url
+        # Browsers download the images themselves in 'browser' mode
+        return [(get_cover_url if COVER_MODE == 'browser' else get_cover, (tconst,))]
+
+    from fetching_connections import CONNECTION_TYPES, get_num_connections, find_title_connections
+    return [(func, (tconst, conn_type)) for conn_type in CONNECTION_TYPES for func in [get_num_connections, find_title_connections]]
+
+
+def run_job(kind, tconst, max_requests):
+
+    '''
+    Fetch what a job needs into the cache, unless it would exceed max_requests.
+    '''
+
+    calls = [(func, args) for func, args in job_calls(kind, tconst) if not func.is_cached(*args)]
+
+    with _lock:
+        if not calls:
+            PROGRESS['cached'] += 1
+            return
+        if PROGRESS['requests'] + len(calls) > max_requests:
+            PROGRESS['skipped'] += 1
+            return
+        PROGRESS['requests'] += len(calls)
+
+    for func, args in calls:
+        # Foreground requests go first
+        with _lock:
+            if _num_foreground > 0:
+                PROGRESS['paused'] += 1
+            while _num_foreground > 0:
+                _idle.wait()
+        func(*args)
+
+    with _lock:
+        PROGRESS['done'] += 1
+
+
+def work(max_requests):
+
+    import instrumentation
+
+    while True:
+        _, _, _, kind, tconst = _jobs.get()
+        try:
+            run_job(kind, tconst, max_requests)
+        except Exception as error:     # e.g. network errors: the panel fetches it again when shown
+            with _lock:
+                PROGRESS['failed'] += 1
+            instrumentation.log_event('warmer', kind='error', job=kind, tconst=tconst, error=str(error))
+        finally:
+            _jobs.task_done()
+
+
+def schedule(kind, tconsts, panel, max_requests=WARMER_MAX_REQUESTS):
+
+    '''
+    Queue jobs ('cover' or 'connections') for tconsts (most needed first), with the
+    priority of the panel that shows them, and start the warmer if needed.
+    Jobs already scheduled by this process are ignored.
+    '''
+
+    global _thread
+
+    if max_requests <= 0:
+        return
+
+    with _lock:
+        for rank, tconst in enumerate(tconsts):
+            if (kind, tconst) in _scheduled:
+                continue
+            _scheduled.add((kind, tconst))
+            _jobs.put((PRIORITIES[panel], rank, next(_order), kind, tconst))
+            PROGRESS['scheduled'] += 1
+
+        if _thread is None:
+            _thread = threading.Thread(target=work, args=(max_requests,), name='watchnext-warmer', daemon=True)
+            _thread.start()
+
+
+def progress():
+
+    '''
+    Counts of scheduled, done (fetched), cached (nothing to fetch), failed and skipped
+    (over budget) jobs, network requests made and times the warmer paused.
+    '''
+
+    with _lock:
+        return dict(PROGRESS, pending=PROGRESS['scheduled'] - PROGRESS['done'] - PROGRESS['cached'] - PROGRESS['failed'] - PROGRESS['skipped'])
@@ -1,11 +1,11 @@
 import streamlit as st
-import numpy as np
-import pandas as pd
+import os
 import app_functions as af
+import snapshot_manager
+import snapshots
 
-from fetching_ratings import get_user_ratings
-from fetching_connections import get_ordered_connections
-from datetime import datetime
+from config import DATA_DIR, ENGINE, RANKINGS_DIR, WARMER_TOP_N
+from instrumentation import stage
 
 # Page metadata
 st.set_page_config(
@@ -15,105 +15,87 @@ st.set_page_config(
 
 st.title('WatchNext')
 
+# Data of a session, loaded once from the snapshot of one dataset version
+SESSION_KEYS = ['dataset_version', 'all_titles', 'episodes', 'episode_index', 'films', 'series', 'user_ratings']
+
 if 'loaded_data' not in st.session_state:
 
-    with st.spinner('Downloading IMDB datasets...'):
-
-        # Load datasets
-        datasets = af.unzip_and_load_datasets()
-        df_imdb_titles = datasets[0]
-        df_imdb_ratings = datasets[1]
-        df_imdb_episodes = datasets[2]
-
-    with st.spinner('Merging ratings information...'):
-
-        df_imdb_titles = pd.merge(
-            left=df_imdb_titles,
-            right=df_imdb_ratings,
-            on='tconst'
-        )
-        
-        df_episodes = pd.merge(
-            left=df_imdb_episodes,
-            right=df_imdb_titles[['tconst', 'runtimeMinutes', 'averageRating', 'numVotes']],
-            on='tconst'
-        )
-
-    with st.spinner('Normalising scores...'):
-
-        df_films = df_imdb_titles.loc[~(df_imdb_titles['titleType'].isin(['tvSeries', 'tvMiniSeries', 'tvEpisode']))]
-        df_films = af.normalise_content(df_films, 'Films')
-        df_films.rename(columns={'score': 'filmScore'}, inplace=True)
-
-        df_series = df_imdb_titles.loc[df_imdb_titles['titleType'].isin(['tvSeries', 'tvMiniSeries', 'tvEpisode'])]
-        df_series = af.normalise_content(df_series, 'Series')
-        df_series.rename(columns={'score': 'seriesScore'}, inplace=True)
-
-        df_episodes = af.normalise_content(df_episodes, 'Episodes') # Columns: ... / averageRating / numVotes / score
-        episode_metric = af.calculate_episode_metric(df_episodes)   # Columns: parentTconst / score
-        runtime_metric = af.calculate_runtime_metric(df_episodes)   # Columns: parentTconst / totalRuntime
-        episode_metric.rename(columns={'score': 'episodeScore'}, inplace=True)
-
-        df_series = pd.merge(
-            left=df_series,
-            right=episode_metric,
-            left_on='tconst',
-            right_on='parentTconst'
-        )
-
-        df_series = pd.merge(
-            left=df_series,
-            right=runtime_metric,
-            on='parentTconst'
-        )
-
-        df_series.drop(columns='parentTconst', inplace=True)
-
-    with st.spinner('Loading user ratings...'):
-        # Load user ratings
-        df_user_ratings = get_user_ratings()
-
-    keys = ['all_titles', 'episodes', 'films', 'series', 'user_ratings']
-    values = [df_imdb_titles, df_imdb_episodes, df_films, df_series, df_user_ratings]
-
-    for k, v in zip(keys, values):
+    # Snapshot served by this process, swapped for a new one built in the background
+    # once the datasets change (see snapshot_manager.py)
+    dataset_version, tables = snapshot_manager.live()
+
+    if tables is None:
+
+        dataset_version = snapshots.dataset_version(DATA_DIR)
+
+        # Tables already built by another process of this host (see shared_tables.py)
+        with st.spinner('Attaching shared tables...'), stage('Attaching shared tables') as record:
+            tables = af.attach_shared_tables(dataset_version)
+            record['rows'] = len(tables['all_titles']) if tables is not None else 0
+
+    is_built = tables is not None
+
+    # Stages that do not depend on each other run at once: on a cold start, films, series
+    # and episodes are normalised while the user ratings are fetched (see dag.py)
+    results = af.load_session_data(dataset_version, DATA_DIR, ENGINE, tables)
+
+    tables = {
+        'all_titles': results['all_titles'],
+        'episodes': results['imdb_episodes'],
+        'episode_index': results['episode_index'],
+        'films': results['films'],
+        'series': results['series']
+    }
+
+    if not is_built:
+        with st.spinner('Sharing tables...'), stage('Publishing shared tables'):
+            af.publish_shared_tables(dataset_version, tables)
+
+    if snapshot_manager.live()[0] is None:
+        snapshot_manager.install(dataset_version, tables)
+
+    values = [dataset_version, tables['all_titles'], tables['episodes'], tables['episode_index'], tables['films'], tables['series'], results['user_ratings']]
+
+    for k, v in zip(SESSION_KEYS, values):
         if k not in st.session_state:
             st.session_state[k] = v
-    
+
     st.session_state['loaded_data'] = True
 
-df_films = st.session_state['films'].copy()
-df_films = df_films[
-    [
-        'tconst',
-        'titleType',
-        'primaryTitle',
-        'startYear',
-        'runtimeMinutes',
-        'averageRating',
-        'numVotes',
-        'filmScore'
-    ]
-]
-
-df_series = st.session_state['series'].copy()
-df_series = df_series[
-    [
-        'tconst',
-        'titleType',
-        'primaryTitle',
-        'startYear',
-        'endYear',
-        'averageRating',
-        'numVotes',
-        'seriesScore',
-        'episodeScore',
-        'totalRuntime'
-    ]
-]
+# A newer dataset version has been swapped in since this session loaded its data
+live_version = af.check_snapshots()
+if live_version is not None and live_version != st.session_state['dataset_version']:
+    st.info('New IMDB data is available (version {}).'.format(live_version))
+    if st.button('Load new data'):
+        for key in SESSION_KEYS + ['loaded_data']:
+            del st.session_state[key]
+        st.rerun()
 
 watched_tconst = st.session_state['user_ratings']['tconst'].copy()
 
+# Prefetch connections of the first watched titles searched (oldest first) in the background
+af.warm_caches('connections', watched_tconst[::-1].head(WARMER_TOP_N), 'connections')
+
+# Search
+
+st.header('Find a title')
+
+title_query = st.text_input(
+    label='Search titles by name',
+    placeholder='e.g. The Dark Knight'
+)
+
+if title_query:
+    df_found = af.search_titles(title_query, num_titles=10)
+    st.dataframe(df_found, use_container_width=True)
+
+    # Start "more like this" and connections from any title
+    if len(df_found) > 0:
+        af.display_more_like_this(df_found, watched_tconst, key='more_like_this_search')
+        af.display_title_connections(df_found, watched_tconst, key='title_connections_search')
+
+st.divider()
+
 # Films
 st.header('FILMS')
 
@@ -129,15 +111,6 @@ max_duration_film = st.number_input(
     step=0.5
 )
 
-if not show_watched_films:
-    df_films = df_films.loc[~(df_films['tconst'].isin(watched_tconst))]
-
-if max_duration_film is not None:
-    df_films = df_films.loc[df_films['runtimeMinutes'].str.isnumeric()]
-    df_films = df_films.loc[df_films['runtimeMinutes'].astype(int) <= max_duration_film*60]
-
-df_films.index = np.arange(1, 1+len(df_films))
-
 num_films = st.slider(
     label='Select number of films to display',
     min_value=5,
@@ -146,12 +119,30 @@ num_films = st.slider(
     step=5
 )
 
+film_facets = af.select_facets('films')
+
 # Save top 100 unwatched films
-df_films.loc[~(df_films['tconst'].isin(watched_tconst))].reset_index(drop=True)[:100].to_csv('Rankings/films_duration_{}_hours.csv'.format(max_duration_film))
+df_top_films = af.run_named_query(
+    'top_films',
+    show_watched=False,
+    max_minutes=max_duration_film*60,
+    num_titles=100
+)
+df_top_films.reset_index(drop=True).to_csv(os.path.join(RANKINGS_DIR, 'films_duration_{}_hours.csv'.format(max_duration_film)))
 
-df_films = df_films[:num_films]
+# Prefetch covers of the top unwatched films in the background
+af.warm_caches('cover', df_top_films['tconst'].head(WARMER_TOP_N), 'films')
+
+df_films = af.top_titles(
+    'films',
+    film_facets,
+    show_watched=show_watched_films,
+    max_minutes=max_duration_film*60,
+    num_titles=num_films
+)
 st.dataframe(df_films, use_container_width=True)
 af.display_covers(df_films)
+af.display_more_like_this(df_films, watched_tconst, key='more_like_this_films')
 
 
 # Series
@@ -176,18 +167,6 @@ max_duration_series = st.number_input(
 
 st.write('{} days = {} hours = {} minutes'.format(max_duration_series, max_duration_series*24, max_duration_series*24*60))
 
-if not show_watched_series:
-    df_series = df_series.loc[~(df_series['tconst'].isin(watched_tconst))]
-
-if not show_unfinished_series:
-    df_series = df_series.loc[df_series['endYear'] != '\\N']
-    df_series = df_series.loc[df_series['endYear'].astype(int) <= datetime.now().year]
-
-if max_duration_series is not None:
-    df_series = df_series.loc[df_series['totalRuntime'] <= max_duration_series*24*60]   # Days to minutes
-
-df_series.index = np.arange(1, 1+len(df_series))
-
 num_series = st.slider(
     label='Select number of series to display',
     min_value=5,
@@ -196,12 +175,126 @@ num_series = st.slider(
     step=5
 )
 
-# Save top 100 unwatched series
-df_series.loc[~(df_series['tconst'].isin(watched_tconst))].reset_index(drop=True)[:100].to_csv('Rankings/series_duration_{}_days.csv'.format(max_duration_series))
+series_facets = af.select_facets('series')
 
-df_series = df_series[:num_series]
+# Save top 100 unwatched series
+df_top_series = af.run_named_query(
+    'top_series',
+    show_watched=False,
+    show_unfinished=show_unfinished_series,
+    max_minutes=max_duration_series*24*60,     # Days to minutes
+    num_titles=100
+)
+df_top_series.reset_index(drop=True).to_csv(os.path.join(RANKINGS_DIR, 'series_duration_{}_days.csv'.format(max_duration_series)))
+
+# Prefetch covers of the top unwatched series in the background
+af.warm_caches('cover', df_top_series['tconst'].head(WARMER_TOP_N), 'series')
+
+df_series = af.top_titles(
+    'series',
+    series_facets,
+    show_watched=show_watched_series,
+    max_minutes=max_duration_series*24*60,
+    num_titles=num_series,
+    show_unfinished=show_unfinished_series
+)
 st.dataframe(df_series, use_container_width=True)
 af.display_covers(df_series, content_type='Series')
+af.display_more_like_this(df_series, watched_tconst, key='more_like_this_series')
+
+# Personalised ranking
+
+st.header('Recommended for you')
+
+show_personalised = st.toggle(
+    label='Show personalised ranking',
+    value=False
+)
+
+if show_personalised:
+
+    profile_weight = st.slider(
+        label='Weight of your ratings in the ranking',
+        min_value=0.0,
+        max_value=1.0,
+        value=0.5,
+        step=0.1
+    )
+
+    num_personalised = st.slider(
+        label='Select number of titles to display',
+        min_value=5,
+        max_value=20,
+        value=5,
+        step=5
+    )
+
+    if 'personalised_index' not in st.session_state:
+        with st.spinner('Learning your preferences...'):
+            st.session_state['personalised_index'] = af.build_personalised_index(
+                st.session_state['dataset_version'],
+                st.session_state['films'],
+                st.session_state['series']
+            )
+
+    import personalised
+
+    df_candidates, feature_matrix = st.session_state['personalised_index']
+    df_personalised = personalised.top_personalised(
+        df_candidates=df_candidates,
+        matrix=feature_matrix,
+        df_user_ratings=st.session_state['user_ratings'],
+        num_titles=num_personalised,
+        weight=profile_weight
+    )
+
+    st.dataframe(df_personalised, use_container_width=True)
+    af.display_covers(df_personalised)
+
+else:
+    st.divider()
+
+# Watch planner
+
+st.header('Plan your watching')
+
+show_planner = st.toggle(
+    label='Show watch planner',
+    value=False
+)
+
+if show_planner:
+
+    budget_hours = st.number_input(
+        label='Select the time you have (in hours)',
+        min_value=1,
+        value=40,
+        step=1
+    )
+
+    max_title_hours = st.number_input(
+        label='Select the maximum duration of a title (in hours)',
+        min_value=0.5,
+        value=10.0,
+        step=0.5
+    )
+
+    max_series = st.slider(
+        label='Select the maximum number of series',
+        min_value=0,
+        max_value=10,
+        value=2
+    )
+
+    finished_only = st.toggle(
+        label='Only finished series',
+        value=True
+    )
+
+    df_plan, plan_summary = af.plan_watching(budget_hours, max_title_hours, max_series, finished_only)
+
+    st.write('{titles} titles, {minutes} minutes, total score {score} (best possible at most {upper_bound})'.format(**plan_summary))
+    st.dataframe(df_plan, use_container_width=True)
 
 # Connections
 
@@ -214,41 +307,51 @@ show_connections = st.toggle(
 
 if show_connections:
 
+    # Asking for more titles resumes a stopped search
     num_connections = st.number_input(
         label='Select number of titles with connections to display.',
         min_value=5,
         max_value=50,
         value=None,
-        step=5
+        step=5,
+        on_change=lambda: st.session_state.update(connections_stopped=False)
     )
 
     if num_connections is not None:
-        cols = ['tconst', 'primaryTitle', 'titleType', 'startYear', 'endYear', 'runtimeMinutes', 'numVotes', 'averageRating', 'score']
 
-        df_connection_films = st.session_state['films'].copy()
-        df_connection_films.rename(columns={'filmScore': 'score'}, inplace=True)
-        df_connection_films['endYear'] = np.nan
-        df_connection_films = df_connection_films[cols]
+        import fetching_connections
 
-        df_connection_series = st.session_state['series'].copy()
-        df_connection_series.rename(columns={'seriesScore': 'score'}, inplace=True)
-        df_connection_series = df_connection_series[cols]
+        # Franchises found by previous runs are kept, so the search resumes from where it stopped
+        search = af.connections_search(st.session_state['dataset_version'], watched_tconst)
+        is_complete = len(search['franchises']) >= num_connections or search['finished']
 
-        df_ranked = pd.concat([df_connection_films, df_connection_series], ignore_index=True)
-        df_ranked = df_ranked.sort_values('score', ascending=False)
+        controls = st.empty()
+        if not is_complete and st.session_state.get('connections_stopped', False):
+            controls.button('Resume search', on_click=lambda: st.session_state.update(connections_stopped=False))
+        elif not is_complete:
+            # Any widget change stops the search (Streamlit reruns the script), this button too
+            controls.button('Stop searching', on_click=lambda: st.session_state.update(connections_stopped=True))
 
-        with st.spinner('Searching connections...'):
-            connections = get_ordered_connections(
-                all_content=st.session_state['all_titles'], 
-                max_num_titles=num_connections, 
-                seen_tconst=watched_tconst
-            )
+        table = st.empty()
+        table.dataframe(fetching_connections.connections_table(search['franchises'][:num_connections]), use_container_width=True)
 
-        st.dataframe(connections, use_container_width=True)
-        af.display_covers_connections(connections, watched_tconst)
+        for franchise in search['franchises'][:num_connections]:
+            af.display_covers_franchise(fetching_connections.connections_table([franchise]), watched_tconst)
 
-else:
-    st.divider()
+        # Show each franchise as soon as it is found
+        if not is_complete and not st.session_state.get('connections_stopped', False):
+            for franchise in af.search_connections(search, st.session_state['all_titles'], num_connections, watched_tconst):
+                table.dataframe(fetching_connections.connections_table(search['franchises']), use_container_width=True)
+                af.display_covers_franchise(fetching_connections.connections_table([franchise]), watched_tconst)
+            controls.empty()
+
+        connections = fetching_connections.connections_table(search['franchises'][:num_connections])
+        if len(connections) > 0:
+            connections.to_csv(os.path.join(RANKINGS_DIR, 'connections.csv'))
+        if search['finished'] and len(search['franchises']) < num_connections:
+            st.caption('No more watched titles with unwatched connections.')
+
+st.divider()
 
 # Unwatched episodes
 
@@ -268,13 +371,7 @@ if show_missed_episodes:
         # Because all_titles (IMDB titles) was merged with IMDB ratings,
         # you only get titles that have ratings. This is good because you 
         # avoid series which have been announced but not released yet.
-        missed_episodes = af.get_new_episodes(
-            titles=st.session_state['all_titles'],
-            episodes=st.session_state['episodes'],
-            df_user_ratings=st.session_state['user_ratings']
-        )
-
-    df_new_episodes = missed_episodes[0]
+        df_new_episodes = af.run_named_query('missed_episodes')
 
     st.dataframe(df_new_episodes, use_container_width=True)
 
@@ -282,19 +379,21 @@ if show_missed_episodes:
     for parent_tconst in df_new_episodes['parentTconst'].unique():
         df = df_new_episodes.loc[df_new_episodes['parentTconst'] == parent_tconst]
         st.subheader(df['parentTitle'].iloc[0])
-        for episode in df.values:
+        for episode in df.itertuples():
             st.write(
                 'S{}E{} - {} ({})'.format(
-                    episode[3],
-                    episode[4],
-                    episode[6],
-                    episode[7]
+                    episode.seasonNumber,
+                    episode.episodeNumber,
+                    episode.primaryTitle,
+                    episode.startYear
                 )
             )
             
     # af.display_covers_unwatched_episodes(df_new_episodes)
 
     # st.header('Other special episodes')
-    # df_strange_episodes = missed_episodes[1]
+    # df_strange_episodes = af.get_new_episodes(st.session_state['episode_index'], st.session_state['user_ratings'])[1]
     # st.dataframe(df_strange_episodes, use_container_width=True)
-    # af.display_covers_unwatched_episodes(df_strange_episodes)
\ No newline at end of file
+    # af.display_covers_unwatched_episodes(df_strange_episodes)
+
+af.display_instrumentation_panel()
@@ -0,0 +1,374 @@
+# Command-line interface of WatchNext: computes the same rankings as the
+# Streamlit app (watch_next.py) without starting Streamlit, e.g. for cron jobs.
+#
+# Examples:
+#   python watch_next_cli.py films --max-hours 2 --top 20
+#   python watch_next_cli.py --format csv --output series.csv series --max-days 5
+#   python watch_next_cli.py --ratings-csv df_user_ratings.csv episodes
+#   python watch_next_cli.py similar tt0111161 --top 10
+#   python watch_next_cli.py search "dark knight" --top 10
+#   python watch_next_cli.py query top_films --param show_watched=false --param max_minutes=120 --param num_titles=10
+#   python watch_next_cli.py query "SELECT primaryTitle, seriesScore FROM series WHERE startYear BETWEEN 1990 AND 1999 ORDER BY seriesScoreRaw DESC LIMIT 10"
+#   python watch_next_cli.py --timings precompute --output-dir Rankings
+#
+# Options of every command (--data-dir, --user, --ratings-csv, --format, --output,
+# --engine, --timings, --metrics) go before the command.
+import argparse
+import json
+import os
+import sys
+
+from contextlib import contextmanager, redirect_stdout
+
+import pandas as pd
+
+import pipeline
+import planner
+import ratings_store
+import shared_tables
+import similar_titles
+import snapshot_manager
+import snapshots
+import telemetry
+import title_search
+from config import DATA_DIR, ENGINE, IMDB_USER_ID, LOG_DIR, RANKINGS_DIR, RATINGS_EXPORTS_DIR
+from instrumentation import stage
+
+
+@contextmanager
+def timed(name, enabled):
+
+    '''
+    Record a stage (see instrumentation.py) and print its timings to stderr
+    (stdout is kept for the results).
+    '''
+
+    with stage(name) as record:
+        yield record
+
+    if enabled:
+        print('{}: {:.2f}s wall, {:.2f}s CPU, peak RSS +{} MB'.format(
+            name, record['wall_seconds'], record['cpu_seconds'], record['peak_rss_delta_mb']
+        ), file=sys.stderr)
+
+
+def load_score_tables(data_dir, engine=ENGINE):
+
+    '''
+    Load the score tables of the current dataset version: map them if another
+    process has published them, otherwise load them from the snapshot, computing
+    and saving them first if needed.
+    '''
+
+    version = snapshots.dataset_version(data_dir)
+
+    return version, snapshot_manager.load_tables(version, data_dir, engine)
+
+
+def load_similar_titles_index(tables, version):
+
+    '''
+    Load the "more like this" index of the snapshot, building and saving it first if needed.
+    '''
+
+    index = similar_titles.load_index(version)
+
+    if index is None:
+        df_candidates = pipeline.candidate_titles(tables['films'], tables['series'])
+        index = similar_titles.build_index(df_candidates)
+        similar_titles.save_index(index, version)
+
+    return index
+
+
+def load_title_search_index(tables, version):
+
+    '''
+    Load the title search index of the snapshot, building and saving it first if needed.
+    '''
+
+    index = title_search.load_index(version)
+
+    if index is None:
+        index = title_search.build_index(tables['all_titles'])
+        title_search.save_index(index, version)
+
+    return index
+
+
+def connect_score_tables(tables, version):
+
+    '''
+    SQL connection to the tables of the snapshot, exporting them first if needed.
+    '''
+
+    # DuckDB is only needed for SQL queries
+    import queries
+
+    if not queries.has_tables(version):
+        queries.export_tables(tables, version)
+
+    return queries.connect(version)
+
+
+def parse_param(text):
+
+    '''
+    Parse a --param name=value (values are JSON when possible: 120, 8.5, true, null).
+    '''
+
+    name, _, value = text.partition('=')
+
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def run_query(tables, version, df_user_ratings, args):
+
+    import queries
+
+    connection = connect_score_tables(tables, version)
+    params = dict(parse_param(param) for param in args.param)
+    sql = queries.QUERIES.get(args.query, args.query)    # A named query or SQL
+
+    return queries.run_query(connection, sql, params, df_user_ratings)
+
+
+def load_user_ratings(args):
+
+    '''
+    Read ratings from a CSV (tconst, userRating, dateRating, or an IMDB export) or scrape them from IMDB.
+    '''
+
+    if args.ratings_csv is not None:
+        # An IMDB export file, or ratings already in the columns of the app
+        if ratings_store.is_export(args.ratings_csv):
+            return ratings_store.read_export(args.ratings_csv)[['tconst', 'userRating', 'dateRating']]
+        df_user_ratings = pd.read_csv(args.ratings_csv)
+        return df_user_ratings[['tconst', 'userRating', 'dateRating']]
+
+    # Only needed when scraping
+    from fetching_ratings import get_user_ratings
+
+    return get_user_ratings(args.user)
+
+
+def import_ratings(args):
+
+    '''
+    Import IMDB export files (the new ones of the exports folder if none are given)
+    into the ratings store, and return the ratings it holds per user.
+    '''
+
+    if args.paths:
+        ratings_store.import_exports(args.paths)
+    else:
+        ratings_store.import_folder(args.folder)
+
+    return ratings_store.summary()
+
+
+def write_output(df, fmt, output=None):
+
+    if fmt == 'json':
+        text = df.to_json(orient='records', indent=2)
+    else:
+        text = df.to_csv(index=False)
+
+    if output is None:
+        sys.stdout.write(text + '\n')
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
+
+
+def top_films(tables, watched_tconst, args):
+    return pipeline.filter_films(tables['films'], watched_tconst, args.show_watched, args.max_hours, num_titles=args.top)
+
+
+def top_series(tables, watched_tconst, args):
+    return pipeline.filter_series(tables['series'], watched_tconst, args.show_watched, args.show_ongoing, args.max_days, num_titles=args.top)
+
+
+def missed_episodes(tables, df_user_ratings):
+    df_new_episodes, _ = pipeline.get_new_episodes(tables['episode_index'], df_user_ratings)
+    return df_new_episodes.drop(columns='index')
+
+
+def ordered_connections(tables, watched_tconst, args):
+
+    # Only needed for connections (web-scraping)
+    from fetching_connections import get_ordered_connections
+
+    return get_ordered_connections(tables['all_titles'], args.num_titles, watched_tconst)
+
+
+def more_like_this(tables, version, watched_tconst, args):
+
+    index = load_similar_titles_index(tables, version)
+    df_similar = similar_titles.more_like_this(index, args.tconst, args.top, exclude_tconsts=watched_tconst, df_titles=tables['all_titles'])
+    df_candidates = pipeline.candidate_titles(tables['films'], tables['series'])
+
+    return df_similar.merge(df_candidates.drop(columns='genres'), on='tconst')
+
+
+def search_titles(tables, version, args):
+
+    index = load_title_search_index(tables, version)
+
+    return title_search.search_titles(index, tables['all_titles'], args.query, args.top)
+
+
+def plan_watching(tables, watched_tconst, args):
+
+    df_candidates = planner.plan_candidates(
+        tables['films'], tables['series'], watched_tconst,
+        max_title_minutes=args.max_title_hours*60 if args.max_title_hours is not None else None,
+        finished_only=args.finished_only
+    )
+    df_plan, summary = planner.plan(df_candidates, args.hours*60, args.max_series)
+    print('Plan: {titles} titles, {minutes} minutes, total score {score} (upper bound {upper_bound})'.format(**summary))
+
+    return df_plan
+
+
+def precompute(tables, version, watched_tconst, df_user_ratings, args):
+
+    '''
+    Build the indexes, SQL and shared tables of the snapshot and write the default rankings of the app
+    (top 100 unwatched) to output_dir.
+    '''
+
+    load_similar_titles_index(tables, version)
+    load_title_search_index(tables, version)
+    connect_score_tables(tables, version)
+    if not shared_tables.is_published(version):
+        shared_tables.publish(tables, version)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    extension = 'json' if args.format == 'json' else 'csv'
+
+    df_films = pipeline.filter_films(tables['films'], watched_tconst, max_duration_hours=args.max_hours, num_titles=100)
+    df_series = pipeline.filter_series(tables['series'], watched_tconst, max_duration_days=args.max_days, num_titles=100)
+
+    rankings = {
+        'films_duration_{}_hours'.format(args.max_hours): df_films,
+        'series_duration_{}_days'.format(args.max_days): df_series,
+        'missed_episodes': missed_episodes(tables, df_user_ratings)
+    }
+
+    for name, df in rankings.items():
+        write_output(df, args.format, os.path.join(args.output_dir, '{}.{}'.format(name, extension)))
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='WatchNext rankings without the Streamlit app.')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='local folder with the IMDB .tsv.gz datasets (default: download)')
+    parser.add_argument('--user', default=IMDB_USER_ID, help='IMDB user id whose ratings are scraped')
+    parser.add_argument('--ratings-csv', default=None, help='CSV with tconst, userRating and dateRating instead of scraping')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--output', default=None, help='file to write the results to (default: stdout)')
+    parser.add_argument('--engine', choices=['pandas', 'polars'], default=ENGINE, help='engine of the scoring pipeline')
+    parser.add_argument('--timings', action='store_true', help='print the time taken by each stage to stderr')
+    parser.add_argument('--metrics', default=os.path.join(LOG_DIR, 'watchnext_cli.prom'),
+                        help='file the requests and cache metrics are written to, in the Prometheus text format')
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    films = subparsers.add_parser('films', help='top unwatched films')
+    films.add_argument('--max-hours', type=float, default=2.0)
+    films.add_argument('--show-watched', action='store_true')
+    films.add_argument('--top', type=int, default=20)
+
+    series = subparsers.add_parser('series', help='top unwatched series')
+    series.add_argument('--max-days', type=int, default=5)
+    series.add_argument('--show-watched', action='store_true')
+    series.add_argument('--show-ongoing', action='store_true')
+    series.add_argument('--top', type=int, default=20)
+
+    subparsers.add_parser('episodes', help='episodes released after the series was rated')
+
+    connections = subparsers.add_parser('connections', help='unwatched prequels and sequels of watched titles')
+    connections.add_argument('--num-titles', type=int, default=5)
+
+    similar = subparsers.add_parser('similar', help='unwatched titles most similar to a title')
+    similar.add_argument('tconst')
+    similar.add_argument('--top', type=int, default=10)
+
+    search = subparsers.add_parser('search', help='titles by name (prefix, then similar names), most voted first')
+    search.add_argument('query')
+    search.add_argument('--top', type=int, default=10)
+
+    query = subparsers.add_parser('query', help='run a named query (see queries.QUERIES) or SQL on the films, series and episodes tables')
+    query.add_argument('query', help='name of the query or SQL, with $name parameters')
+    query.add_argument('--param', action='append', default=[], help='name=value of a parameter (repeatable)')
+
+    plan = subparsers.add_parser('plan', help='unwatched films and series with the highest total score in a time budget')
+    plan.add_argument('--hours', type=float, default=40.0, help='time budget')
+    plan.add_argument('--max-title-hours', type=float, default=None, help='maximum duration of a title')
+    plan.add_argument('--max-series', type=int, default=None, help='maximum number of series (default: no limit)')
+    plan.add_argument('--finished-only', action='store_true', help='only series that have ended')
+
+    import_parser = subparsers.add_parser('import-ratings', help='import IMDB ratings export files (user id taken from their names, e.g. ur103598244.csv)')
+    import_parser.add_argument('paths', nargs='*', help='export files (default: the new files of --folder)')
+    import_parser.add_argument('--folder', default=RATINGS_EXPORTS_DIR)
+
+    precompute_parser = subparsers.add_parser('precompute', help='build the snapshot and write the default rankings to a folder')
+    precompute_parser.add_argument('--output-dir', default=RANKINGS_DIR)
+    precompute_parser.add_argument('--max-hours', type=float, default=2.0)
+    precompute_parser.add_argument('--max-days', type=int, default=5)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    # Only needs the ratings store
+    if args.command == 'import-ratings':
+        write_output(import_ratings(args), args.format, args.output)
+        return
+
+    # Progress messages of the pipeline go to stderr so that stdout only has the results
+    with redirect_stdout(sys.stderr):
+
+        with timed('Loading score tables', args.timings):
+            version, tables = load_score_tables(args.data_dir, args.engine)
+
+        with timed('Loading user ratings', args.timings):
+            df_user_ratings = load_user_ratings(args)
+            watched_tconst = df_user_ratings['tconst']
+
+        with timed('Computing {}'.format(args.command), args.timings):
+            if args.command == 'films':
+                result = top_films(tables, watched_tconst, args)
+            elif args.command == 'series':
+                result = top_series(tables, watched_tconst, args)
+            elif args.command == 'episodes':
+                result = missed_episodes(tables, df_user_ratings)
+            elif args.command == 'connections':
+                result = ordered_connections(tables, watched_tconst, args)
+            elif args.command == 'similar':
+                result = more_like_this(tables, version, watched_tconst, args)
+            elif args.command == 'search':
+                result = search_titles(tables, version, args)
+            elif args.command == 'plan':
+                result = plan_watching(tables, watched_tconst, args)
+            elif args.command == 'query':
+                result = run_query(tables, version, df_user_ratings, args)
+            else:
+                precompute(tables, version, watched_tconst, df_user_ratings, args)
+                result = None
+
+    telemetry.write_metrics(args.metrics)
+
+    if result is not None:
+        write_output(result, args.format, args.output)
+
+
+if __name__ == '__main__':
+    main()